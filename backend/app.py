@@ -3,6 +3,7 @@ PPT设计大师 后端 - Flask 应用入口
 """
 import os
 import logging
+import threading
 from flask import Flask
 from flask_cors import CORS
 from config import Config
@@ -30,15 +31,48 @@ def create_app():
     # 注册蓝图
     from controllers.batch_controller import batch_bp
     from controllers.export_controller import export_bp
+    from controllers.image_controller import image_bp
+    from controllers.template_controller import template_bp
 
     app.register_blueprint(batch_bp, url_prefix='/api/batch')
     app.register_blueprint(export_bp, url_prefix='/api/export')
+    app.register_blueprint(image_bp, url_prefix='/api/images')
+    app.register_blueprint(template_bp, url_prefix='/api/templates')
+
+    # 预热上游连接（后台执行，不阻塞启动）
+    if Config.HTTP_WARMUP:
+        from services.http_client import get_http_pool
+        threading.Thread(target=get_http_pool().warm_up, name="http_warmup", daemon=True).start()
 
     # 健康检查端点
     @app.route('/health')
     def health():
         return {'status': 'ok', 'service': 'ppt-designer-backend'}
 
+    # 运行指标
+    @app.route('/metrics')
+    def metrics():
+        from services.http_client import get_http_pool
+        from services.cache import get_description_cache, get_image_cache
+        from services.blob_store import get_blob_store
+        from services.template_registry import get_template_registry
+        from services.concurrency import get_limiter_stats
+        from services.task_manager import get_task_manager
+        from services.event_bus import get_event_bus
+        description_cache = get_description_cache()
+        image_cache = get_image_cache()
+        return {
+            'http_pool': get_http_pool().stats(),
+            'concurrency': get_limiter_stats(),
+            'description_cache': description_cache.to_dict() if description_cache else None,
+            'image_cache': image_cache.to_dict() if image_cache else None,
+            'blob_store': get_blob_store().to_dict(),
+            'templates': get_template_registry().to_dict(),
+            'scheduler': get_task_manager().scheduler_stats(),
+            'event_bus': get_event_bus().to_dict(),
+            'task_store': get_task_manager().store_stats()
+        }
+
     # 根路由
     @app.route('/')
     def index():
@@ -47,8 +81,11 @@ def create_app():
             'version': '1.0.0',
             'endpoints': {
                 'health': '/health',
+                'metrics': '/metrics',
                 'batch': '/api/batch/*',
-                'export': '/api/export/*'
+                'export': '/api/export/*',
+                'images': '/api/images/<image_id>',
+                'templates': '/api/templates'
             }
         }
 
@@ -0,0 +1,105 @@
+"""
+页面序列化基准测试
+对比原先基于 dataclasses.asdict 的 ScriptPage 与当前 __slots__ + 手写 to_dict 的实现：
+每页序列化耗时、200 页任务的 to_dict 耗时以及每个页面对象的内存占用
+
+用法（在 backend 目录下）:
+    python benchmarks/bench_serialization.py [--pages 200] [--repeat 5]
+"""
+import os
+import sys
+import uuid
+import timeit
+import argparse
+import tracemalloc
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.file_parser import ScriptPage, PageStatus  # noqa: E402
+from services.task_manager import BatchTask  # noqa: E402
+
+
+@dataclass
+class LegacyScriptPage:
+    """优化前的 ScriptPage：普通 dataclass，to_dict 经过 asdict"""
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    index: int = 0
+    shot_number: str = ""
+    segment: str = ""
+    narration: str = ""
+    visual_hint: str = ""
+    description: str = ""
+    image_path: str = ""
+    status: PageStatus = PageStatus.PENDING
+    error_message: str = ""
+    attempts: int = 0
+    completed_phase: str = ""
+    version: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data['status'] = self.status.value
+        return data
+
+
+def make_pages(cls, count: int) -> List[Any]:
+    narration = "大家好，今天我们来学习如何设计一份清晰的演示文稿。" * 4
+    description = "【页面标题】演示文稿设计\n【主体内容】三个要点，左文右图。" * 6
+    return [
+        cls(index=i, shot_number=str(i + 1), segment="正文", narration=narration,
+            description=description, status=PageStatus.COMPLETED, completed_phase="description")
+        for i in range(count)
+    ]
+
+
+def time_per_call(func: Callable[[], Any], repeat: int, number: int) -> float:
+    """最快一轮的单次耗时（微秒）"""
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1e6
+
+
+def bytes_per_page(cls, count: int) -> float:
+    """创建 count 个页面对象（不含共享的字符串内容）平均占用的内存"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    pages = make_pages(cls, count)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del pages
+    return size / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=200, help='任务页数')
+    parser.add_argument('--repeat', type=int, default=5, help='重复轮数')
+    args = parser.parse_args()
+
+    legacy_pages = make_pages(LegacyScriptPage, args.pages)
+    pages = make_pages(ScriptPage, args.pages)
+    task = BatchTask(name="bench", pages=pages, total_pages=len(pages))
+
+    # 确认两种实现输出一致
+    assert legacy_pages[0].to_dict().keys() == pages[0].to_dict().keys()
+
+    rows = [
+        ("单页 to_dict (us)",
+         time_per_call(legacy_pages[0].to_dict, args.repeat, 20000),
+         time_per_call(pages[0].to_dict, args.repeat, 20000)),
+        (f"{args.pages} 页任务 to_dict (us)",
+         time_per_call(lambda: [p.to_dict() for p in legacy_pages], args.repeat, 100),
+         time_per_call(task.to_dict, args.repeat, 100)),
+        ("每页内存 (bytes)",
+         bytes_per_page(LegacyScriptPage, 10000),
+         bytes_per_page(ScriptPage, 10000)),
+    ]
+
+    print(f"{'指标':<24}{'asdict':>12}{'当前实现':>12}{'提升':>10}")
+    for name, before, after in rows:
+        print(f"{name:<24}{before:>12.2f}{after:>12.2f}{before / after:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,14 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# 后端目录：缓存、图片存储、模板库和任务数据库的相对路径以此为基准，与启动时的工作目录无关
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _backend_path(name: str, default: str) -> str:
+    """读取路径配置，相对路径按后端目录解析为绝对路径"""
+    return os.path.join(BASE_DIR, os.getenv(name, default))
+
 
 class Config:
     """应用配置"""
@@ -44,9 +52,103 @@ class Config:
     MAX_DESCRIPTION_WORKERS = int(os.getenv('MAX_DESCRIPTION_WORKERS', 5))
     MAX_IMAGE_WORKERS = int(os.getenv('MAX_IMAGE_WORKERS', 4))
 
+    # 自适应并发（AIMD）：根据上游 429/503 与延迟在 [1, 上限] 之间调整并发
+    ADAPTIVE_CONCURRENCY_ENABLED = os.getenv('ADAPTIVE_CONCURRENCY_ENABLED', 'true').lower() == 'true'
+    ADAPTIVE_MAX_TEXT_CONCURRENCY = int(os.getenv('ADAPTIVE_MAX_TEXT_CONCURRENCY', MAX_DESCRIPTION_WORKERS * 3))
+    ADAPTIVE_MAX_IMAGE_CONCURRENCY = int(os.getenv('ADAPTIVE_MAX_IMAGE_CONCURRENCY', MAX_IMAGE_WORKERS * 3))
+    ADAPTIVE_TEXT_LATENCY_TARGET = float(os.getenv('ADAPTIVE_TEXT_LATENCY_TARGET', 30))  # 秒
+    ADAPTIVE_IMAGE_LATENCY_TARGET = float(os.getenv('ADAPTIVE_IMAGE_LATENCY_TARGET', 120))  # 秒
+    ADAPTIVE_DECREASE_FACTOR = float(os.getenv('ADAPTIVE_DECREASE_FACTOR', 0.5))
+    ADAPTIVE_DECREASE_COOLDOWN = float(os.getenv('ADAPTIVE_DECREASE_COOLDOWN', 2))  # 秒
+
+    # 调用通道：单页交互接口与批量生成任务隔离，批量任务不能占用交互预留的并发名额
+    INTERACTIVE_RESERVED_SHARE = float(os.getenv('INTERACTIVE_RESERVED_SHARE', 0.25))  # 预留给交互请求的并发比例
+    INTERACTIVE_RATE_LIMIT = float(os.getenv('INTERACTIVE_RATE_LIMIT', 0))  # 每分钟请求数，0 表示不限
+    BATCH_RATE_LIMIT = float(os.getenv('BATCH_RATE_LIMIT', 0))  # 每分钟请求数，0 表示不限
+
+    # 上游重试：5xx/429/超时按带抖动的指数退避重试，受单次调用总时间预算限制
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 4))
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 1))  # 秒
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 30))  # 秒
+    RETRY_TEXT_BUDGET = float(os.getenv('RETRY_TEXT_BUDGET', 300))  # 秒
+    RETRY_IMAGE_BUDGET = float(os.getenv('RETRY_IMAGE_BUDGET', 900))  # 秒
+
+    # 生成引擎：thread（线程池，默认）或 asyncio（单事件循环 + 信号量）
+    GENERATION_ENGINE = os.getenv('GENERATION_ENGINE', 'thread').lower()
+    ASYNC_MAX_DESCRIPTION_CONCURRENCY = int(os.getenv('ASYNC_MAX_DESCRIPTION_CONCURRENCY', 64))
+    ASYNC_MAX_IMAGE_CONCURRENCY = int(os.getenv('ASYNC_MAX_IMAGE_CONCURRENCY', 64))
+    ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', 128))
+
+    # 阶段调度：staged（全部描述完成后再生成图片，默认）或 pipelined（每页描述完成即生成图片）
+    GENERATION_MODE = os.getenv('GENERATION_MODE', 'staged').lower()
+    # 流水线模式下等待生成图片的页面上限，超过时暂停提交新的描述
+    PIPELINE_IMAGE_QUEUE_SIZE = int(os.getenv('PIPELINE_IMAGE_QUEUE_SIZE', MAX_IMAGE_WORKERS * 2))
+
+    # 描述流式生成：批量任务用 streamGenerateContent 边生成边写入页面描述
+    DESCRIPTION_STREAMING = os.getenv('DESCRIPTION_STREAMING', 'true').lower() == 'true'
+    STREAM_PARTIAL_INTERVAL = float(os.getenv('STREAM_PARTIAL_INTERVAL', 0.5))  # 部分描述推送的最小间隔（秒）
+
+    # 多页描述：把多个页面打包进一次请求，摊薄提示词、模板图片等固定开销（可在启动生成时单独指定）
+    DESCRIPTION_BATCH_ENABLED = os.getenv('DESCRIPTION_BATCH_ENABLED', 'false').lower() == 'true'
+    DESCRIPTION_BATCH_TOKEN_BUDGET = int(os.getenv('DESCRIPTION_BATCH_TOKEN_BUDGET', 6000))  # 每次请求的讲稿 token 预算（估算）
+    DESCRIPTION_BATCH_MAX_PAGES = int(os.getenv('DESCRIPTION_BATCH_MAX_PAGES', 8))  # 每次请求最多页数
+    DESCRIPTION_BATCH_TIMEOUT = float(os.getenv('DESCRIPTION_BATCH_TIMEOUT', 300))  # 单次请求超时（秒）
+
+    # 脚本解析：长脚本按自然边界切块并发调用 AI 解析
+    PARSE_CHUNK_CHARS = int(os.getenv('PARSE_CHUNK_CHARS', 4000))  # 单块最大字符数
+    PARSE_CHUNK_OVERLAP_LINES = int(os.getenv('PARSE_CHUNK_OVERLAP_LINES', 2))  # 相邻块重叠行数
+    PARSE_MAX_WORKERS = int(os.getenv('PARSE_MAX_WORKERS', 4))  # 并发解析的块数
+    PARSE_CHUNK_TIMEOUT = float(os.getenv('PARSE_CHUNK_TIMEOUT', 120))  # 单块请求超时（秒）
+
+    # 多任务公平调度
+    MAX_CONCURRENT_TASKS = int(os.getenv('MAX_CONCURRENT_TASKS', 16))  # 同时执行生成流程的任务数，超出的排队
+    SCHEDULER_TASK_WINDOW = int(os.getenv('SCHEDULER_TASK_WINDOW', 0))  # 单个任务最大在途页面数，0 表示不限
+
+    # 上游连接池（按 origin 共享长连接）
+    HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'false').lower() == 'true'  # 需要安装 h2
+    HTTP_POOL_HEADROOM = int(os.getenv('HTTP_POOL_HEADROOM', 4))  # 单页交互请求预留连接数
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 10))
+    HTTP_WARMUP = os.getenv('HTTP_WARMUP', 'true').lower() == 'true'
+    HTTP_WARMUP_CONNECTIONS = int(os.getenv('HTTP_WARMUP_CONNECTIONS', 2))
+
     # 文件上传
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB
+    # Word 文件解压后 document.xml 的大小上限，防止压缩炸弹
+    DOCX_MAX_XML_BYTES = int(os.getenv('DOCX_MAX_XML_BYTES', 256 * 1024 * 1024))
 
     # 输出目录
     OUTPUT_FOLDER = os.getenv('OUTPUT_FOLDER', 'outputs')
+
+    # 生成结果缓存
+    CACHE_FOLDER = _backend_path('CACHE_FOLDER', 'cache')
+    DESCRIPTION_CACHE_ENABLED = os.getenv('DESCRIPTION_CACHE_ENABLED', 'true').lower() == 'true'
+    DESCRIPTION_CACHE_TTL = float(os.getenv('DESCRIPTION_CACHE_TTL', 7 * 24 * 3600))  # 秒，<=0 表示不过期
+    DESCRIPTION_CACHE_MEMORY_ENTRIES = int(os.getenv('DESCRIPTION_CACHE_MEMORY_ENTRIES', 1024))
+    DESCRIPTION_CACHE_DISK_MB = int(os.getenv('DESCRIPTION_CACHE_DISK_MB', 256))
+    IMAGE_CACHE_ENABLED = os.getenv('IMAGE_CACHE_ENABLED', 'true').lower() == 'true'
+    IMAGE_CACHE_DISK_MB = int(os.getenv('IMAGE_CACHE_DISK_MB', 2048))
+
+    # 图片存储：按内容寻址保存生成的图片，接口返回图片 ID 和 URL 而不是 base64
+    BLOB_STORE_FOLDER = _backend_path('BLOB_STORE_FOLDER', 'blobs')
+    BLOB_STORE_MAX_MB = int(os.getenv('BLOB_STORE_MAX_MB', 4096))
+    # 最近写入或读取过的图片至少保留的时间（秒），期间即使超出容量也不淘汰，避免客户端持有的图片 ID 失效
+    BLOB_STORE_MIN_RETENTION = float(os.getenv('BLOB_STORE_MIN_RETENTION', 24 * 3600))
+    # 单图接口默认的返回格式：base64（data URL）或 url（图片 ID + URL），可按请求指定 response_format
+    IMAGE_RESPONSE_FORMAT = os.getenv('IMAGE_RESPONSE_FORMAT', 'base64').lower()
+
+    # 模板库：模板图片上传一次得到 template_id，单页接口只传模板 ID 而不是每次重发 template_base64
+    TEMPLATE_FOLDER = _backend_path('TEMPLATE_FOLDER', 'data/templates')
+    TEMPLATE_STORE_MAX_MB = int(os.getenv('TEMPLATE_STORE_MAX_MB', 512))
+    TEMPLATE_MEMORY_MB = int(os.getenv('TEMPLATE_MEMORY_MB', 64))  # 内存中保留的模板 base64 总量
+
+    # 任务持久化：sqlite（重启后可恢复任务）或 memory（仅保存在内存）
+    TASK_STORE = os.getenv('TASK_STORE', 'sqlite').lower()
+    TASK_DB_PATH = _backend_path('TASK_DB_PATH', 'data/tasks.db')
+    TASK_STORE_FLUSH_INTERVAL = float(os.getenv('TASK_STORE_FLUSH_INTERVAL', 0.5))  # 页面更新批量写入间隔（秒）
+    TASK_STORE_FLUSH_BATCH = int(os.getenv('TASK_STORE_FLUSH_BATCH', 200))
+
+    # 任务进度推送（SSE）
+    SSE_HEARTBEAT_INTERVAL = float(os.getenv('SSE_HEARTBEAT_INTERVAL', 15))  # 心跳间隔（秒）
+    SSE_BUFFER_SIZE = int(os.getenv('SSE_BUFFER_SIZE', 1024))  # 每个任务保留的事件数，用于断线重连补发
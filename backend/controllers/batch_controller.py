@@ -4,17 +4,25 @@
 """
 import os
 import io
+import asyncio
+import mimetypes
 import base64
 import logging
-import threading
-from flask import Blueprint, request, current_app, send_file
+from datetime import datetime
+from flask import Blueprint, Response, request, current_app, send_file, stream_with_context, url_for
 from werkzeug.utils import secure_filename
 
 from config import Config
 from utils.response import success_response, error_response, created_response
+from utils.json_codec import get_json_body, dumps as json_dumps
 from services.file_parser import FileParser, ScriptPage
 from services.task_manager import get_task_manager, TaskStatus
 from services.ai_service import get_ai_service
+from services.async_ai_service import get_async_ai_service
+from services.event_bus import get_event_bus
+from services.cache import split_data_url
+from services.blob_store import get_blob_store
+from services.template_registry import get_template_registry
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +31,11 @@ batch_bp = Blueprint('batch', __name__)
 # 允许的文件扩展名
 ALLOWED_EXTENSIONS = {'.xlsx', '.xls', '.txt', '.md', '.json', '.docx'}
 
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# 单图接口的返回格式：base64 返回 data URL，url 返回图片 ID 和图片地址
+IMAGE_RESPONSE_FORMATS = ('base64', 'url')
+
 
 def allowed_file(filename: str) -> bool:
     """检查文件扩展名是否允许"""
@@ -35,7 +48,7 @@ def upload_script():
     上传脚本文件并解析
 
     Returns:
-        解析后的页面列表
+        解析后的页面列表，以及解析方式 parse_method（structured：按表头/字段/镜头标记直接解析；ai：AI 解析）
     """
     if 'file' not in request.files:
         return error_response("没有上传文件", 400)
@@ -70,12 +83,13 @@ def upload_script():
         file.save(upload_path)
         logger.info(f"文件上传成功: {upload_path}")
 
-        # 解析文件
-        pages = FileParser.parse_file(upload_path)
+        # 解析文件（结构明确时不调用 AI）
+        pages, parse_method = FileParser.parse(upload_path)
 
         return success_response({
             'filename': filename,
             'total_pages': len(pages),
+            'parse_method': parse_method,
             'pages': [p.to_dict() for p in pages]
         }, "文件解析成功")
 
@@ -95,7 +109,7 @@ def create_task():
             "pages": [ScriptPage 列表]
         }
     """
-    data = request.get_json()
+    data = get_json_body()
     if not data:
         return error_response("请求数据为空", 400)
 
@@ -138,8 +152,20 @@ def start_generation(task_id: str):
     """
     开始生成（描述 + 图片）
 
+    已完成的页面阶段会被跳过：出错、取消或进程中断后再次调用只生成剩余页面
+
     Args:
         task_id: 任务 ID
+
+    Request body（可选）:
+        {
+            "custom_prompt": "描述提示词（可选，省略时沿用上次启动时的提示词）",
+            "image_prompt": "图片提示词（可选，提供后描述完成的页面继续生成图片）",
+            "force": false,  // true 时重新生成 page_ids 指定的页面（省略 page_ids 表示全部页面）
+            "page_ids": ["页面ID", ...],
+            "priority": 1,  // 可选，1-10，多个任务同时生成时优先级高的任务获得更多并发
+            "batch_descriptions": false  // 可选，true 时一次请求生成多页描述（默认取 DESCRIPTION_BATCH_ENABLED）
+        }
     """
     task_manager = get_task_manager()
     task = task_manager.get_task(task_id)
@@ -147,52 +173,265 @@ def start_generation(task_id: str):
     if not task:
         return error_response("任务不存在", 404)
 
-    if task.status not in [TaskStatus.PENDING, TaskStatus.ERROR]:
+    data = get_json_body(silent=True) or {}
+    force = bool(data.get('force', False))
+    page_ids = data.get('page_ids')
+
+    # 生成中但不在本进程执行的任务是被重启中断的，允许恢复
+    interrupted = task.status in [TaskStatus.GENERATING_DESCRIPTIONS, TaskStatus.GENERATING_IMAGES] \
+        and not task_manager.is_running(task_id)
+    startable = task.status in [TaskStatus.PENDING, TaskStatus.ERROR, TaskStatus.CANCELLED] \
+        or interrupted or (force and task.status == TaskStatus.COMPLETED)
+    if not startable:
         return error_response(f"任务状态不允许启动: {task.status.value}", 400)
 
-    # 在后台线程中执行生成
-    def run_generation():
-        ai_service = get_ai_service()
+    options = {k: data[k] for k in ('custom_prompt', 'image_prompt') if data.get(k)}
+    if data.get('priority') is not None:
+        try:
+            options['priority'] = min(max(int(data['priority']), 1), 10)
+        except (TypeError, ValueError):
+            return error_response("priority 必须是 1-10 的整数", 400)
+    if data.get('batch_descriptions') is not None:
+        options['batch_descriptions'] = bool(data['batch_descriptions'])
 
-        # 生成描述
-        def generate_description(page: ScriptPage) -> str:
-            return ai_service.generate_page_description(
-                shot_number=page.shot_number,
-                segment=page.segment,
-                narration=page.narration,
-                visual_hint=page.visual_hint
-            )
+    if not task_manager.begin_run(task_id):
+        return error_response("任务正在生成中", 400)
 
-        task_manager.run_descriptions_generation(task_id, generate_description)
+    # 从占用运行标记到交给后台线程之间出错时释放标记，否则任务会一直被视为生成中
+    try:
+        if options:
+            task.options.update(options)
+            task_manager.save_task(task)
+        custom_prompt = task.options.get('custom_prompt')
+        image_prompt = task.options.get('image_prompt')
+        batch_descriptions = task.options.get('batch_descriptions', Config.DESCRIPTION_BATCH_ENABLED)
+
+        if force:
+            reset = task_manager.reset_pages(task_id, page_ids)
+            logger.info(f"任务 {task_id} 强制重新生成 {reset} 个页面")
+
+        # 在协调线程池中执行生成
+        def run_generation():
+            try:
+                generate_all()
+            except Exception as e:
+                logger.error(f"任务 {task_id} 生成失败: {e}")
+                task_manager.update_task_status(task_id, TaskStatus.ERROR, "生成失败", str(e))
+            finally:
+                task_manager.end_run(task_id)
+
+        def on_partial(page: ScriptPage):
+            """流式生成时把部分描述写入页面并推送（DESCRIPTION_STREAMING 关闭时不流式）"""
+            if not Config.DESCRIPTION_STREAMING:
+                return None
+            return lambda text: task_manager.update_page_partial(task_id, page, text)
+
+        def batch_items(pages):
+            return [{'id': page.id, 'shot_number': page.shot_number, 'narration': page.narration,
+                     'visual_hint': page.visual_hint} for page in pages]
+
+        def generate_all():
+            # asyncio 引擎下使用异步 AI 服务
+            if task_manager.engine == 'asyncio':
+                async_ai_service = get_async_ai_service()
+
+                async def generate_description(page: ScriptPage) -> str:
+                    return await async_ai_service.generate_page_description(
+                        shot_number=page.shot_number,
+                        segment=page.segment,
+                        narration=page.narration,
+                        visual_hint=page.visual_hint,
+                        custom_prompt=custom_prompt,
+                        on_partial=on_partial(page)
+                    )
+
+                async def generate_descriptions(pages):
+                    return await async_ai_service.generate_page_descriptions(
+                        batch_items(pages), custom_prompt=custom_prompt
+                    )
+
+                async def generate_image(page: ScriptPage) -> str:
+                    image = await async_ai_service.generate_ppt_image(
+                        narration=page.narration,
+                        description=page.description,
+                        custom_prompt=image_prompt
+                    )
+                    return await asyncio.to_thread(_save_page_image, task_id, page, image)
+            else:
+                ai_service = get_ai_service()
+
+                def generate_description(page: ScriptPage) -> str:
+                    return ai_service.generate_page_description(
+                        shot_number=page.shot_number,
+                        segment=page.segment,
+                        narration=page.narration,
+                        visual_hint=page.visual_hint,
+                        custom_prompt=custom_prompt,
+                        on_partial=on_partial(page)
+                    )
 
-        # 生成图片（暂时跳过，等图片生成 API 完善后启用）
-        # def generate_image(page: ScriptPage) -> str:
-        #     image = ai_service.generate_image(page.description)
-        #     if image:
-        #         image_path = os.path.join(Config.OUTPUT_FOLDER, f"{task_id}_{page.index}.png")
-        #         image.save(image_path)
-        #         return image_path
-        #     return ""
-        #
-        # task_manager.run_images_generation(task_id, generate_image)
+                def generate_descriptions(pages):
+                    return ai_service.generate_page_descriptions(batch_items(pages), custom_prompt=custom_prompt)
 
-        # 直接标记为完成（描述生成完成即可）
-        task_manager.update_task_status(task_id, TaskStatus.COMPLETED, "描述生成完成")
+                def generate_image(page: ScriptPage) -> str:
+                    image = ai_service.generate_ppt_image(
+                        narration=page.narration,
+                        description=page.description,
+                        custom_prompt=image_prompt
+                    )
+                    return _save_page_image(task_id, page, image)
+
+            # 多页描述按组完成，流水线模式仍逐页生成描述
+            batch_func = generate_descriptions if batch_descriptions else None
+            if not image_prompt:
+                # 未提供图片提示词时只生成描述
+                task_manager.run_descriptions_generation(task_id, generate_description, batch_func)
+                task_manager.update_task_status(task_id, TaskStatus.COMPLETED, "描述生成完成")
+            elif Config.GENERATION_MODE == 'pipelined':
+                task_manager.run_pipelined_generation(task_id, generate_description, generate_image)
+            else:
+                task_manager.run_descriptions_generation(task_id, generate_description, batch_func)
+                task_manager.run_images_generation(task_id, generate_image)
 
-    thread = threading.Thread(target=run_generation, daemon=True)
-    thread.start()
+        task_manager.run_in_background(run_generation)
+    except Exception:
+        task_manager.end_run(task_id)
+        raise
 
     return success_response({
         'task_id': task_id,
-        'status': 'started'
+        'status': 'started',
+        'pending_pages': len(task.pages_with_phase(''))
     }, "生成任务已启动")
 
 
+def _save_page_image(task_id: str, page: ScriptPage, image: str) -> str:
+    """将生成的图片 data URL 保存到输出目录，返回文件路径"""
+    parts = split_data_url(image) if image else None
+    if not parts:
+        raise ValueError("未生成图片")
+    mime_type, data = parts
+    extension = mimetypes.guess_extension(mime_type) or '.png'
+    image_path = os.path.join(Config.OUTPUT_FOLDER, f"{task_id}_{page.index}{extension}")
+    with open(image_path, 'wb') as f:
+        f.write(base64.b64decode(data))
+    return image_path
+
+
 @batch_bp.route('/<task_id>/status', methods=['GET'])
 def get_task_status(task_id: str):
     """
     获取任务状态
 
+    任务每次变化都会递增 version，响应带有对应的 ETag：
+    - 携带 If-None-Match 且任务未变化时返回 304
+    - ?since=<version> 时只返回该版本之后变化的页面（加上任务概要）
+
+    Args:
+        task_id: 任务 ID
+    """
+    task_manager = get_task_manager()
+    task = task_manager.get_task(task_id)
+
+    if not task:
+        return error_response("任务不存在", 404)
+
+    since = request.args.get('since', type=int)
+    etag = str(task.version)
+
+    if request.if_none_match.contains_weak(etag) or (since is not None and since >= task.version):
+        response = Response(status=304)
+    else:
+        response, _ = success_response(task.to_delta(since) if since is not None else task.to_dict())
+    response.set_etag(etag, weak=True)
+    # 浏览器每次都需重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _sse_event(event_type: str, data, event_id: int = None) -> str:
+    """格式化一条 SSE 事件"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json_dumps(data).decode('utf-8')}")
+    return '\n'.join(lines) + '\n\n'
+
+
+@batch_bp.route('/<task_id>/events', methods=['GET'])
+def task_events(task_id: str):
+    """
+    任务进度推送（Server-Sent Events），替代轮询 /status
+
+    事件类型:
+        snapshot: 完整任务数据（首次连接，或断线太久无法补发时）
+        task: 任务状态/阶段变化（不含页面）
+        page: 单个页面状态变化，附带任务进度；流式生成描述期间推送部分描述（partial 为 true）
+        end: 任务已被删除，随后关闭连接
+
+    断线重连时浏览器会自动携带 Last-Event-ID 请求头，服务端补发其后的事件；
+    也可以用查询参数 last_event_id 指定
+
+    Args:
+        task_id: 任务 ID
+    """
+    task_manager = get_task_manager()
+    task = task_manager.get_task(task_id)
+
+    if not task:
+        return error_response("任务不存在", 404)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        after_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        after_id = None
+
+    event_bus = get_event_bus()
+
+    def generate(after_id):
+        # 在生成器内订阅，连接断开（生成器关闭）时由 finally 退订
+        stream = event_bus.subscribe(task_id)
+        try:
+            yield "retry: 3000\n\n"
+            if after_id is None or not stream.can_resume(after_id):
+                # 先记下事件位置再生成快照，快照之后的变化由后续事件补上
+                after_id = stream.last_id
+                yield _sse_event('snapshot', task.to_dict(), after_id)
+
+            while True:
+                events = stream.wait(after_id, Config.SSE_HEARTBEAT_INTERVAL)
+                for event_id, event_type, data in events:
+                    yield _sse_event(event_type, data, event_id)
+                    after_id = event_id
+                if stream.closed:
+                    yield _sse_event('end', {'task_id': task_id})
+                    return
+                if not events:
+                    # 心跳（注释行），防止代理断开空闲连接
+                    yield ": heartbeat\n\n"
+        finally:
+            event_bus.unsubscribe(task_id, stream)
+
+    return Response(
+        stream_with_context(generate(after_id)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+@batch_bp.route('/<task_id>/cancel', methods=['POST'])
+def cancel_task(task_id: str):
+    """
+    取消生成
+
+    排队中的页面不再执行，在途请求被中止或结果被丢弃；已完成的页面阶段保留，
+    之后调用 /generate 可继续生成剩余页面
+
     Args:
         task_id: 任务 ID
     """
@@ -202,7 +441,13 @@ def get_task_status(task_id: str):
     if not task:
         return error_response("任务不存在", 404)
 
-    return success_response(task.to_dict())
+    if not task_manager.cancel_task(task_id):
+        return error_response(f"任务状态不允许取消: {task.status.value}", 400)
+
+    return success_response({
+        'task_id': task_id,
+        'status': task.status.value
+    }, "任务已取消")
 
 
 @batch_bp.route('/<task_id>', methods=['DELETE'])
@@ -221,18 +466,133 @@ def delete_task(task_id: str):
         return error_response("任务不存在", 404)
 
 
+# 列表与批量查询的单次上限
+MAX_LIST_LIMIT = 200
+
+# 出现任一参数时 /list 使用分页返回格式
+LIST_QUERY_ARGS = ('cursor', 'limit', 'status', 'created_after', 'created_before', 'view')
+
+
+def _parse_datetime_arg(name: str):
+    """解析 ISO 格式的时间查询参数，缺省返回 None，格式错误抛出 ValueError"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} 不是有效的 ISO 时间: {value}")
+
+
 @batch_bp.route('/list', methods=['GET'])
 def list_tasks():
-    """获取所有任务列表"""
+    """
+    获取任务列表
+
+    不带查询参数时保持原有格式，返回全部任务的完整数据：
+        {"total": 任务数, "tasks": [完整任务]}
+
+    带下列任一参数时按创建时间倒序分页：
+        {"count": 本页条数, "tasks": [...], "next_cursor": 下一页游标或 null}
+
+    Query:
+        cursor: 上一页返回的 next_cursor（可选）
+        limit: 每页条数，默认 50，最大 200
+        status: 按状态过滤，多个状态用逗号分隔（可选）
+        created_after / created_before: 按创建时间过滤，ISO 格式（可选）
+        view: summary（默认，只含任务概要和各状态页面数）或 full（含全部页面）
+    """
+    task_manager = get_task_manager()
+
+    if not any(arg in request.args for arg in LIST_QUERY_ARGS):
+        tasks = task_manager.get_all_tasks()
+        return success_response({
+            'total': len(tasks),
+            'tasks': [t.to_dict() for t in tasks]
+        })
+
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_LIST_LIMIT)
+    view = request.args.get('view', 'summary')
+    status_arg = request.args.get('status')
+    statuses = [s.strip() for s in status_arg.split(',') if s.strip()] if status_arg else None
+
+    try:
+        if statuses:
+            statuses = [TaskStatus(s).value for s in statuses]
+        tasks, next_cursor = task_manager.list_tasks(
+            statuses=statuses,
+            created_after=_parse_datetime_arg('created_after'),
+            created_before=_parse_datetime_arg('created_before'),
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+    except ValueError as e:
+        return error_response(f"查询参数无效: {e}", 400)
+
+    if view == 'full':
+        full_tasks = (task_manager.get_task(t['id']) for t in tasks)
+        tasks = [t.to_dict() for t in full_tasks if t]
+
+    return success_response({
+        'count': len(tasks),
+        'tasks': tasks,
+        'next_cursor': next_cursor
+    })
+
+
+@batch_bp.route('/status', methods=['POST'])
+def get_tasks_status():
+    """
+    批量获取任务状态
+
+    Request body:
+        {
+            "task_ids": ["任务ID", ...],  // 最多 200 个
+            "view": "summary"  // 可选，summary（默认）或 full
+        }
+    """
+    data = get_json_body()
+    if not data:
+        return error_response("请求数据为空", 400)
+
+    task_ids = data.get('task_ids')
+    if not isinstance(task_ids, list) or not task_ids:
+        return error_response("task_ids 必须是非空数组", 400)
+    if len(task_ids) > MAX_LIST_LIMIT:
+        return error_response(f"task_ids 最多 {MAX_LIST_LIMIT} 个", 400)
+
     task_manager = get_task_manager()
-    tasks = task_manager.get_all_tasks()
+    task_ids = [str(task_id) for task_id in task_ids]
+
+    if data.get('view') == 'full':
+        tasks = {}
+        for task_id in task_ids:
+            task = task_manager.get_task(task_id)
+            if task:
+                tasks[task_id] = task.to_dict()
+    else:
+        tasks = task_manager.get_task_summaries(task_ids)
 
     return success_response({
-        'total': len(tasks),
-        'tasks': [t.to_dict() for t in tasks]
+        'tasks': tasks,
+        'missing': [task_id for task_id in task_ids if task_id not in tasks]
     })
 
 
+def _template_input(data):
+    """
+    读取模板：优先按 template_id 从模板库读取，否则使用 template_base64
+
+    Returns:
+        (模板, 是否找到)：模板为 TemplateImage、base64 字符串或 None；template_id 不存在时第二项为 False
+    """
+    template_id = data.get('template_id')
+    if template_id:
+        template = get_template_registry().get(template_id)
+        return template, template is not None
+    return data.get('template_base64'), True
+
+
 @batch_bp.route('/generate-description', methods=['POST'])
 def generate_single_description():
     """
@@ -245,10 +605,19 @@ def generate_single_description():
             "full_context": "完整脚本上下文（可选）",
             "current_index": 当前页索引（可选）,
             "custom_prompt": "自定义提示词（可选，前端传来）",
-            "template_base64": "模板图片base64（可选）"
+            "template_base64": "模板图片base64（可选）",
+            "template_id": "或模板库中的模板 ID（可选，见 POST /api/templates）",
+            "bypass_cache": false,  // 可选，true 时跳过描述缓存强制重新生成
+            "stream": false  // 可选，true 时以 NDJSON 流式返回（也可用 Accept: application/x-ndjson）
         }
+
+    流式返回时每行一个 JSON 对象:
+        {"type": "delta", "text": "新增文本"}  // 多次
+        {"type": "done", "description": "完整描述"}  // 成功结束
+        {"type": "error", "message": "错误信息"}  // 开始输出后出错
+    建立上游连接前出错时仍返回普通的错误响应
     """
-    data = request.get_json()
+    data = get_json_body()
     if not data:
         return error_response("请求数据为空", 400)
 
@@ -257,13 +626,20 @@ def generate_single_description():
     full_context = data.get('full_context', '')  # 完整上下文
     current_index = data.get('current_index')     # 当前页索引
     custom_prompt = data.get('custom_prompt')     # 自定义提示词
-    template_base64 = data.get('template_base64') # 模板图片
+    template_base64, template_found = _template_input(data)  # 模板图片
+    bypass_cache = bool(data.get('bypass_cache', False))
 
     # 调试日志
-    logger.info(f"[描述生成] 收到请求: narration长度={len(narration)}, 有custom_prompt={custom_prompt is not None}, 有template={template_base64 is not None and len(template_base64) > 0}")
+    logger.info(f"[描述生成] 收到请求: narration长度={len(narration)}, 有custom_prompt={custom_prompt is not None}, 有template={bool(template_base64)}")
 
     if not narration:
         return error_response("讲稿内容不能为空", 400)
+    if not template_found:
+        return error_response("模板不存在，请重新上传模板", 404)
+
+    if data.get('stream') or request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        return _stream_description_response(narration, visual_hint, custom_prompt, template_base64,
+                                            use_cache=not bypass_cache)
 
     try:
         ai_service = get_ai_service()
@@ -275,7 +651,8 @@ def generate_single_description():
             full_context=full_context if full_context else None,
             current_index=current_index,
             custom_prompt=custom_prompt,
-            template_base64=template_base64
+            template_base64=template_base64,
+            use_cache=not bypass_cache
         )
 
         return success_response({
@@ -287,6 +664,81 @@ def generate_single_description():
         return error_response(f"生成描述失败: {str(e)}", 500)
 
 
+def _ndjson_line(data) -> bytes:
+    return json_dumps(data) + b'\n'
+
+
+def _stream_description_response(narration: str, visual_hint: str, custom_prompt: str,
+                                 template_base64: str, use_cache: bool):
+    """以 NDJSON 流式返回描述：首段文本到达即开始输出，浏览器感知的延迟是首字延迟"""
+    deltas = get_ai_service().stream_page_description(
+        shot_number="",
+        narration=narration,
+        visual_hint=visual_hint,
+        custom_prompt=custom_prompt,
+        template_base64=template_base64,
+        use_cache=use_cache
+    )
+    # 先取首段：建立连接、上游报错等问题仍以普通错误响应返回
+    try:
+        first = next(deltas, "")
+    except Exception as e:
+        logger.error(f"生成描述失败: {e}")
+        return error_response(f"生成描述失败: {str(e)}", 500)
+
+    def generate():
+        parts = [first]
+        if first:
+            yield _ndjson_line({'type': 'delta', 'text': first})
+        try:
+            for delta in deltas:
+                parts.append(delta)
+                yield _ndjson_line({'type': 'delta', 'text': delta})
+        except Exception as e:
+            logger.error(f"流式生成描述失败: {e}")
+            yield _ndjson_line({'type': 'error', 'message': f"生成描述失败: {str(e)}"})
+            return
+        yield _ndjson_line({'type': 'done', 'description': ''.join(parts)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=NDJSON_MIMETYPE,
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+def _image_response_format(data) -> str:
+    """请求指定的图片返回格式，未指定时使用配置的默认值，无效时返回空字符串"""
+    response_format = str(data.get('response_format') or Config.IMAGE_RESPONSE_FORMAT).lower()
+    return response_format if response_format in IMAGE_RESPONSE_FORMATS else ''
+
+
+def _image_result(image: str, as_blob: bool, base64_key: str) -> dict:
+    """单图接口的返回数据：url 格式返回图片 ID 和地址，否则沿用原有的 base64 字段"""
+    if as_blob:
+        return {
+            'image_id': image,
+            'image_url': url_for('image.get_image', image_id=image)
+        }
+    return {base64_key: image}
+
+
+def _image_input(data, base64_key: str, id_key: str):
+    """
+    读取输入图片：优先按图片 ID 从图片存储读取，否则使用 base64 字段
+
+    Returns:
+        图片 data URL；图片 ID 不存在时返回 None，两者都未提供时返回空字符串
+    """
+    image_id = data.get(id_key)
+    if image_id:
+        return get_blob_store().get_data_url(image_id)
+    return data.get(base64_key, '')
+
+
 @batch_bp.route('/generate-image', methods=['POST'])
 def generate_single_image():
     """
@@ -299,7 +751,10 @@ def generate_single_image():
             "page_type": "content/cover/ending",
             "aspect_ratio": "16:9",
             "template_base64": "模板图片base64（可选）",
+            "template_id": "或模板库中的模板 ID（可选，见 POST /api/templates）",
             "custom_prompt": "自定义提示词（可选）",
+            "bypass_cache": false,  // 可选，true 时跳过图片缓存强制重新生成
+            "response_format": "base64",  // 可选，url 时返回 image_id 和 image_url 而不是 image_base64
             "api_config": {  // 可选，前端传来的 API 配置
                 "api_url": "...",
                 "api_key": "...",
@@ -307,7 +762,7 @@ def generate_single_image():
             }
         }
     """
-    data = request.get_json()
+    data = get_json_body()
     if not data:
         return error_response("请求数据为空", 400)
 
@@ -315,60 +770,45 @@ def generate_single_image():
     description = data.get('description', '')
     page_type = data.get('page_type', 'content')
     aspect_ratio = data.get('aspect_ratio', '16:9')
-    template_base64 = data.get('template_base64')  # 模板图片
+    template_base64, template_found = _template_input(data)  # 模板图片
     custom_prompt = data.get('custom_prompt')  # 自定义提示词
     api_config = data.get('api_config')  # 前端传来的 API 配置
+    bypass_cache = bool(data.get('bypass_cache', False))
+    response_format = _image_response_format(data)
 
     logger.info(f"[图片生成] 收到请求: 有custom_prompt={custom_prompt is not None}, 有template={template_base64 is not None}")
 
     if not narration and not description:
         return error_response("讲稿或描述至少需要一个", 400)
+    if not template_found:
+        return error_response("模板不存在，请重新上传模板", 404)
+    if not response_format:
+        return error_response(f"response_format 只能是 {'/'.join(IMAGE_RESPONSE_FORMATS)}", 400)
+    as_blob = response_format == 'url'
 
     try:
         ai_service = get_ai_service()
 
-        # 如果有前端配置，临时覆盖 AI 服务的配置
+        # 如果有前端配置，本次请求使用改用该配置的服务副本
         if api_config and api_config.get('api_url') and api_config.get('api_key'):
             logger.info(f"[图片API] 使用前端传来的 API 配置: {api_config.get('api_url')}")
-            # 临时保存原配置
-            original_api_base = ai_service.image_api_base
-            original_api_key = ai_service.image_api_key
-            original_model = ai_service.image_model
-
-            # 使用前端配置
-            ai_service.image_api_base = api_config.get('api_url')
-            ai_service.image_api_key = api_config.get('api_key')
-            if api_config.get('model'):
-                ai_service.image_model = api_config.get('model')
-
-            try:
-                image_base64 = ai_service.generate_ppt_image(
-                    narration=narration,
-                    description=description,
-                    page_type=page_type,
-                    aspect_ratio=aspect_ratio,
-                    template_base64=template_base64,
-                    custom_prompt=custom_prompt
-                )
-            finally:
-                # 恢复原配置
-                ai_service.image_api_base = original_api_base
-                ai_service.image_api_key = original_api_key
-                ai_service.image_model = original_model
-        else:
-            image_base64 = ai_service.generate_ppt_image(
-                narration=narration,
-                description=description,
-                page_type=page_type,
-                aspect_ratio=aspect_ratio,
-                template_base64=template_base64,
-                custom_prompt=custom_prompt
+            ai_service = ai_service.with_image_api(
+                api_config.get('api_url'), api_config.get('api_key'), api_config.get('model')
             )
 
+        image_base64 = ai_service.generate_ppt_image(
+            narration=narration,
+            description=description,
+            page_type=page_type,
+            aspect_ratio=aspect_ratio,
+            template_base64=template_base64,
+            custom_prompt=custom_prompt,
+            use_cache=not bypass_cache,
+            as_blob=as_blob
+        )
+
         if image_base64:
-            return success_response({
-                'image_base64': image_base64
-            }, "图片生成成功")
+            return success_response(_image_result(image_base64, as_blob, 'image_base64'), "图片生成成功")
         else:
             return error_response("图片生成失败，未能获取有效图片", 500)
 
@@ -384,26 +824,35 @@ def extract_single_image():
 
     Request body:
         {
-            "cropped_image_base64": "裁剪后的图片base64数据"
+            "cropped_image_base64": "裁剪后的图片base64数据",
+            "cropped_image_id": "或图片存储中的图片 ID（可选）",
+            "response_format": "base64"  // 可选，url 时返回 image_id 和 image_url 而不是 image
         }
     """
-    data = request.get_json()
+    data = get_json_body()
     if not data:
         return error_response("请求数据为空", 400)
 
-    cropped_image_base64 = data.get('cropped_image_base64', '')
+    cropped_image_base64 = _image_input(data, 'cropped_image_base64', 'cropped_image_id')
+    bypass_cache = bool(data.get('bypass_cache', False))
+    response_format = _image_response_format(data)
 
+    if cropped_image_base64 is None:
+        return error_response("图片不存在", 404)
     if not cropped_image_base64:
         return error_response("裁剪图片不能为空", 400)
+    if not response_format:
+        return error_response(f"response_format 只能是 {'/'.join(IMAGE_RESPONSE_FORMATS)}", 400)
+    as_blob = response_format == 'url'
 
     try:
         ai_service = get_ai_service()
-        image_base64 = ai_service.extract_illustration(cropped_image_base64)
+        image_base64 = ai_service.extract_illustration(
+            cropped_image_base64, use_cache=not bypass_cache, as_blob=as_blob
+        )
 
         if image_base64:
-            return success_response({
-                'image': image_base64
-            }, "插画提取成功")
+            return success_response(_image_result(image_base64, as_blob, 'image'), "插画提取成功")
         else:
             return error_response("插画提取失败，未能获取有效图片", 500)
 
@@ -416,24 +865,38 @@ def extract_single_image():
 def remove_single_background():
     """
     去除单张图片的模板背景
+
+    Request body:
+        {
+            "image_base64": "图片base64数据",
+            "image_id": "或图片存储中的图片 ID（可选）",
+            "response_format": "base64"  // 可选，url 时返回 image_id 和 image_url 而不是 image_base64
+        }
     """
-    data = request.get_json()
+    data = get_json_body()
     if not data:
         return error_response("请求数据为空", 400)
 
-    image_base64 = data.get('image_base64', '')
+    image_base64 = _image_input(data, 'image_base64', 'image_id')
+    bypass_cache = bool(data.get('bypass_cache', False))
+    response_format = _image_response_format(data)
 
+    if image_base64 is None:
+        return error_response("图片不存在", 404)
     if not image_base64:
         return error_response("图片数据不能为空", 400)
+    if not response_format:
+        return error_response(f"response_format 只能是 {'/'.join(IMAGE_RESPONSE_FORMATS)}", 400)
+    as_blob = response_format == 'url'
 
     try:
         ai_service = get_ai_service()
-        result_base64 = ai_service.remove_template_background(image_base64)
+        result_base64 = ai_service.remove_template_background(
+            image_base64, use_cache=not bypass_cache, as_blob=as_blob
+        )
 
         if result_base64:
-            return success_response({
-                'image_base64': result_base64
-            }, "去背景成功")
+            return success_response(_image_result(result_base64, as_blob, 'image_base64'), "去背景成功")
         else:
             return error_response("去背景失败，未能获取有效图片", 500)
 
@@ -449,26 +912,35 @@ def clean_single_image():
 
     Request body:
         {
-            "image_base64": "原始PPT图片的base64数据"
+            "image_base64": "原始PPT图片的base64数据",
+            "image_id": "或图片存储中的图片 ID（可选）",
+            "response_format": "base64"  // 可选，url 时返回 image_id 和 image_url 而不是 image_base64
         }
     """
-    data = request.get_json()
+    data = get_json_body()
     if not data:
         return error_response("请求数据为空", 400)
 
-    image_base64 = data.get('image_base64', '')
+    image_base64 = _image_input(data, 'image_base64', 'image_id')
+    bypass_cache = bool(data.get('bypass_cache', False))
+    response_format = _image_response_format(data)
 
+    if image_base64 is None:
+        return error_response("图片不存在", 404)
     if not image_base64:
         return error_response("图片数据不能为空", 400)
+    if not response_format:
+        return error_response(f"response_format 只能是 {'/'.join(IMAGE_RESPONSE_FORMATS)}", 400)
+    as_blob = response_format == 'url'
 
     try:
         ai_service = get_ai_service()
-        result_base64 = ai_service.clean_slide_image(image_base64)
+        result_base64 = ai_service.clean_slide_image(
+            image_base64, use_cache=not bypass_cache, as_blob=as_blob
+        )
 
         if result_base64:
-            return success_response({
-                'image_base64': result_base64
-            }, "图片清洗成功")
+            return success_response(_image_result(result_base64, as_blob, 'image_base64'), "图片清洗成功")
         else:
             return error_response("图片清洗失败，未能获取有效图片", 500)
 
@@ -490,19 +962,18 @@ def export_ppt():
                     "title": "标题",
                     "subtitle": "副标题",
                     "narration": "讲稿",
-                    "image_base64": "base64图片数据"
+                    "image_base64": "base64图片数据",
+                    "image_id": "或图片存储中的图片 ID（可选）"
                 }
             ]
         }
     """
     from pptx import Presentation
-    from pptx.util import Inches, Pt
-    from pptx.dml.color import RgbColor
-    from pptx.enum.text import PP_ALIGN
+    from pptx.util import Inches
 
     logger.info("[导出PPT] 开始处理导出请求")
 
-    data = request.get_json()
+    data = get_json_body()
     if not data:
         logger.error("[导出PPT] 请求数据为空")
         return error_response("请求数据为空", 400)
@@ -525,6 +996,7 @@ def export_ppt():
 
         for idx, page in enumerate(pages_data):
             page_type = page.get('type', 'content')
+            image_id = page.get('image_id')
             image_base64 = page.get('image_base64')
 
             logger.info(f"[导出PPT] 处理第 {idx + 1} 页，类型: {page_type}")
@@ -533,19 +1005,27 @@ def export_ppt():
             blank_layout = prs.slide_layouts[6]  # 空白布局
             slide = prs.slides.add_slide(blank_layout)
 
-            if image_base64:
+            if image_id or image_base64:
                 try:
-                    # 解析 base64 图片
-                    if image_base64.startswith('data:'):
-                        # 移除 data:image/xxx;base64, 前缀
-                        image_base64 = image_base64.split(',', 1)[1]
-
-                    image_data = base64.b64decode(image_base64)
-                    image_stream = io.BytesIO(image_data)
+                    if image_id:
+                        # 从图片存储读取原始字节，不经过 base64；先读入内存，
+                        # 避免 python-pptx 打开文件前图片被并发淘汰
+                        entry = get_blob_store().read(image_id)
+                        if entry is None:
+                            raise ValueError(f"图片不存在: {image_id}")
+                        image_source = io.BytesIO(entry[0])
+                    else:
+                        # 解析 base64 图片
+                        if image_base64.startswith('data:'):
+                            # 移除 data:image/xxx;base64, 前缀
+                            image_base64 = image_base64.split(',', 1)[1]
+
+                        image_data = base64.b64decode(image_base64)
+                        image_source = io.BytesIO(image_data)
 
                     # 图片铺满整个幻灯片
                     slide.shapes.add_picture(
-                        image_stream,
+                        image_source,
                         Inches(0),
                         Inches(0),
                         width=prs.slide_width,
@@ -7,6 +7,7 @@ import logging
 from flask import Blueprint, request, send_file
 
 from utils.response import success_response, error_response
+from utils.json_codec import get_json_body
 from services.task_manager import get_task_manager, TaskStatus
 from services.export_service import get_export_service
 
@@ -39,7 +40,7 @@ def export_pptx(task_id: str):
         return error_response(f"任务未完成，当前状态: {task.status.value}", 400)
 
     # 获取请求参数
-    data = request.get_json() or {}
+    data = get_json_body() or {}
     include_notes = data.get('include_notes', True)
     output_name = data.get('output_name', task.name or task_id)
 
@@ -60,6 +61,7 @@ def export_pptx(task_id: str):
 
         # 更新任务输出路径
         task.output_path = output_path
+        task_manager.save_task(task)
 
         return success_response({
             'output_path': output_path,
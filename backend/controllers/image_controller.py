@@ -0,0 +1,41 @@
+"""
+图片控制器
+按图片 ID 读取图片存储中的图片
+"""
+import logging
+from flask import Blueprint, send_file
+
+from utils.response import error_response
+from services.blob_store import get_blob_store
+
+logger = logging.getLogger(__name__)
+
+image_bp = Blueprint('image', __name__)
+
+# 图片按内容寻址，同一 ID 的内容永远不变，可以让浏览器和 CDN 长期缓存
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+@image_bp.route('/<image_id>', methods=['GET'])
+def get_image(image_id: str):
+    """
+    获取图片（支持 ETag/If-None-Match 和 Range 请求）
+
+    Args:
+        image_id: 图片 ID（图片内容的 SHA-256）
+    """
+    located = get_blob_store().locate(image_id)
+    if located is None:
+        return error_response("图片不存在", 404)
+
+    path, mime_type = located
+    response = send_file(
+        path,
+        mimetype=mime_type,
+        conditional=True,
+        etag=image_id,
+        max_age=IMMUTABLE_MAX_AGE
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,80 @@
+"""
+模板控制器
+模板图片上传一次得到模板 ID，单页描述/图片接口通过 template_id 引用
+"""
+import logging
+import mimetypes
+from flask import Blueprint, request, send_file, url_for
+
+from utils.response import created_response, error_response
+from utils.json_codec import get_json_body
+from services.cache import IMAGE_EXTENSIONS
+from services.template_registry import get_template_registry
+
+logger = logging.getLogger(__name__)
+
+template_bp = Blueprint('template', __name__)
+
+# 模板按内容寻址，同一 ID 的内容永远不变
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+@template_bp.route('', methods=['POST'])
+def upload_template():
+    """
+    登记模板图片
+
+    multipart 上传 file 字段，或 JSON:
+        {
+            "template_base64": "模板图片 data URL"
+        }
+
+    Returns:
+        template_id（图片内容的 SHA-256，相同图片得到相同 ID）、mime_type、template_url
+    """
+    registry = get_template_registry()
+    if 'file' in request.files:
+        file = request.files['file']
+        mime_type = file.mimetype
+        if mime_type not in IMAGE_EXTENSIONS:
+            mime_type = mimetypes.guess_type(file.filename or '')[0] or mime_type
+        template = registry.register(file.read(), mime_type)
+    else:
+        data = get_json_body()
+        if not data or not data.get('template_base64'):
+            return error_response("模板图片不能为空", 400)
+        template = registry.register_data_url(data['template_base64'])
+
+    if template is None:
+        return error_response(f"模板图片无效，支持: {', '.join(IMAGE_EXTENSIONS)}", 400)
+
+    return created_response({
+        'template_id': template.template_id,
+        'mime_type': template.mime_type,
+        'template_url': url_for('template.get_template', template_id=template.template_id)
+    }, "模板登记成功")
+
+
+@template_bp.route('/<template_id>', methods=['GET'])
+def get_template(template_id: str):
+    """
+    获取模板图片（可用于确认模板仍然存在）
+
+    Args:
+        template_id: 模板 ID
+    """
+    located = get_template_registry().locate(template_id)
+    if located is None:
+        return error_response("模板不存在", 404)
+
+    path, mime_type = located
+    response = send_file(
+        path,
+        mimetype=mime_type,
+        conditional=True,
+        etag=template_id,
+        max_age=IMMUTABLE_MAX_AGE
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -3,12 +3,23 @@ AI 服务 - 文字和图片统一使用 Gemini 原生 API
 提示词统一由前端管理并通过 custom_prompt 参数传递
 """
 import re
+import time
 import logging
 import base64
+import copy
 import httpx
-from typing import Optional
+from contextlib import ExitStack
+from typing import Optional, Dict, Any, Tuple, Callable, Iterator, List, Sequence, TypeVar, Union
 
 from config import Config
+from utils.json_codec import dumps as json_dumps, loads as json_loads
+from .http_client import get_http_client, origin_of
+from .cache import get_description_cache, get_image_cache, make_cache_key, split_data_url
+from .blob_store import get_blob_store
+from .template_registry import TemplateImage
+from .cancellation import TaskCancelledError, raise_if_cancelled
+from .concurrency import get_limiter
+from .retry import get_retry_policy, is_retryable
 
 logger = logging.getLogger(__name__)
 
@@ -41,145 +52,197 @@ def extract_chinese_content(text: str) -> str:
     return '\n'.join(chinese_lines).strip() if chinese_lines else text
 
 
-class AIService:
-    """AI 服务类"""
+# 图片类请求统一使用的生成配置
+IMAGE_GENERATION_CONFIG = {
+    "responseModalities": ["TEXT", "IMAGE"],
+    "imageConfig": {
+        "aspectRatio": "16:9",
+        "imageSize": "2K"
+    }
+}
 
-    def __init__(self):
-        """初始化 AI 服务"""
-        # 文字处理配置 (Gemini 原生 API)
-        self.text_api_base = Config.TEXT_API_BASE
-        self.text_api_key = Config.TEXT_API_KEY
-        self.text_model = Config.TEXT_MODEL
+DESCRIPTION_SYSTEM_INSTRUCTION = "你只输出最终结果，不输出任何思考过程、分析步骤或英文内容。直接给出答案。"
 
-        # 图片生成配置 (Gemini 原生 API)
-        self.image_api_base = Config.IMAGE_API_BASE
-        self.image_api_key = Config.IMAGE_API_KEY
-        self.image_model = Config.IMAGE_MODEL
+# 单页描述的输出上限，多页请求按页数放大
+DESCRIPTION_MAX_OUTPUT_TOKENS = 2048
 
-    def generate_page_description(self, shot_number: str, segment: str,
-                                   narration: str, visual_hint: str = None,
-                                   full_context: str = None, current_index: int = None,
-                                   custom_prompt: str = None, template_base64: str = None) -> str:
-        """
-        生成页面描述
+BATCH_DESCRIPTION_INSTRUCTION = """下面共有 {count} 个页面，请对每一页分别执行上面的要求，各页互相独立。
+只输出一个 JSON 数组，按页面顺序每页一个元素：{{"id": "页面编号", "description": "该页的输出"}}。
+description 的内容与单独处理该页时的输出完全相同，不要输出 JSON 以外的任何内容。"""
 
-        Args:
-            shot_number: 镜号
-            segment: 环节
-            narration: 讲稿内容
-            visual_hint: 画面提示（可选）
-            full_context: 完整脚本上下文（可选）
-            current_index: 当前页索引（可选）
-            custom_prompt: 自定义提示词（必须由前端传递）
-            template_base64: 模板图片base64（可选，有模板时分析风格）
+GENERATE_METHOD = 'generateContent'
+STREAM_METHOD = 'streamGenerateContent'
 
-        Returns:
-            生成的页面描述
-        """
-        # 必须提供自定义提示词
-        if not custom_prompt:
-            raise ValueError("必须提供 custom_prompt 参数，提示词由前端统一管理")
 
-        # 使用自定义提示词并替换变量
-        prompt = custom_prompt.replace('{{narration}}', narration)
-        if visual_hint:
-            prompt = prompt.replace('{{visual_hint}}', visual_hint)
+def inline_image_part(image_base64: str, log_prefix: str, label: str) -> Optional[Dict[str, Any]]:
+    """
+    将 data URL 转换为 Gemini inline_data part，格式无效时返回 None
+    """
+    if not image_base64 or not image_base64.startswith('data:'):
+        return None
+    match = re.match(r'data:(image/[^;]+);base64,(.+)', image_base64)
+    if not match:
+        logger.warning(f"{log_prefix} {label} data URL 格式无效，已跳过")
+        return None
+    return {
+        "inline_data": {
+            "mime_type": match.group(1),
+            "data": match.group(2)
+        }
+    }
 
-        # 在 prompt 开头添加强制指令
-        prompt = f"【重要】直接输出最终结果，禁止输出任何思考过程、分析步骤、英文内容。\n\n{prompt}"
-        logger.info(f"[文字API] 生成页面描述，镜号: {shot_number}, 有模板: {template_base64 is not None}")
 
-        # 使用配置的模型
-        desc_model = self.text_model
-        url = f"{self.text_api_base}/v1beta/models/{desc_model}:generateContent"
-        headers = {
-            "x-goog-api-key": self.text_api_key,
-            "Content-Type": "application/json"
+def template_image_part(template: Union[str, TemplateImage, None],
+                        log_prefix: str) -> Optional[Dict[str, Any]]:
+    """
+    模板图片的 inline_data part：模板库中的模板直接使用规范化后的数据，data URL 逐次解析
+    """
+    if isinstance(template, TemplateImage):
+        return template.inline_part()
+    return inline_image_part(template, log_prefix, "模板图片")
+
+
+def build_description_payload(narration: str, visual_hint: str = None,
+                              custom_prompt: str = None,
+                              template_base64: str = None) -> Dict[str, Any]:
+    """构建页面描述请求体"""
+    # 必须提供自定义提示词
+    if not custom_prompt:
+        raise ValueError("必须提供 custom_prompt 参数，提示词由前端统一管理")
+
+    # 使用自定义提示词并替换变量
+    prompt = custom_prompt.replace('{{narration}}', narration)
+    if visual_hint:
+        prompt = prompt.replace('{{visual_hint}}', visual_hint)
+
+    # 在 prompt 开头添加强制指令
+    prompt = f"【重要】直接输出最终结果，禁止输出任何思考过程、分析步骤、英文内容。\n\n{prompt}"
+
+    # 构建请求内容
+    parts = [{"text": prompt}]
+
+    # 如果有模板图片，添加到 parts
+    if template_base64:
+        template_part = template_image_part(template_base64, "[文字API]")
+        if template_part:
+            parts.append(template_part)
+
+    return {
+        "systemInstruction": {
+            "parts": [{"text": DESCRIPTION_SYSTEM_INSTRUCTION}]
+        },
+        "contents": [{"parts": parts}],
+        "generationConfig": {
+            "temperature": 0.7,
+            "maxOutputTokens": DESCRIPTION_MAX_OUTPUT_TOKENS
         }
+    }
 
-        # 构建请求内容
-        parts = [{"text": prompt}]
-
-        # 如果有模板图片，添加到 parts
-        if template_base64:
-            if template_base64.startswith('data:'):
-                match = re.match(r'data:(image/[^;]+);base64,(.+)', template_base64)
-                if match:
-                    mime_type = match.group(1)
-                    image_data = match.group(2)
-                    parts.append({
-                        "inline_data": {
-                            "mime_type": mime_type,
-                            "data": image_data
-                        }
-                    })
-                else:
-                    logger.warning(f"[文字API] 模板图片 data URL 格式无效，跳过模板")
-
-        payload = {
-            "systemInstruction": {
-                "parts": [{"text": "你只输出最终结果，不输出任何思考过程、分析步骤或英文内容。直接给出答案。"}]
-            },
-            "contents": [{"parts": parts}],
-            "generationConfig": {
-                "temperature": 0.7,
-                "maxOutputTokens": 2048
-            }
-        }
 
-        try:
-            with httpx.Client(timeout=120.0) as client:
-                response = client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
+T = TypeVar('T')
 
-                result = response.json()
 
-                # 提取文本响应
-                if "candidates" in result and len(result["candidates"]) > 0:
-                    candidate = result["candidates"][0]
-                    if "content" in candidate and "parts" in candidate["content"]:
-                        for part in candidate["content"]["parts"]:
-                            if "text" in part:
-                                description = part["text"]
-                                logger.info(f"[文字API] 描述生成成功，长度: {len(description)}")
-                                return description
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符约 1 个/token，其他字符约 4 个/token"""
+    if not text:
+        return 0
+    cjk = len(re.findall(r'[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]', text))
+    return cjk + (len(text) - cjk + 3) // 4
 
-                logger.error(f"[文字API] 响应中没有文本数据")
-                raise ValueError("API 响应中没有文本数据")
 
-        except httpx.HTTPStatusError as e:
-            logger.error(f"[文字API] HTTP 错误 {e.response.status_code}: {e.response.text[:200]}")
-            raise
-        except Exception as e:
-            logger.error(f"[文字API] 生成页面描述失败: {e}")
-            raise
+def pack_description_batches(pages: Sequence[T], text_of: Callable[[T], str],
+                             token_budget: int = None, max_pages: int = None) -> List[List[T]]:
+    """
+    按顺序把页面打包为多页描述请求的分组
 
-    def generate_image(self, prompt: str, aspect_ratio: str = "16:9",
-                       template_base64: str = None) -> Optional[str]:
-        """
-        使用 Gemini 原生 API 生成图片
+    每组输入的估算 token 数不超过 token_budget（单页超出时单独成组），页数不超过 max_pages；
+    相邻页面放在同一组，模型能看到前后文
 
-        Args:
-            prompt: 图片描述
-            aspect_ratio: 宽高比
-            template_base64: 模板图片的 base64 数据（可选）
+    Args:
+        pages: 页面列表
+        text_of: 返回页面参与请求的文本（讲稿、画面提示）
+        token_budget: 每组输入 token 预算，默认 DESCRIPTION_BATCH_TOKEN_BUDGET
+        max_pages: 每组最多页数，默认 DESCRIPTION_BATCH_MAX_PAGES
+    """
+    token_budget = token_budget or Config.DESCRIPTION_BATCH_TOKEN_BUDGET
+    max_pages = max(1, max_pages or Config.DESCRIPTION_BATCH_MAX_PAGES)
+    batches: List[List[T]] = []
+    current: List[T] = []
+    used = 0
+    for page in pages:
+        tokens = estimate_tokens(text_of(page))
+        if current and (used + tokens > token_budget or len(current) >= max_pages):
+            batches.append(current)
+            current, used = [], 0
+        current.append(page)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_batch_description_payload(pages: Sequence[Dict[str, Any]], custom_prompt: str = None,
+                                    template_base64: str = None) -> Dict[str, Any]:
+    """
+    构建多页描述请求体：提示词、系统指令和模板图片只发送一次，要求模型返回 JSON 数组
 
-        Returns:
-            base64 编码的图片数据
-        """
-        url = f"{self.image_api_base}/v1beta/models/{self.image_model}:generateContent"
-        headers = {
-            "x-goog-api-key": self.image_api_key,
-            "Content-Type": "application/json"
+    Args:
+        pages: 页面数据列表，包含 narration 和可选的 visual_hint；请求中按顺序以 1..N 编号
+    """
+    if not custom_prompt:
+        raise ValueError("必须提供 custom_prompt 参数，提示词由前端统一管理")
+
+    prompt = custom_prompt.replace('{{narration}}', '（见下方各页的讲稿）') \
+        .replace('{{visual_hint}}', '（见下方各页的画面提示）')
+    sections = [
+        f"【重要】直接输出最终结果，禁止输出任何思考过程、分析步骤、英文内容。\n\n{prompt}",
+        BATCH_DESCRIPTION_INSTRUCTION.format(count=len(pages))
+    ]
+    for number, page in enumerate(pages, 1):
+        section = f"=== 页面 {number} ===\n讲稿：{page['narration']}"
+        if page.get('visual_hint'):
+            section += f"\n画面提示：{page['visual_hint']}"
+        sections.append(section)
+
+    parts = [{"text": '\n\n'.join(sections)}]
+    if template_base64:
+        template_part = template_image_part(template_base64, "[文字API]")
+        if template_part:
+            parts.append(template_part)
+
+    return {
+        "systemInstruction": {
+            "parts": [{"text": DESCRIPTION_SYSTEM_INSTRUCTION}]
+        },
+        "contents": [{"parts": parts}],
+        "generationConfig": {
+            "temperature": 0.7,
+            "maxOutputTokens": DESCRIPTION_MAX_OUTPUT_TOKENS * len(pages),
+            "responseMimeType": "application/json",
+            "responseSchema": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "id": {"type": "STRING"},
+                        "description": {"type": "STRING"}
+                    },
+                    "required": ["id", "description"]
+                }
+            }
         }
+    }
 
-        # 构建 Gemini 原生格式的请求
-        parts = []
 
-        # 构建提示词
-        if template_base64:
-            logger.info(f"[图片API] 使用模板生成图片")
-            text_prompt = f"""生成一张PPT页面图片。
+def build_image_payload(prompt: str, template_base64: str = None) -> Dict[str, Any]:
+    """构建 PPT 页面图片生成请求体"""
+    # 构建 Gemini 原生格式的请求
+    parts = []
+
+    # 构建提示词
+    if template_base64:
+        logger.info(f"[图片API] 使用模板生成图片")
+        text_prompt = f"""生成一张PPT页面图片。
 
 【强制要求 - 背景和边框必须完全复制】
 仔细观察模板图片，以下元素必须与模板保持一致：
@@ -205,25 +268,14 @@ class AIService:
 
 16:9比例，直接生成图片。"""
 
-            parts.append({"text": text_prompt})
-
-            # 添加模板图片
-            if template_base64.startswith('data:'):
-                # 提取 mime_type 和 base64 数据
-                match = re.match(r'data:(image/[^;]+);base64,(.+)', template_base64)
-                if match:
-                    mime_type = match.group(1)
-                    image_data = match.group(2)
-                    parts.append({
-                        "inline_data": {
-                            "mime_type": mime_type,
-                            "data": image_data
-                        }
-                    })
-                else:
-                    logger.warning(f"[图片API] 模板图片 data URL 格式无效，跳过模板")
-        else:
-            text_prompt = f"""生成一张专业的PPT幻灯片图片，16:9比例。
+        parts.append({"text": text_prompt})
+
+        # 添加模板图片
+        template_part = template_image_part(template_base64, "[图片API]")
+        if template_part:
+            parts.append(template_part)
+    else:
+        text_prompt = f"""生成一张专业的PPT幻灯片图片，16:9比例。
 
 【文字排版要有设计感】
 - 标题用醒目字体，可以有色块背景
@@ -240,47 +292,563 @@ class AIService:
 {prompt}
 
 直接生成图片，不要输出文字。"""
-            parts.append({"text": text_prompt})
-
-        payload = {
-            "contents": [{
-                "parts": parts
-            }],
-            "generationConfig": {
-                "responseModalities": ["TEXT", "IMAGE"],
-                "imageConfig": {
-                    "aspectRatio": "16:9",
-                    "imageSize": "2K"
-                }
-            }
+        parts.append({"text": text_prompt})
+
+    return {
+        "contents": [{
+            "parts": parts
+        }],
+        "generationConfig": IMAGE_GENERATION_CONFIG
+    }
+
+
+def build_image_edit_payload(prompt: str, image_base64: str = None) -> Dict[str, Any]:
+    """构建基于输入图片的图片处理请求体（提取插画/去背景/清洗）"""
+    parts = [{"text": prompt}]
+
+    # 如果有输入图片，添加到 parts
+    if image_base64:
+        image_part = inline_image_part(image_base64, "[图片API]", "输入图片")
+        if image_part:
+            parts.append(image_part)
+
+    return {
+        "contents": [{"parts": parts}],
+        "generationConfig": IMAGE_GENERATION_CONFIG
+    }
+
+
+def render_ppt_image_prompt(narration: str, description: str = None,
+                            custom_prompt: str = None) -> str:
+    """用自定义提示词渲染 PPT 图片提示词"""
+    # 必须提供自定义提示词
+    if not custom_prompt:
+        raise ValueError("必须提供 custom_prompt 参数，提示词由前端统一管理")
+
+    # 使用自定义提示词并替换变量
+    # 同时支持 {{script}} 和 {{narration}} 两种变量名
+    prompt = custom_prompt.replace('{{script}}', narration).replace('{{narration}}', narration)
+    if description:
+        prompt = prompt.replace('{{description}}', description)
+    return prompt
+
+
+def parse_text_result(result: Dict[str, Any]) -> str:
+    """从 generateContent 响应中提取文本，没有文本时抛出 ValueError"""
+    if "candidates" in result and len(result["candidates"]) > 0:
+        candidate = result["candidates"][0]
+        if "content" in candidate and "parts" in candidate["content"]:
+            for part in candidate["content"]["parts"]:
+                if "text" in part:
+                    return part["text"]
+
+    logger.error(f"[文字API] 响应中没有文本数据")
+    raise ValueError("API 响应中没有文本数据")
+
+
+def parse_batch_description_result(result: Dict[str, Any]) -> Dict[str, str]:
+    """
+    解析多页描述响应，返回 {页面编号: 描述}
+
+    输出被截断或格式错误时抛出 ValueError；缺少的页面或描述为空的页面不出现在结果中
+    """
+    text = parse_text_result(result).strip()
+    if text.startswith('```'):
+        text = re.sub(r'^```\w*\s*|\s*```$', '', text)
+    items = json_loads(text)
+    if not isinstance(items, list):
+        raise ValueError("多页描述响应不是 JSON 数组")
+    descriptions = {}
+    for item in items:
+        if isinstance(item, dict) and isinstance(item.get('description'), str) and item['description'].strip():
+            descriptions[str(item.get('id', '')).strip()] = item['description'].strip()
+    return descriptions
+
+
+def should_split_batch(exc: BaseException) -> bool:
+    """
+    多页请求失败后是否拆成更小的组重试
+
+    输出格式错误、超时（输出过长）时拆分；任务取消和其他错误（4xx、重试耗尽的 5xx/429）
+    拆分也无济于事，整组直接失败
+    """
+    if isinstance(exc, TaskCancelledError):
+        return False
+    return isinstance(exc, (ValueError, httpx.TimeoutException))
+
+
+def plan_batch_retry(items: List[Dict[str, Any]], returned: Dict[str, str],
+                     descriptions: Dict[str, str], cache: Any) -> List[List[Dict[str, Any]]]:
+    """
+    记录多页请求返回的描述（并写入单页缓存），返回需要重试的分组：
+    全部缺失时对半拆分，部分缺失时只重试缺失的页面
+    """
+    missing = []
+    for number, item in enumerate(items, 1):
+        description = returned.get(str(number))
+        if description:
+            descriptions[item['id']] = description
+            if cache:
+                cache.put(item['cache_key'], description)
+        else:
+            missing.append(item)
+    if not missing:
+        return []
+    if len(missing) < len(items):
+        logger.warning(f"[文字API] 多页描述缺少 {len(missing)}/{len(items)} 页，重试缺失的页面")
+        return [missing]
+    middle = len(items) // 2
+    logger.warning(f"[文字API] 多页描述 {len(items)} 页全部失败，拆分为 {middle} + {len(items) - middle} 页重试")
+    return [items[:middle], items[middle:]]
+
+
+def parse_text_delta(chunk: Dict[str, Any]) -> str:
+    """从 streamGenerateContent 的单个响应片段中提取新增文本（跳过思考过程），上游报错时抛出 ValueError"""
+    if 'error' in chunk:
+        error = chunk['error']
+        raise ValueError(f"流式响应出错: {error.get('message', error) if isinstance(error, dict) else error}")
+    candidates = chunk.get('candidates') or [{}]
+    parts = (candidates[0].get('content') or {}).get('parts') or []
+    return ''.join(part['text'] for part in parts if 'text' in part and not part.get('thought'))
+
+
+class SSEDecoder:
+    """逐行解析 streamGenerateContent?alt=sse 的响应，每个 data 事件是一个 JSON 响应片段"""
+
+    def __init__(self):
+        self._data = []
+
+    def feed(self, line: str) -> Optional[Dict[str, Any]]:
+        """输入一行，事件结束（空行）时返回解析出的片段"""
+        line = line.rstrip('\r')
+        if not line:
+            return self.flush()
+        if line.startswith('data:'):
+            self._data.append(line[5:].lstrip())
+        return None
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """返回尚未结束的事件（响应末尾没有空行时）"""
+        if not self._data:
+            return None
+        data, self._data = '\n'.join(self._data), []
+        return json_loads(data)
+
+
+class PartialReporter:
+    """按最小间隔把累积的部分文本交给回调，避免每个片段都触发一次写入和推送"""
+
+    def __init__(self, callback: Callable[[str], None], interval: float):
+        self._callback = callback
+        self._interval = interval
+        self._last = 0.0
+        self.text = ""
+
+    def add(self, delta: str):
+        self.text += delta
+        now = time.monotonic()
+        if now - self._last >= self._interval:
+            self._last = now
+            self._callback(self.text)
+
+
+def parse_image_result(result: Dict[str, Any], log_action: str) -> Optional[str]:
+    """从 generateContent 响应中提取图片 data URL，没有图片时返回 None"""
+    if "candidates" in result and len(result["candidates"]) > 0:
+        candidate = result["candidates"][0]
+        if "content" in candidate and "parts" in candidate["content"]:
+            for part in candidate["content"]["parts"]:
+                if "inlineData" in part:
+                    mime_type = part["inlineData"].get("mimeType", "image/png")
+                    image_data = part["inlineData"]["data"]
+                    logger.info(f"[图片API] {log_action}成功，格式: {mime_type}")
+                    return f"data:{mime_type};base64,{image_data}"
+
+        logger.error(f"[图片API] 响应中没有图片数据")
+        return None
+    else:
+        logger.error(f"[图片API] 非预期响应格式: {result}")
+        return None
+
+
+class AIService:
+    """AI 服务类"""
+
+    def __init__(self):
+        """初始化 AI 服务"""
+        # 文字处理配置 (Gemini 原生 API)
+        self.text_api_base = Config.TEXT_API_BASE
+        self.text_api_key = Config.TEXT_API_KEY
+        self.text_model = Config.TEXT_MODEL
+
+        # 图片生成配置 (Gemini 原生 API)
+        self.image_api_base = Config.IMAGE_API_BASE
+        self.image_api_key = Config.IMAGE_API_KEY
+        self.image_model = Config.IMAGE_MODEL
+
+    def with_image_api(self, api_base: str, api_key: str, model: Optional[str] = None) -> 'AIService':
+        """
+        返回改用指定图片上游的副本（单次请求的 api_config 使用）
+
+        共享的服务实例同时被批量任务使用，不能临时改写其配置
+        """
+        service = copy.copy(self)
+        service.image_api_base = api_base
+        service.image_api_key = api_key
+        if model:
+            service.image_model = model
+        return service
+
+    def image_cache_key(self, payload: Dict[str, Any]) -> str:
+        """
+        图片缓存键：命名空间带上图片上游的 origin，
+        前端经 api_config 指定的上游与服务端配置的上游即使模型名相同也不共用缓存结果
+        """
+        return make_cache_key(f"image@{origin_of(self.image_api_base or '')}", self.image_model, payload)
+
+    def description_cache_key(self, payload: Dict[str, Any]) -> str:
+        """描述缓存键：与图片缓存键一样带上文字上游的 origin，不同上游的同名模型不共用缓存结果"""
+        return make_cache_key(f"description@{origin_of(self.text_api_base or '')}", self.text_model, payload)
+
+    def request_target(self, api: str, method: str = GENERATE_METHOD) -> Tuple[str, str, Dict[str, str]]:
+        """
+        返回 api ('text'/'image') 对应的 (api_base, url, headers)
+
+        method 为 STREAM_METHOD 时返回以 SSE 格式流式输出的地址
+        """
+        if api == 'image':
+            api_base, api_key, model = self.image_api_base, self.image_api_key, self.image_model
+        else:
+            api_base, api_key, model = self.text_api_base, self.text_api_key, self.text_model
+
+        url = f"{api_base}/v1beta/models/{model}:{method}"
+        if method == STREAM_METHOD:
+            url += "?alt=sse"
+        headers = {
+            "x-goog-api-key": api_key,
+            "Content-Type": "application/json"
         }
+        return api_base, url, headers
 
-        logger.info(f"[图片API] 生成图片，prompt长度: {len(prompt)}, 比例: {aspect_ratio}, 有模板: {template_base64 is not None}")
+    def generate_content(self, api: str, payload: Dict[str, Any],
+                         timeout: float = 120.0) -> Dict[str, Any]:
+        """
+        调用 Gemini generateContent 接口（复用按 origin 共享的连接池）
+        瞬时错误（5xx、429、超时）按重试策略自动重试
+
+        Args:
+            api: 'text' 或 'image'，决定使用的地址、密钥和模型
+            payload: 请求体
+            timeout: 单次请求超时时间（秒）
+
+        Returns:
+            解析后的 JSON 响应
+        """
+        api_base, url, headers = self.request_target(api)
+        # 请求体只编码一次，重试时复用（含内联图片时可达数 MB）
+        body = json_dumps(payload)
+
+        def post_once() -> Dict[str, Any]:
+            # 自适应并发限制：根据 429/503 与延迟动态调整同时在途的请求数
+            with get_limiter(api).slot() as permit:
+                response = get_http_client(api_base).post(url, content=body, headers=headers, timeout=timeout)
+                permit.observe(response.status_code, response.headers.get('Retry-After'))
+            response.raise_for_status()
+            return json_loads(response.content)
+
+        return get_retry_policy(api).call(post_once)
+
+    def stream_content(self, api: str, payload: Dict[str, Any],
+                       timeout: float = 120.0) -> Iterator[Dict[str, Any]]:
+        """
+        调用 Gemini streamGenerateContent 接口，逐个产出响应片段
+
+        建立连接阶段的瞬时错误按重试策略重试，开始接收后出错直接抛出（已产出的片段无法撤回）；
+        并发名额一直占用到流结束或调用方关闭生成器，每个片段之间检查任务是否已取消
+
+        Args:
+            api: 'text' 或 'image'
+            payload: 请求体
+            timeout: 相邻两个片段之间的最长等待时间（秒）
+        """
+        api_base, url, headers = self.request_target(api, STREAM_METHOD)
+        client = get_http_client(api_base)
+        body = json_dumps(payload)
+
+        def open_once() -> Tuple[ExitStack, httpx.Response]:
+            with ExitStack() as stack:
+                permit = stack.enter_context(get_limiter(api).slot())
+                response = stack.enter_context(client.stream(url, content=body, headers=headers, timeout=timeout))
+                # 延迟按响应头到达的时间统计
+                permit.observe(response.status_code, response.headers.get('Retry-After'))
+                if response.is_error:
+                    response.read()
+                response.raise_for_status()
+                # 连接建立成功，名额和响应交给调用方在流结束时释放
+                return stack.pop_all(), response
+
+        stack, response = get_retry_policy(api).call(open_once)
+        with stack:
+            decoder = SSEDecoder()
+            for line in response.iter_lines():
+                chunk = decoder.feed(line)
+                if chunk is not None:
+                    raise_if_cancelled()
+                    yield chunk
+            chunk = decoder.flush()
+            if chunk is not None:
+                yield chunk
+
+    def _lookup_description(self, payload: Dict[str, Any], shot_number: str,
+                            use_cache: bool) -> Tuple[Any, Optional[str], Optional[str]]:
+        """查询描述缓存，返回 (缓存, 缓存键, 命中的描述)"""
+        cache = get_description_cache()
+        cache_key = self.description_cache_key(payload) if cache else None
+        if cache:
+            if use_cache:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"[文字API] 命中描述缓存，镜号: {shot_number}")
+                    return cache, cache_key, cached
+            else:
+                cache.stats.incr('bypassed')
+        return cache, cache_key, None
+
+    def _stream_description(self, payload: Dict[str, Any], cache: Any,
+                            cache_key: Optional[str]) -> Iterator[str]:
+        """流式生成描述，逐个产出新增文本，完整结束后写入缓存"""
+        started_at = time.monotonic()
+        parts = []
+        for chunk in self.stream_content('text', payload, timeout=120.0):
+            delta = parse_text_delta(chunk)
+            if not delta:
+                continue
+            if not parts:
+                logger.info(f"[文字API] 描述首段到达，耗时: {time.monotonic() - started_at:.2f}s")
+            parts.append(delta)
+            yield delta
+
+        description = ''.join(parts)
+        if not description:
+            logger.error(f"[文字API] 响应中没有文本数据")
+            raise ValueError("API 响应中没有文本数据")
+        logger.info(f"[文字API] 描述流式生成成功，长度: {len(description)}, "
+                    f"总耗时: {time.monotonic() - started_at:.2f}s")
+        if cache:
+            cache.put(cache_key, description)
+
+    def stream_page_description(self, shot_number: str, narration: str, visual_hint: str = None,
+                                custom_prompt: str = None, template_base64: str = None,
+                                use_cache: bool = True) -> Iterator[str]:
+        """
+        流式生成页面描述，逐个产出新增的文本片段（拼接起来即完整描述）
+
+        参数同 generate_page_description；命中缓存时一次产出完整描述
+        """
+        payload = build_description_payload(narration, visual_hint, custom_prompt, template_base64)
+        logger.info(f"[文字API] 流式生成页面描述，镜号: {shot_number}, 有模板: {template_base64 is not None}")
+
+        cache, cache_key, cached = self._lookup_description(payload, shot_number, use_cache)
+        if cached is not None:
+            yield cached
+            return
+        yield from self._stream_description(payload, cache, cache_key)
+
+    def generate_page_description(self, shot_number: str, segment: str,
+                                   narration: str, visual_hint: str = None,
+                                   full_context: str = None, current_index: int = None,
+                                   custom_prompt: str = None, template_base64: str = None,
+                                   use_cache: bool = True,
+                                   on_partial: Optional[Callable[[str], None]] = None) -> str:
+        """
+        生成页面描述
+
+        Args:
+            shot_number: 镜号
+            segment: 环节
+            narration: 讲稿内容
+            visual_hint: 画面提示（可选）
+            full_context: 完整脚本上下文（可选）
+            current_index: 当前页索引（可选）
+            custom_prompt: 自定义提示词（必须由前端传递）
+            template_base64: 模板图片base64 或模板库中的 TemplateImage（可选，有模板时分析风格）
+            use_cache: 是否使用描述缓存，False 时强制请求上游（结果仍会写入缓存）
+            on_partial: 可选，提供时流式生成，按 STREAM_PARTIAL_INTERVAL 间隔传入已生成的部分描述
+
+        Returns:
+            生成的页面描述
+        """
+        payload = build_description_payload(narration, visual_hint, custom_prompt, template_base64)
+        logger.info(f"[文字API] 生成页面描述，镜号: {shot_number}, 有模板: {template_base64 is not None}")
 
+        cache, cache_key, cached = self._lookup_description(payload, shot_number, use_cache)
+        if cached is not None:
+            return cached
+
+        try:
+            if on_partial is not None:
+                reporter = PartialReporter(on_partial, Config.STREAM_PARTIAL_INTERVAL)
+                try:
+                    for delta in self._stream_description(payload, cache, cache_key):
+                        reporter.add(delta)
+                    return reporter.text
+                except Exception as e:
+                    # 已收到部分内容后连接中断：改用普通请求重新生成（建立连接阶段的错误已按策略重试过）
+                    if not reporter.text or not is_retryable(e):
+                        raise
+                    logger.warning(f"[文字API] 描述流式传输中断，改用普通请求: {e}")
+
+            return self._request_description(payload, cache, cache_key)
+
+        except httpx.HTTPStatusError as e:
+            logger.error(f"[文字API] HTTP 错误 {e.response.status_code}: {e.response.text[:200]}")
+            raise
+        except Exception as e:
+            logger.error(f"[文字API] 生成页面描述失败: {e}")
+            raise
+
+    def _request_description(self, payload: Dict[str, Any], cache: Any, cache_key: Optional[str]) -> str:
+        """普通请求生成单页描述，成功后写入缓存"""
+        result = self.generate_content('text', payload, timeout=120.0)
+        description = parse_text_result(result)
+        logger.info(f"[文字API] 描述生成成功，长度: {len(description)}")
+        if cache:
+            cache.put(cache_key, description)
+        return description
+
+    def generate_page_descriptions(self, pages: List[Dict[str, Any]], custom_prompt: str = None,
+                                   template_base64: str = None,
+                                   use_cache: bool = True) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """
+        一次请求生成多个页面的描述，提示词和模板图片只发送一次
+
+        与单页生成共用描述缓存（缓存键按单页请求体计算），只有未命中的页面进入请求；
+        返回不完整时只重试缺失的页面，整组失败时对半拆分重试，拆到单页时按单页请求生成
+
+        Args:
+            pages: 页面数据列表，每项包含 id、narration，可选 visual_hint、shot_number
+            custom_prompt: 自定义提示词（同单页生成）
+            template_base64: 模板图片base64 或模板库中的 TemplateImage（可选）
+            use_cache: 是否使用描述缓存
+
+        Returns:
+            (页面 id -> 描述, 失败的页面 id -> 错误信息)
+        """
+        descriptions: Dict[str, str] = {}
+        errors: Dict[str, str] = {}
+        items = []
+        cache = None
+        for page in pages:
+            payload = build_description_payload(page['narration'], page.get('visual_hint'),
+                                                custom_prompt, template_base64)
+            cache, cache_key, cached = self._lookup_description(payload, page.get('shot_number', ''), use_cache)
+            if cached is not None:
+                descriptions[page['id']] = cached
+            else:
+                items.append({**page, 'payload': payload, 'cache_key': cache_key})
+
+        if items:
+            logger.info(f"[文字API] 多页生成页面描述，共 {len(pages)} 页，命中缓存 {len(pages) - len(items)} 页")
+            self._describe_batch(items, custom_prompt, template_base64, cache, descriptions, errors)
+        return descriptions, errors
+
+    def _describe_batch(self, items: List[Dict[str, Any]], custom_prompt: str, template_base64: Optional[str],
+                        cache: Any, descriptions: Dict[str, str], errors: Dict[str, str]):
+        """生成一组页面的描述，结果写入 descriptions / errors"""
+        if len(items) == 1:
+            item = items[0]
+            try:
+                descriptions[item['id']] = self._request_description(item['payload'], cache, item['cache_key'])
+            except TaskCancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[文字API] 生成页面描述失败: {e}")
+                errors[item['id']] = str(e)
+            return
+
+        payload = build_batch_description_payload(items, custom_prompt, template_base64)
         try:
+            result = self.generate_content('text', payload, timeout=Config.DESCRIPTION_BATCH_TIMEOUT)
+            returned = parse_batch_description_result(result)
+        except Exception as e:
+            if isinstance(e, TaskCancelledError):
+                raise
+            if not should_split_batch(e):
+                logger.error(f"[文字API] 多页描述请求失败（{len(items)} 页）: {e}")
+                errors.update({item['id']: str(e) for item in items})
+                return
+            logger.warning(f"[文字API] 多页描述请求失败（{len(items)} 页），拆分重试: {e}")
+            returned = {}
+        logger.info(f"[文字API] 多页描述返回 {len(returned)}/{len(items)} 页")
+
+        for group in plan_batch_retry(items, returned, descriptions, cache):
+            self._describe_batch(group, custom_prompt, template_base64, cache, descriptions, errors)
+
+    def _request_image(self, payload: Dict[str, Any], log_action: str,
+                       use_cache: bool = True, as_blob: bool = False) -> Optional[str]:
+        """
+        发送图片请求并经过图片结果缓存（generate_image 与 _call_gemini_image_api 共用）
+
+        上游返回的 base64 只解码一次，缓存和图片存储都保存解码后的字节
+
+        Args:
+            payload: 请求体
+            log_action: 日志中的操作描述
+            use_cache: 是否读取缓存，False 时强制请求上游（结果仍会写入缓存）
+            as_blob: True 时把图片写入图片存储并返回图片 ID，而不是 data URL
+
+        Returns:
+            图片 data URL（as_blob 时为图片 ID），没有图片时返回 None
+        """
+        cache = get_image_cache()
+        cache_key = self.image_cache_key(payload) if cache else None
+        image = None
+        if cache:
+            if use_cache:
+                image = cache.get(cache_key)
+                if image is not None:
+                    logger.info(f"[图片API] 命中图片缓存: {log_action}")
+            else:
+                cache.stats.incr('bypassed')
+
+        if image is None:
             # 图片生成可能需要较长时间，设置 5 分钟超时
-            with httpx.Client(timeout=300.0) as client:
-                response = client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
+            result = self.generate_content('image', payload, timeout=300.0)
+            parts = split_data_url(parse_image_result(result, log_action))
+            if parts is None:
+                return None
+            mime_type, data = parts
+            image = base64.b64decode(data), mime_type
+            if cache:
+                cache.put(cache_key, *image)
+
+        data, mime_type = image
+        if as_blob:
+            return get_blob_store().put(data, mime_type)
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
 
-                result = response.json()
-
-                # 从 Gemini 响应中提取图片
-                if "candidates" in result and len(result["candidates"]) > 0:
-                    candidate = result["candidates"][0]
-                    if "content" in candidate and "parts" in candidate["content"]:
-                        for part in candidate["content"]["parts"]:
-                            if "inlineData" in part:
-                                mime_type = part["inlineData"].get("mimeType", "image/png")
-                                image_data = part["inlineData"]["data"]
-                                logger.info(f"[图片API] 图片生成成功，格式: {mime_type}")
-                                return f"data:{mime_type};base64,{image_data}"
-
-                    logger.error(f"[图片API] 响应中没有图片数据")
-                    return None
-                else:
-                    logger.error(f"[图片API] 非预期响应格式: {result}")
-                    return None
+    def generate_image(self, prompt: str, aspect_ratio: str = "16:9",
+                       template_base64: str = None, use_cache: bool = True,
+                       as_blob: bool = False) -> Optional[str]:
+        """
+        使用 Gemini 原生 API 生成图片
+
+        Args:
+            prompt: 图片描述
+            aspect_ratio: 宽高比
+            template_base64: 模板图片的 base64 数据或模板库中的 TemplateImage（可选）
+            use_cache: 是否使用图片缓存
+            as_blob: True 时返回图片存储中的图片 ID
+
+        Returns:
+            base64 编码的图片数据（as_blob 时为图片 ID）
+        """
+        payload = build_image_payload(prompt, template_base64)
+
+        logger.info(f"[图片API] 生成图片，prompt长度: {len(prompt)}, 比例: {aspect_ratio}, 有模板: {template_base64 is not None}")
+
+        try:
+            return self._request_image(payload, "图片生成", use_cache, as_blob)
 
         except httpx.HTTPStatusError as e:
             logger.error(f"[图片API] HTTP 错误 {e.response.status_code}: {e.response.text[:200]}")
@@ -293,7 +861,9 @@ class AIService:
                            page_type: str = "content",
                            aspect_ratio: str = "16:9",
                            template_base64: str = None,
-                           custom_prompt: str = None) -> Optional[str]:
+                           custom_prompt: str = None,
+                           use_cache: bool = True,
+                           as_blob: bool = False) -> Optional[str]:
         """
         生成 PPT 页面图片
 
@@ -302,27 +872,23 @@ class AIService:
             description: 页面描述（可选，如果没有则根据 narration 生成）
             page_type: 页面类型 (cover/content/ending)
             aspect_ratio: 宽高比
-            template_base64: 模板图片的 base64 数据（可选）
+            template_base64: 模板图片的 base64 数据或模板库中的 TemplateImage（可选）
             custom_prompt: 自定义提示词（必须由前端传递）
+            use_cache: 是否使用图片缓存
+            as_blob: True 时返回图片存储中的图片 ID
 
         Returns:
-            base64 编码的图片
+            base64 编码的图片（as_blob 时为图片 ID）
         """
-        # 必须提供自定义提示词
-        if not custom_prompt:
-            raise ValueError("必须提供 custom_prompt 参数，提示词由前端统一管理")
-
-        # 使用自定义提示词并替换变量
-        # 同时支持 {{script}} 和 {{narration}} 两种变量名
-        prompt = custom_prompt.replace('{{script}}', narration).replace('{{narration}}', narration)
-        if description:
-            prompt = prompt.replace('{{description}}', description)
+        prompt = render_ppt_image_prompt(narration, description, custom_prompt)
         logger.info(f"[图片API] 使用自定义提示词生成PPT图片，类型: {page_type}")
 
-        return self.generate_image(prompt, aspect_ratio, template_base64)
+        return self.generate_image(prompt, aspect_ratio, template_base64, use_cache, as_blob)
 
     def _call_gemini_image_api(self, prompt: str, image_base64: str = None,
-                                 log_action: str = "处理图片") -> Optional[str]:
+                                 log_action: str = "处理图片",
+                                 use_cache: bool = True,
+                                 as_blob: bool = False) -> Optional[str]:
         """
         通用的 Gemini 图片生成 API 调用
 
@@ -330,70 +896,18 @@ class AIService:
             prompt: 提示词
             image_base64: 输入图片的 base64 数据（可选）
             log_action: 日志中的操作描述
+            use_cache: 是否使用图片缓存
+            as_blob: True 时返回图片存储中的图片 ID
 
         Returns:
-            生成的图片 base64 数据
+            生成的图片 base64 数据（as_blob 时为图片 ID）
         """
-        url = f"{self.image_api_base}/v1beta/models/{self.image_model}:generateContent"
-        headers = {
-            "x-goog-api-key": self.image_api_key,
-            "Content-Type": "application/json"
-        }
-
-        parts = [{"text": prompt}]
-
-        # 如果有输入图片，添加到 parts
-        if image_base64:
-            if image_base64.startswith('data:'):
-                match = re.match(r'data:(image/[^;]+);base64,(.+)', image_base64)
-                if match:
-                    mime_type = match.group(1)
-                    image_data = match.group(2)
-                    parts.append({
-                        "inline_data": {
-                            "mime_type": mime_type,
-                            "data": image_data
-                        }
-                    })
-                else:
-                    logger.warning(f"[图片API] 输入图片 data URL 格式无效，跳过图片")
-
-        payload = {
-            "contents": [{"parts": parts}],
-            "generationConfig": {
-                "responseModalities": ["TEXT", "IMAGE"],
-                "imageConfig": {
-                    "aspectRatio": "16:9",
-                    "imageSize": "2K"
-                }
-            }
-        }
+        payload = build_image_edit_payload(prompt, image_base64)
 
         logger.info(f"[图片API] {log_action}")
 
         try:
-            # 图片生成可能需要较长时间，设置 5 分钟超时
-            with httpx.Client(timeout=300.0) as client:
-                response = client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
-
-                result = response.json()
-
-                if "candidates" in result and len(result["candidates"]) > 0:
-                    candidate = result["candidates"][0]
-                    if "content" in candidate and "parts" in candidate["content"]:
-                        for part in candidate["content"]["parts"]:
-                            if "inlineData" in part:
-                                mime_type = part["inlineData"].get("mimeType", "image/png")
-                                image_data = part["inlineData"]["data"]
-                                logger.info(f"[图片API] {log_action}成功，格式: {mime_type}")
-                                return f"data:{mime_type};base64,{image_data}"
-
-                    logger.error(f"[图片API] 响应中没有图片数据")
-                    return None
-                else:
-                    logger.error(f"[图片API] 非预期响应格式: {result}")
-                    return None
+            return self._request_image(payload, log_action, use_cache, as_blob)
 
         except httpx.HTTPStatusError as e:
             logger.error(f"[图片API] HTTP 错误 {e.response.status_code}: {e.response.text[:200]}")
@@ -402,15 +916,18 @@ class AIService:
             logger.error(f"[图片API] {log_action}失败: {e}")
             raise
 
-    def extract_illustration(self, cropped_image_base64: str) -> Optional[str]:
+    def extract_illustration(self, cropped_image_base64: str, use_cache: bool = True,
+                                as_blob: bool = False) -> Optional[str]:
         """
         从裁剪的图片中提取插画并重新生成
 
         Args:
             cropped_image_base64: 裁剪后的图片 base64 数据
+            use_cache: 是否使用图片缓存
+            as_blob: True 时返回图片存储中的图片 ID
 
         Returns:
-            生成的插画 base64 数据
+            生成的插画 base64 数据（as_blob 时为图片 ID）
         """
         prompt = """请仔细观察这张PPT中被裁剪出的插画区域，然后重新生成一张相似风格但更精美的插画。
 
@@ -423,17 +940,20 @@ class AIService:
 
 直接生成图片，不要输出任何文字说明。"""
 
-        return self._call_gemini_image_api(prompt, cropped_image_base64, "提取插画")
+        return self._call_gemini_image_api(prompt, cropped_image_base64, "提取插画", use_cache, as_blob)
 
-    def remove_template_background(self, image_base64: str) -> Optional[str]:
+    def remove_template_background(self, image_base64: str, use_cache: bool = True,
+                                      as_blob: bool = False) -> Optional[str]:
         """
         去除PPT图片中的模板背景元素，只保留核心设计内容
 
         Args:
             image_base64: 原始PPT图片的 base64 数据
+            use_cache: 是否使用图片缓存
+            as_blob: True 时返回图片存储中的图片 ID
 
         Returns:
-            去除背景后的图片 base64 数据
+            去除背景后的图片 base64 数据（as_blob 时为图片 ID）
         """
         prompt = """请仔细观察这张PPT图片，然后重新生成一张只包含核心内容的图片。
 
@@ -447,17 +967,20 @@ class AIService:
 
 直接生成图片，不要输出任何文字说明。"""
 
-        return self._call_gemini_image_api(prompt, image_base64, "去除模板背景")
+        return self._call_gemini_image_api(prompt, image_base64, "去除模板背景", use_cache, as_blob)
 
-    def clean_slide_image(self, image_base64: str) -> Optional[str]:
+    def clean_slide_image(self, image_base64: str, use_cache: bool = True,
+                             as_blob: bool = False) -> Optional[str]:
         """
         清洗PPT图片：去除模板装饰和文字，保留核心内容
 
         Args:
             image_base64: 原始PPT图片的 base64 数据
+            use_cache: 是否使用图片缓存
+            as_blob: True 时返回图片存储中的图片 ID
 
         Returns:
-            清洗后的图片 base64 数据
+            清洗后的图片 base64 数据（as_blob 时为图片 ID）
         """
         prompt = """请仔细观察这张PPT图片，然后重新生成一张干净的图片。
 
@@ -482,7 +1005,7 @@ class AIService:
 
 直接生成图片，不要输出任何文字说明。"""
 
-        return self._call_gemini_image_api(prompt, image_base64, "清洗PPT图片")
+        return self._call_gemini_image_api(prompt, image_base64, "清洗PPT图片", use_cache, as_blob)
 
 
 # 单例实例和锁
@@ -0,0 +1,288 @@
+"""
+异步 AI 服务 - AIService 的 asyncio 版本
+基于 httpx.AsyncClient，供 asyncio 生成引擎在单个事件循环上并发大量页面请求
+请求体构建与响应解析与 AIService 共用
+"""
+import time
+import logging
+import threading
+from contextlib import AsyncExitStack
+from typing import Optional, Dict, Any, AsyncIterator, Callable, Tuple, List
+
+import httpx
+
+from config import Config
+from utils.json_codec import dumps as json_dumps, loads as json_loads
+from .ai_service import (
+    get_ai_service, build_description_payload, build_image_payload,
+    render_ppt_image_prompt, parse_text_result, parse_text_delta, parse_image_result,
+    SSEDecoder, PartialReporter, STREAM_METHOD,
+    build_batch_description_payload, parse_batch_description_result, should_split_batch, plan_batch_retry
+)
+from .http_client import get_async_http_client
+from .cache import get_description_cache, get_image_cache
+from .cancellation import TaskCancelledError, raise_if_cancelled
+from .concurrency import get_limiter
+from .retry import get_retry_policy, is_retryable
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAIService:
+    """异步 AI 服务类"""
+
+    def __init__(self):
+        # 地址、密钥和模型与同步服务保持一致
+        self._sync_service = get_ai_service()
+
+    async def generate_content(self, api: str, payload: Dict[str, Any],
+                               timeout: float = 120.0) -> Dict[str, Any]:
+        """
+        异步调用 Gemini generateContent 接口
+
+        Args:
+            api: 'text' 或 'image'
+            payload: 请求体
+            timeout: 单次请求超时时间（秒）
+
+        Returns:
+            解析后的 JSON 响应
+        """
+        api_base, url, headers = self._sync_service.request_target(api)
+        client = get_async_http_client(api_base)
+        body = json_dumps(payload)
+
+        async def post_once() -> Dict[str, Any]:
+            # 与同步服务共用自适应并发限制器
+            async with get_limiter(api).slot_async() as permit:
+                response = await client.post(url, content=body, headers=headers, timeout=timeout)
+                permit.observe(response.status_code, response.headers.get('Retry-After'))
+            response.raise_for_status()
+            return json_loads(response.content)
+
+        # 与同步服务共用重试策略
+        return await get_retry_policy(api).acall(post_once)
+
+    async def stream_content(self, api: str, payload: Dict[str, Any],
+                             timeout: float = 120.0) -> AsyncIterator[Dict[str, Any]]:
+        """异步调用 streamGenerateContent 接口，参数与行为同 AIService.stream_content"""
+        api_base, url, headers = self._sync_service.request_target(api, STREAM_METHOD)
+        client = get_async_http_client(api_base)
+        body = json_dumps(payload)
+
+        async def open_once() -> Tuple[AsyncExitStack, httpx.Response]:
+            async with AsyncExitStack() as stack:
+                permit = await stack.enter_async_context(get_limiter(api).slot_async())
+                response = await stack.enter_async_context(
+                    client.stream(url, content=body, headers=headers, timeout=timeout)
+                )
+                permit.observe(response.status_code, response.headers.get('Retry-After'))
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                return stack.pop_all(), response
+
+        stack, response = await get_retry_policy(api).acall(open_once)
+        async with stack:
+            decoder = SSEDecoder()
+            async for line in response.aiter_lines():
+                chunk = decoder.feed(line)
+                if chunk is not None:
+                    raise_if_cancelled()
+                    yield chunk
+            chunk = decoder.flush()
+            if chunk is not None:
+                yield chunk
+
+    async def _stream_description(self, payload: Dict[str, Any], reporter: PartialReporter,
+                                  cache: Any, cache_key: Optional[str]) -> str:
+        """流式生成描述，部分文本交给 reporter，完整结束后写入缓存"""
+        started_at = time.monotonic()
+        async for chunk in self.stream_content('text', payload, timeout=120.0):
+            delta = parse_text_delta(chunk)
+            if not delta:
+                continue
+            if not reporter.text:
+                logger.info(f"[文字API] 描述首段到达，耗时: {time.monotonic() - started_at:.2f}s")
+            reporter.add(delta)
+
+        description = reporter.text
+        if not description:
+            logger.error(f"[文字API] 响应中没有文本数据")
+            raise ValueError("API 响应中没有文本数据")
+        logger.info(f"[文字API] 描述流式生成成功，长度: {len(description)}, "
+                    f"总耗时: {time.monotonic() - started_at:.2f}s")
+        if cache:
+            cache.put(cache_key, description)
+        return description
+
+    async def generate_page_description(self, shot_number: str, segment: str,
+                                        narration: str, visual_hint: str = None,
+                                        custom_prompt: str = None,
+                                        template_base64: str = None,
+                                        use_cache: bool = True,
+                                        on_partial: Optional[Callable[[str], None]] = None) -> str:
+        """异步生成页面描述，参数同 AIService.generate_page_description"""
+        payload = build_description_payload(narration, visual_hint, custom_prompt, template_base64)
+        logger.info(f"[文字API] 异步生成页面描述，镜号: {shot_number}, 有模板: {template_base64 is not None}")
+
+        cache = get_description_cache()
+        cache_key = self._sync_service.description_cache_key(payload) if cache else None
+        if cache:
+            if use_cache:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"[文字API] 命中描述缓存，镜号: {shot_number}")
+                    return cached
+            else:
+                cache.stats.incr('bypassed')
+
+        try:
+            if on_partial is not None:
+                reporter = PartialReporter(on_partial, Config.STREAM_PARTIAL_INTERVAL)
+                try:
+                    return await self._stream_description(payload, reporter, cache, cache_key)
+                except Exception as e:
+                    # 已收到部分内容后连接中断：改用普通请求重新生成
+                    if not reporter.text or not is_retryable(e):
+                        raise
+                    logger.warning(f"[文字API] 描述流式传输中断，改用普通请求: {e}")
+
+            return await self._request_description(payload, cache, cache_key)
+
+        except httpx.HTTPStatusError as e:
+            logger.error(f"[文字API] HTTP 错误 {e.response.status_code}: {e.response.text[:200]}")
+            raise
+        except Exception as e:
+            logger.error(f"[文字API] 生成页面描述失败: {e}")
+            raise
+
+    async def _request_description(self, payload: Dict[str, Any], cache: Any, cache_key: Optional[str]) -> str:
+        """普通请求生成单页描述，成功后写入缓存"""
+        result = await self.generate_content('text', payload, timeout=120.0)
+        description = parse_text_result(result)
+        logger.info(f"[文字API] 描述生成成功，长度: {len(description)}")
+        if cache:
+            cache.put(cache_key, description)
+        return description
+
+    async def generate_page_descriptions(self, pages: List[Dict[str, Any]], custom_prompt: str = None,
+                                         template_base64: str = None,
+                                         use_cache: bool = True) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """异步生成多个页面的描述，参数和返回值同 AIService.generate_page_descriptions"""
+        descriptions: Dict[str, str] = {}
+        errors: Dict[str, str] = {}
+        items = []
+        cache = get_description_cache()
+        for page in pages:
+            payload = build_description_payload(page['narration'], page.get('visual_hint'),
+                                                custom_prompt, template_base64)
+            cache_key = self._sync_service.description_cache_key(payload) if cache else None
+            cached = None
+            if cache:
+                if use_cache:
+                    cached = cache.get(cache_key)
+                else:
+                    cache.stats.incr('bypassed')
+            if cached is not None:
+                descriptions[page['id']] = cached
+            else:
+                items.append({**page, 'payload': payload, 'cache_key': cache_key})
+
+        if items:
+            logger.info(f"[文字API] 异步多页生成页面描述，共 {len(pages)} 页，命中缓存 {len(pages) - len(items)} 页")
+            await self._describe_batch(items, custom_prompt, template_base64, cache, descriptions, errors)
+        return descriptions, errors
+
+    async def _describe_batch(self, items: List[Dict[str, Any]], custom_prompt: str,
+                              template_base64: Optional[str], cache: Any,
+                              descriptions: Dict[str, str], errors: Dict[str, str]):
+        """生成一组页面的描述，结果写入 descriptions / errors"""
+        if len(items) == 1:
+            item = items[0]
+            try:
+                descriptions[item['id']] = await self._request_description(item['payload'], cache, item['cache_key'])
+            except TaskCancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[文字API] 生成页面描述失败: {e}")
+                errors[item['id']] = str(e)
+            return
+
+        payload = build_batch_description_payload(items, custom_prompt, template_base64)
+        try:
+            result = await self.generate_content('text', payload, timeout=Config.DESCRIPTION_BATCH_TIMEOUT)
+            returned = parse_batch_description_result(result)
+        except Exception as e:
+            if isinstance(e, TaskCancelledError):
+                raise
+            if not should_split_batch(e):
+                logger.error(f"[文字API] 多页描述请求失败（{len(items)} 页）: {e}")
+                errors.update({item['id']: str(e) for item in items})
+                return
+            logger.warning(f"[文字API] 多页描述请求失败（{len(items)} 页），拆分重试: {e}")
+            returned = {}
+        logger.info(f"[文字API] 多页描述返回 {len(returned)}/{len(items)} 页")
+
+        for group in plan_batch_retry(items, returned, descriptions, cache):
+            await self._describe_batch(group, custom_prompt, template_base64, cache, descriptions, errors)
+
+    async def generate_image(self, prompt: str, aspect_ratio: str = "16:9",
+                             template_base64: str = None, use_cache: bool = True) -> Optional[str]:
+        """异步生成图片，参数同 AIService.generate_image"""
+        payload = build_image_payload(prompt, template_base64)
+        logger.info(f"[图片API] 异步生成图片，prompt长度: {len(prompt)}, 比例: {aspect_ratio}, 有模板: {template_base64 is not None}")
+
+        cache = get_image_cache()
+        cache_key = self._sync_service.image_cache_key(payload) if cache else None
+        if cache:
+            if use_cache:
+                cached = cache.get_data_url(cache_key)
+                if cached is not None:
+                    logger.info(f"[图片API] 命中图片缓存: 图片生成")
+                    return cached
+            else:
+                cache.stats.incr('bypassed')
+
+        try:
+            # 图片生成可能需要较长时间，设置 5 分钟超时
+            result = await self.generate_content('image', payload, timeout=300.0)
+            image = parse_image_result(result, "图片生成")
+            if image and cache:
+                cache.put_data_url(cache_key, image)
+            return image
+
+        except httpx.HTTPStatusError as e:
+            logger.error(f"[图片API] HTTP 错误 {e.response.status_code}: {e.response.text[:200]}")
+            raise
+        except Exception as e:
+            logger.error(f"[图片API] 生成图片失败: {e}")
+            raise
+
+    async def generate_ppt_image(self, narration: str, description: str = None,
+                                 page_type: str = "content",
+                                 aspect_ratio: str = "16:9",
+                                 template_base64: str = None,
+                                 custom_prompt: str = None,
+                                 use_cache: bool = True) -> Optional[str]:
+        """异步生成 PPT 页面图片，参数同 AIService.generate_ppt_image"""
+        prompt = render_ppt_image_prompt(narration, description, custom_prompt)
+        logger.info(f"[图片API] 使用自定义提示词生成PPT图片，类型: {page_type}")
+
+        return await self.generate_image(prompt, aspect_ratio, template_base64, use_cache)
+
+
+# 单例实例和锁
+_async_ai_service: Optional[AsyncAIService] = None
+_async_ai_service_lock = threading.Lock()
+
+
+def get_async_ai_service() -> AsyncAIService:
+    """获取异步 AI 服务单例（线程安全）"""
+    global _async_ai_service
+    if _async_ai_service is None:
+        with _async_ai_service_lock:
+            # 双重检查锁定
+            if _async_ai_service is None:
+                _async_ai_service = AsyncAIService()
+    return _async_ai_service
@@ -0,0 +1,231 @@
+"""
+图片 Blob 存储
+生成或上传的图片按内容寻址（SHA-256）保存为文件，接口之间传递短小的图片 ID 和 URL，
+而不是在 JSON 中来回传输数 MB 的 base64 data URL
+"""
+import os
+import re
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from .cache import CacheStats, IMAGE_EXTENSIONS, IMAGE_MIME_TYPES, split_data_url
+
+logger = logging.getLogger(__name__)
+
+_IMAGE_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_image_id(value: Any) -> bool:
+    """是否为合法的图片 ID（SHA-256 十六进制）"""
+    return isinstance(value, str) and bool(_IMAGE_ID_RE.match(value))
+
+
+class BlobStore:
+    """
+    内容寻址的图片存储
+
+    每张图片一个 <sha256>.<ext> 文件，相同内容只保存一份；按总字节数限制，
+    超出时淘汰最久未使用的图片。内存中只保存 ID -> (文件名, 大小, 最近使用时间) 的 LRU 索引，
+    启动时按文件修改时间重建。
+
+    客户端拿到图片 ID 后还会回来读取或导出，最近 min_retention 秒内写入或读取过的图片不会被淘汰，
+    此时磁盘用量可以暂时超过上限，等这些图片过了保留期再回收
+    """
+
+    def __init__(self, folder: str, max_bytes: int, min_retention: float = 0):
+        # send_file 会把相对路径按 Flask 应用根目录解析，这里统一转成绝对路径
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        self.min_retention = min_retention
+        self.stats = CacheStats()
+
+        self._index: "OrderedDict[str, Tuple[str, int, float]]" = OrderedDict()
+        self._usage = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.folder, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            image_id, _, ext = name.partition('.')
+            if ext not in IMAGE_MIME_TYPES or not is_image_id(image_id):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, image_id, name, stat.st_size))
+        for used_at, image_id, name, size in sorted(entries):
+            self._index[image_id] = (name, size, used_at)
+            self._usage += size
+
+    def put(self, data: bytes, mime_type: str) -> Optional[str]:
+        """保存图片字节，返回图片 ID；不支持的图片类型返回 None"""
+        ext = IMAGE_EXTENSIONS.get(mime_type)
+        if ext is None:
+            logger.warning(f"[图片存储] 不支持的图片类型: {mime_type}")
+            return None
+        image_id = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            existing = self._use_locked(image_id)
+        if existing is not None:
+            # 内容相同的图片已存在，只刷新 LRU 顺序
+            self._touch(existing[0])
+            self.stats.incr('disk_hits')
+            return image_id
+
+        name = f"{image_id}.{ext}"
+        path = os.path.join(self.folder, name)
+        try:
+            # 先写临时文件再原子替换，避免并发读到半个文件
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"[图片存储] 写入图片失败 {path}: {e}")
+            raise
+
+        with self._lock:
+            if self._use_locked(image_id) is None:
+                self._index[image_id] = (name, len(data), time.time())
+                self._usage += len(data)
+            evicted = self._evict_locked()
+        self.stats.incr('writes')
+
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.folder, old_name))
+            except OSError:
+                pass
+            self.stats.incr('evictions')
+        return image_id
+
+    def put_data_url(self, data_url: str) -> Optional[str]:
+        """解码 data URL 后保存，格式无效时返回 None"""
+        parts = split_data_url(data_url)
+        if parts is None:
+            return None
+        mime_type, data = parts
+        try:
+            image_bytes = base64.b64decode(data)
+        except ValueError:
+            return None
+        return self.put(image_bytes, mime_type)
+
+    def _use_locked(self, image_id: str) -> Optional[Tuple[str, int, float]]:
+        """刷新图片的 LRU 顺序和最近使用时间（调用方持有 self._lock）"""
+        entry = self._index.get(image_id)
+        if entry is None:
+            return None
+        entry = (entry[0], entry[1], time.time())
+        self._index[image_id] = entry
+        self._index.move_to_end(image_id)
+        return entry
+
+    def _evict_locked(self) -> List[str]:
+        """按 LRU 顺序淘汰超出容量的图片，返回待删除的文件名（调用方持有 self._lock）"""
+        evicted = []
+        cutoff = time.time() - self.min_retention
+        while self._usage > self.max_bytes and len(self._index) > 1:
+            _, (_, _, used_at) = next(iter(self._index.items()))
+            # 索引按使用时间排序，最旧的一张仍在保留期内时其余图片也都在保留期内
+            if used_at > cutoff:
+                break
+            _, (old_name, old_size, _) = self._index.popitem(last=False)
+            self._usage -= old_size
+            evicted.append(old_name)
+        return evicted
+
+    def _touch(self, name: str):
+        # 更新修改时间，重启后仍能保持 LRU 顺序
+        try:
+            os.utime(os.path.join(self.folder, name))
+        except OSError:
+            pass
+
+    def locate(self, image_id: str) -> Optional[Tuple[str, str]]:
+        """
+        查找图片文件，返回 (文件路径, mime_type)，不存在时返回 None
+
+        查找同时刷新最近使用时间，保留期内返回的路径不会被淘汰删除
+        """
+        if not is_image_id(image_id):
+            return None
+        with self._lock:
+            entry = self._use_locked(image_id)
+        if entry is None:
+            self.stats.incr('misses')
+            return None
+
+        name = entry[0]
+        path = os.path.join(self.folder, name)
+        if not os.path.exists(path):
+            with self._lock:
+                removed = self._index.pop(image_id, None)
+                if removed:
+                    self._usage -= removed[1]
+            self.stats.incr('misses')
+            return None
+        self._touch(name)
+        self.stats.incr('disk_hits')
+        return path, IMAGE_MIME_TYPES[name.partition('.')[2]]
+
+    def read(self, image_id: str) -> Optional[Tuple[bytes, str]]:
+        """读取图片，返回 (图片字节, mime_type)"""
+        located = self.locate(image_id)
+        if located is None:
+            return None
+        path, mime_type = located
+        try:
+            with open(path, 'rb') as f:
+                return f.read(), mime_type
+        except OSError:
+            return None
+
+    def get_data_url(self, image_id: str) -> Optional[str]:
+        """读取图片并编码为 data URL（作为上游请求的输入图片时使用）"""
+        entry = self.read(image_id)
+        if entry is None:
+            return None
+        data, mime_type = entry
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.stats.to_dict()
+        with self._lock:
+            data.update({
+                'entries': len(self._index),
+                'disk_bytes': self._usage,
+                'max_disk_bytes': self.max_bytes
+            })
+        return data
+
+
+# 单例实例和锁
+_blob_store: Optional[BlobStore] = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """获取图片存储单例（线程安全）"""
+    global _blob_store
+    if _blob_store is None:
+        with _blob_store_lock:
+            # 双重检查锁定
+            if _blob_store is None:
+                _blob_store = BlobStore(
+                    folder=Config.BLOB_STORE_FOLDER,
+                    max_bytes=Config.BLOB_STORE_MAX_MB * 1024 * 1024,
+                    min_retention=Config.BLOB_STORE_MIN_RETENTION
+                )
+    return _blob_store
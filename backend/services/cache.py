@@ -0,0 +1,420 @@
+"""
+生成结果缓存
+按内容寻址：键为最终请求内容（提示词、输入/模板图片、模型、生成配置）的哈希，
+相同输入直接复用上次的生成结果，不再请求上游
+"""
+import os
+import time
+import base64
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import Config
+from utils.json_codec import dumps as json_dumps, loads as json_loads
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(namespace: str, model: str, payload: Dict[str, Any]) -> str:
+    """
+    计算内容寻址的缓存键
+
+    payload 为发往上游的完整请求体，已包含最终提示词、模板图片数据和生成配置，
+    因此任一输入变化都会得到不同的键
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{namespace}\0{model}\0".encode('utf-8'))
+    digest.update(json_dumps(payload, sort_keys=True))
+    return digest.hexdigest()
+
+
+class CacheStats:
+    """缓存命中统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'bypassed': self.bypassed,
+                'hit_ratio': round(hits / lookups, 3) if lookups else 0.0
+            }
+
+
+class DescriptionCache:
+    """
+    页面描述两级缓存：内存 LRU + 磁盘存储
+
+    - 内存层按条目数限制，超出时淘汰最久未使用的条目
+    - 磁盘层每个条目一个 JSON 文件，按总字节数限制，超出时删除最旧的文件
+    - 两层都按 TTL 过期（ttl <= 0 表示不过期）
+    """
+
+    def __init__(self, folder: str, ttl: float, memory_entries: int, disk_bytes: int):
+        self.folder = folder
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_bytes = disk_bytes
+        self.stats = CacheStats()
+
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+
+        os.makedirs(self.folder, exist_ok=True)
+        self._disk_usage = self._scan_disk_usage()
+
+    def _path_for(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], f"{key}.json")
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def _scan_disk_usage(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，未命中返回 None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._expired(created_at):
+                    self._memory.move_to_end(key)
+                    self.stats.incr('memory_hits')
+                    return value
+                del self._memory[key]
+
+        entry = self._read_disk(key)
+        if entry is None:
+            self.stats.incr('misses')
+            return None
+
+        value, created_at = entry
+        self._put_memory(key, value, created_at)
+        self.stats.incr('disk_hits')
+        return value
+
+    def put(self, key: str, value: str):
+        """写入缓存（内存 + 磁盘）"""
+        created_at = time.time()
+        self._put_memory(key, value, created_at)
+        self._write_disk(key, value, created_at)
+        self.stats.incr('writes')
+
+    def _put_memory(self, key: str, value: str, created_at: float):
+        with self._lock:
+            self._memory[key] = (value, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[Tuple[str, float]]:
+        path = self._path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = json_loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"[缓存] 读取缓存文件失败 {path}: {e}")
+            return None
+
+        if self._expired(entry.get('created_at', 0)):
+            self._remove_disk(path)
+            return None
+        return entry['value'], entry['created_at']
+
+    def _write_disk(self, key: str, value: str, created_at: float):
+        path = self._path_for(key)
+        data = json_dumps({'value': value, 'created_at': created_at})
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            # 先写临时文件再原子替换，避免并发读到半个文件
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"[缓存] 写入缓存文件失败 {path}: {e}")
+            return
+
+        with self._disk_lock:
+            self._disk_usage += len(data) - old_size
+            over_limit = self._disk_usage > self.disk_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _remove_disk(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._disk_lock:
+            self._disk_usage -= size
+        self.stats.incr('evictions')
+
+    def _evict_disk(self):
+        """删除最旧的缓存文件，直到占用降到上限的 90%"""
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        entries.sort()
+
+        target = int(self.disk_bytes * 0.9)
+        for _, path in entries:
+            with self._disk_lock:
+                if self._disk_usage <= target:
+                    break
+            self._remove_disk(path)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._memory.clear()
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                self._remove_disk(os.path.join(root, name))
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.stats.to_dict()
+        with self._lock:
+            memory_size = len(self._memory)
+        with self._disk_lock:
+            disk_usage = self._disk_usage
+        data.update({
+            'memory_entries': memory_size,
+            'disk_bytes': disk_usage,
+            'ttl': self.ttl
+        })
+        return data
+
+
+# 图片 MIME 类型与缓存文件扩展名的对应关系
+IMAGE_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/webp': 'webp',
+    'image/gif': 'gif'
+}
+IMAGE_MIME_TYPES = {ext: mime for mime, ext in IMAGE_EXTENSIONS.items()}
+
+
+def split_data_url(data_url: str) -> Optional[Tuple[str, str]]:
+    """拆分 data URL，返回 (mime_type, base64 数据)，格式无效时返回 None"""
+    if not data_url or not data_url.startswith('data:'):
+        return None
+    header, sep, data = data_url.partition(',')
+    if not sep or not header.endswith(';base64'):
+        return None
+    return header[5:-7], data
+
+
+class ImageCache:
+    """
+    图片结果磁盘缓存
+
+    以解码后的图片字节存储（每个条目一个 <key>.<ext> 文件，扩展名记录 MIME 类型），
+    不保存 base64 字符串；按总字节数限制，超出时淘汰最久未使用的条目。
+    内存中只保存 键 -> (文件名, 大小) 的 LRU 索引，启动时按文件修改时间重建
+    """
+
+    def __init__(self, folder: str, disk_bytes: int):
+        self.folder = folder
+        self.disk_bytes = disk_bytes
+        self.stats = CacheStats()
+
+        self._index: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._usage = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.folder, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            key, _, ext = name.partition('.')
+            if ext not in IMAGE_MIME_TYPES:
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, key, name, stat.st_size))
+        # 按修改时间排序，最近使用的在末尾
+        for _, key, name, size in sorted(entries):
+            self._index[key] = (name, size)
+            self._usage += size
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """查询缓存，命中返回 (图片字节, mime_type)"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is not None:
+                self._index.move_to_end(key)
+        if entry is None:
+            self.stats.incr('misses')
+            return None
+
+        name, _ = entry
+        path = os.path.join(self.folder, name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # 更新修改时间，重启后仍能保持 LRU 顺序
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                removed = self._index.pop(key, None)
+                if removed:
+                    self._usage -= removed[1]
+            self.stats.incr('misses')
+            return None
+
+        self.stats.incr('disk_hits')
+        return data, IMAGE_MIME_TYPES[name.partition('.')[2]]
+
+    def put(self, key: str, data: bytes, mime_type: str):
+        """写入缓存"""
+        ext = IMAGE_EXTENSIONS.get(mime_type)
+        if ext is None:
+            return
+        name = f"{key}.{ext}"
+        path = os.path.join(self.folder, name)
+        try:
+            # 先写临时文件再原子替换，避免并发读到半个文件
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"[缓存] 写入图片缓存失败 {path}: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            old = self._index.pop(key, None)
+            if old:
+                self._usage -= old[1]
+            self._index[key] = (name, len(data))
+            self._usage += len(data)
+            while self._usage > self.disk_bytes and len(self._index) > 1:
+                _, (old_name, old_size) = self._index.popitem(last=False)
+                self._usage -= old_size
+                evicted.append(old_name)
+        self.stats.incr('writes')
+
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.folder, old_name))
+            except OSError:
+                pass
+            self.stats.incr('evictions')
+
+    def get_data_url(self, key: str) -> Optional[str]:
+        """查询缓存并以 data URL 返回"""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        data, mime_type = entry
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def put_data_url(self, key: str, data_url: str):
+        """解码 data URL 后写入缓存"""
+        parts = split_data_url(data_url)
+        if parts is None:
+            return
+        mime_type, data = parts
+        try:
+            image_bytes = base64.b64decode(data)
+        except ValueError:
+            return
+        self.put(key, image_bytes, mime_type)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.stats.to_dict()
+        with self._lock:
+            data.update({
+                'entries': len(self._index),
+                'disk_bytes': self._usage,
+                'max_disk_bytes': self.disk_bytes
+            })
+        return data
+
+
+# 单例实例和锁
+_description_cache: Optional[DescriptionCache] = None
+_description_cache_lock = threading.Lock()
+_image_cache: Optional[ImageCache] = None
+_image_cache_lock = threading.Lock()
+
+
+def get_description_cache() -> Optional[DescriptionCache]:
+    """获取页面描述缓存单例，未启用时返回 None"""
+    global _description_cache
+    if not Config.DESCRIPTION_CACHE_ENABLED:
+        return None
+    if _description_cache is None:
+        with _description_cache_lock:
+            # 双重检查锁定
+            if _description_cache is None:
+                _description_cache = DescriptionCache(
+                    folder=os.path.join(Config.CACHE_FOLDER, 'descriptions'),
+                    ttl=Config.DESCRIPTION_CACHE_TTL,
+                    memory_entries=Config.DESCRIPTION_CACHE_MEMORY_ENTRIES,
+                    disk_bytes=Config.DESCRIPTION_CACHE_DISK_MB * 1024 * 1024
+                )
+    return _description_cache
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """获取图片结果缓存单例，未启用时返回 None"""
+    global _image_cache
+    if not Config.IMAGE_CACHE_ENABLED:
+        return None
+    if _image_cache is None:
+        with _image_cache_lock:
+            # 双重检查锁定
+            if _image_cache is None:
+                _image_cache = ImageCache(
+                    folder=os.path.join(Config.CACHE_FOLDER, 'images'),
+                    disk_bytes=Config.IMAGE_CACHE_DISK_MB * 1024 * 1024
+                )
+    return _image_cache
@@ -0,0 +1,98 @@
+"""
+协作式取消
+每次任务运行持有一个 CancellationToken，经上下文变量传递到页面处理和上游调用：
+排队中的作业直接撤回，等待并发名额或重试退避的调用立即退出，
+asyncio 引擎中的在途请求被取消，线程池中阻塞在上游连接读写上的请求经取消回调关闭连接后退出
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TaskCancelledError(Exception):
+    """任务已被取消"""
+
+
+class CancellationToken:
+    """取消令牌（线程安全）"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason = ""
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "任务已取消"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"取消回调执行失败: {e}")
+
+    @contextmanager
+    def on_cancel(self, callback: Callable[[], None]) -> Iterator[None]:
+        """
+        在上下文内登记取消回调（如关闭阻塞中的连接），令牌被取消时在取消方线程中调用；
+        令牌已取消时立即调用
+        """
+        with self._lock:
+            registered = not self._event.is_set()
+            if registered:
+                self._callbacks.append(callback)
+        if not registered:
+            callback()
+        try:
+            yield
+        finally:
+            if registered:
+                with self._lock:
+                    if callback in self._callbacks:
+                        self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelledError(self.reason)
+
+    def sleep(self, seconds: float):
+        """可被取消打断的 sleep，被取消时抛出 TaskCancelledError"""
+        if self._event.wait(max(0.0, seconds)):
+            raise TaskCancelledError(self.reason)
+
+
+_current_token: ContextVar[Optional[CancellationToken]] = ContextVar('cancellation_token', default=None)
+
+
+def current_token() -> Optional[CancellationToken]:
+    """当前上下文的取消令牌，不在任务运行中时为 None"""
+    return _current_token.get()
+
+
+def raise_if_cancelled():
+    """当前上下文的令牌已取消时抛出 TaskCancelledError"""
+    token = _current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+@contextmanager
+def use_token(token: Optional[CancellationToken]) -> Iterator[Optional[CancellationToken]]:
+    """在上下文内使用指定的取消令牌（线程和 asyncio 任务各自独立）"""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
@@ -0,0 +1,472 @@
+"""
+自适应并发控制
+对文字/图片上游调用使用 AIMD（加性增、乘性减）调整并发上限：
+延迟和错误率健康时逐步提高并发，遇到 429/503 或超时时成倍收缩，并遵守 Retry-After
+
+上游调用分为两个通道（lane）：交互通道（单页接口）和批量通道（批量生成任务）。
+批量通道不能占用为交互通道预留的并发名额，交互请求排队时批量请求让行；
+两个通道还可以各自设置请求速率上限（令牌桶）
+"""
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, Optional
+
+import httpx
+
+from config import Config
+from .cancellation import current_token
+
+logger = logging.getLogger(__name__)
+
+# 视为上游限流/过载的状态码
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+# 调用通道
+LANE_INTERACTIVE = 'interactive'
+LANE_BATCH = 'batch'
+LANES = (LANE_INTERACTIVE, LANE_BATCH)
+
+# 当前上下文的调用通道；Flask 请求线程默认为交互通道，批量任务的页面处理显式切换到批量通道
+_current_lane: ContextVar[str] = ContextVar('upstream_lane', default=LANE_INTERACTIVE)
+
+
+def current_lane() -> str:
+    """当前上下文的调用通道"""
+    return _current_lane.get()
+
+
+@contextmanager
+def use_lane(lane: str) -> Iterator[str]:
+    """
+    在上下文内把上游调用归入指定通道
+
+    线程和 asyncio 任务各自拥有独立的上下文，并发的页面互不干扰
+    """
+    if lane not in LANES:
+        raise ValueError(f"未知的调用通道: {lane}")
+    token = _current_lane.set(lane)
+    try:
+        yield lane
+    finally:
+        _current_lane.reset(token)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def concurrency_ceiling(api: str) -> int:
+    """
+    api 调用的最大并发数
+    启用自适应并发时为自适应上限，线程池和连接池按此大小创建
+    """
+    if api == 'image':
+        base, ceiling = Config.MAX_IMAGE_WORKERS, Config.ADAPTIVE_MAX_IMAGE_CONCURRENCY
+    else:
+        base, ceiling = Config.MAX_DESCRIPTION_WORKERS, Config.ADAPTIVE_MAX_TEXT_CONCURRENCY
+    return max(base, ceiling) if Config.ADAPTIVE_CONCURRENCY_ENABLED else base
+
+
+class TokenBucket:
+    """令牌桶速率限制（调用方持锁），rate_per_minute <= 0 表示不限速"""
+
+    __slots__ = ('rate', 'capacity', '_tokens', '_updated_at')
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 5.0):
+        self.rate = max(0.0, rate_per_minute) / 60.0
+        # 允许短时突发：最多积攒 burst_seconds 秒的配额，至少 1 个
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def try_take(self) -> float:
+        """取出一个令牌，成功返回 0，否则返回下一个令牌可用前的秒数"""
+        if self.unlimited:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / self.rate
+
+
+class _LaneState:
+    """单个通道的在途数、排队数、限速与延迟统计（调用方持锁）"""
+
+    __slots__ = ('name', 'bucket', 'in_flight', 'waiting', 'max_waiting', 'acquired',
+                 'rate_limited', 'wait_ewma', 'max_wait', 'latency_ewma')
+
+    def __init__(self, name: str, rate_per_minute: float):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_minute)
+        self.in_flight = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.rate_limited = 0
+        self.wait_ewma: Optional[float] = None
+        self.max_wait = 0.0
+        self.latency_ewma: Optional[float] = None
+
+    def record_wait(self, waited: float):
+        self.acquired += 1
+        self.max_wait = max(self.max_wait, waited)
+        self.wait_ewma = waited if self.wait_ewma is None else self.wait_ewma * 0.8 + waited * 0.2
+
+    def record_latency(self, latency: float):
+        self.latency_ewma = latency if self.latency_ewma is None \
+            else self.latency_ewma * 0.8 + latency * 0.2
+
+    def to_dict(self, cap: int) -> Dict[str, Any]:
+        return {
+            'cap': cap,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'acquired': self.acquired,
+            'rate_limit_per_minute': round(self.bucket.rate * 60, 1) if not self.bucket.unlimited else None,
+            'rate_limited': self.rate_limited,
+            'wait_ewma': round(self.wait_ewma, 3) if self.wait_ewma is not None else None,
+            'max_wait': round(self.max_wait, 3),
+            'latency_ewma': round(self.latency_ewma, 3) if self.latency_ewma is not None else None
+        }
+
+
+class _Permit:
+    """一次上游调用占用的并发名额，调用方通过 observe 报告结果"""
+
+    __slots__ = ('limiter', 'lane', 'started_at', 'observed')
+
+    def __init__(self, limiter: 'AdaptiveLimiter', lane: str):
+        self.limiter = limiter
+        self.lane = lane
+        self.started_at = time.monotonic()
+        self.observed = False
+
+    def observe(self, status_code: int, retry_after: Optional[str] = None):
+        """报告上游响应状态"""
+        self.observed = True
+        latency = time.monotonic() - self.started_at
+        self.limiter.record_latency(self.lane, latency)
+        if status_code in THROTTLE_STATUS_CODES:
+            self.limiter.on_throttle(parse_retry_after(retry_after))
+        elif status_code >= 500:
+            self.limiter.on_error()
+        else:
+            self.limiter.on_success(latency)
+
+    def fail(self, exc: BaseException):
+        """报告调用异常（未拿到响应）"""
+        self.observed = True
+        # 超时说明上游过载，与限流同样处理
+        if isinstance(exc, httpx.TimeoutException):
+            self.limiter.on_throttle(None)
+        else:
+            self.limiter.on_error()
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发限制器（线程安全，同时支持 asyncio）
+
+    - 成功且延迟低于目标、近期错误率正常时：limit += increase / limit（约每轮 +increase）
+    - 429/503/超时：limit *= decrease_factor，冷却期内只收缩一次；
+      带 Retry-After 时在该时间之前不再放行新请求
+    - 批量通道最多使用 limit 减去交互预留份额的名额，剩余名额优先留给排队中的交互请求；
+      交互通道可以使用全部名额
+    """
+
+    def __init__(self, name: str, initial: int, min_limit: int, max_limit: int,
+                 latency_target: float, decrease_factor: float = 0.5,
+                 increase: float = 1.0, error_rate_threshold: float = 0.2,
+                 interactive_share: float = 0.0, lane_rate_limits: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.increase = increase
+        self.error_rate_threshold = error_rate_threshold
+
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._latency_ewma: Optional[float] = None
+        self._error_rate = 0.0
+        self._cond = threading.Condition()
+
+        self.interactive_share = min(max(interactive_share, 0.0), 1.0)
+        lane_rate_limits = lane_rate_limits or {}
+        self._lanes: Dict[str, _LaneState] = {
+            lane: _LaneState(lane, lane_rate_limits.get(lane, 0)) for lane in LANES
+        }
+
+        # 统计
+        self.successes = 0
+        self.errors = 0
+        self.throttled = 0
+        self.waiting = 0
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    def lane_cap(self, lane: str) -> int:
+        """通道可使用的最大并发数：批量通道扣除交互预留份额（至少保留 1 个）"""
+        limit = self.limit
+        if lane == LANE_BATCH and self.interactive_share > 0:
+            reserved = max(1, round(limit * self.interactive_share))
+            return max(1, limit - reserved)
+        return limit
+
+    def _can_acquire(self, lane: str) -> float:
+        """返回 0 表示可以放行，否则为建议的等待秒数"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._in_flight >= self.limit:
+            return 0.05
+        state = self._lanes[lane]
+        if lane == LANE_BATCH and (
+                state.in_flight >= self.lane_cap(lane)
+                # 剩余名额要先留给正在排队的交互请求
+                or self._in_flight + self._lanes[LANE_INTERACTIVE].waiting >= self.limit):
+            return 0.05
+        # 令牌最后检查，避免取了令牌却拿不到并发名额
+        wait = state.bucket.try_take()
+        if wait > 0:
+            state.rate_limited += 1
+        return wait
+
+    def _take_locked(self, lane: str, waited: float):
+        self._in_flight += 1
+        state = self._lanes[lane]
+        state.in_flight += 1
+        state.record_wait(waited)
+
+    def _enter_wait_locked(self, lane: str):
+        self.waiting += 1
+        state = self._lanes[lane]
+        state.waiting += 1
+        state.max_waiting = max(state.max_waiting, state.waiting)
+
+    def _leave_wait_locked(self, lane: str):
+        self.waiting -= 1
+        self._lanes[lane].waiting -= 1
+
+    def try_acquire(self, lane: Optional[str] = None, waited: float = 0.0) -> float:
+        """尝试占用名额，成功返回 0，否则返回建议的等待秒数"""
+        lane = lane or current_lane()
+        with self._cond:
+            wait = self._can_acquire(lane)
+            if wait == 0.0:
+                self._take_locked(lane, waited)
+            return wait
+
+    def acquire(self, timeout: Optional[float] = None, lane: Optional[str] = None) -> bool:
+        """阻塞直到获得名额，lane 默认取当前上下文的通道"""
+        lane = lane or current_lane()
+        token = current_token()
+        started_at = time.monotonic()
+        deadline = None if timeout is None else started_at + timeout
+        with self._cond:
+            self._enter_wait_locked(lane)
+            try:
+                while True:
+                    # 任务被取消时不再等待名额（每次最多等待 0.05s 后重新检查）
+                    if token is not None:
+                        token.raise_if_cancelled()
+                    wait = self._can_acquire(lane)
+                    if wait == 0.0:
+                        self._take_locked(lane, time.monotonic() - started_at)
+                        return True
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        wait = min(wait, remaining)
+                    if token is not None:
+                        wait = min(wait, 0.05)
+                    self._cond.wait(wait)
+            finally:
+                self._leave_wait_locked(lane)
+
+    def release(self, lane: Optional[str] = None):
+        lane = lane or current_lane()
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            state = self._lanes[lane]
+            state.in_flight = max(0, state.in_flight - 1)
+            # 两个通道的等待者条件不同，全部唤醒由各自重新判断
+            self._cond.notify_all()
+
+    def record_latency(self, lane: str, latency: float):
+        with self._cond:
+            self._lanes[lane].record_latency(latency)
+
+    def _update_error_rate(self, is_error: bool):
+        # 指数加权的错误率，约反映最近 20 次调用
+        self._error_rate = self._error_rate * 0.95 + (0.05 if is_error else 0.0)
+
+    def on_success(self, latency: float):
+        with self._cond:
+            self.successes += 1
+            self._update_error_rate(False)
+            self._latency_ewma = latency if self._latency_ewma is None \
+                else self._latency_ewma * 0.8 + latency * 0.2
+            healthy = self._latency_ewma <= self.latency_target \
+                and self._error_rate < self.error_rate_threshold
+            # 只有名额被用满时才有必要继续加
+            if healthy and self._in_flight >= self.limit - 1:
+                self._limit = min(self.max_limit, self._limit + self.increase / max(self._limit, 1.0))
+            self._cond.notify_all()
+
+    def on_error(self):
+        with self._cond:
+            self.errors += 1
+            self._update_error_rate(True)
+
+    def on_throttle(self, retry_after: Optional[float]):
+        with self._cond:
+            self.throttled += 1
+            self._update_error_rate(True)
+            now = time.monotonic()
+            # 同一批并发请求同时被限流时只收缩一次
+            if now - self._last_decrease >= Config.ADAPTIVE_DECREASE_COOLDOWN:
+                old_limit = self.limit
+                self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+                self._last_decrease = now
+                logger.warning(f"[并发控制] {self.name} 上游限流，并发上限 {old_limit} -> {self.limit}")
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+
+    @contextmanager
+    def slot(self, lane: Optional[str] = None):
+        """占用一个名额，退出时释放；调用方用 permit.observe 报告结果"""
+        lane = lane or current_lane()
+        self.acquire(lane=lane)
+        permit = _Permit(self, lane)
+        try:
+            yield permit
+        except BaseException as e:
+            if not permit.observed:
+                permit.fail(e)
+            raise
+        finally:
+            self.release(lane)
+
+    @asynccontextmanager
+    async def slot_async(self, lane: Optional[str] = None):
+        """asyncio 版本的 slot，等待期间不阻塞事件循环"""
+        lane = lane or current_lane()
+        started_at = time.monotonic()
+        with self._cond:
+            self._enter_wait_locked(lane)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._can_acquire(lane)
+                    if wait == 0.0:
+                        self._take_locked(lane, time.monotonic() - started_at)
+                        break
+                await asyncio.sleep(min(wait, 0.5))
+        finally:
+            with self._cond:
+                self._leave_wait_locked(lane)
+
+        permit = _Permit(self, lane)
+        try:
+            yield permit
+        except BaseException as e:
+            if not permit.observed:
+                permit.fail(e)
+            raise
+        finally:
+            self.release(lane)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._cond:
+            blocked_for = max(0.0, self._blocked_until - time.monotonic())
+            return {
+                'limit': self.limit,
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'in_flight': self._in_flight,
+                'waiting': self.waiting,
+                'utilization': round(self._in_flight / self.limit, 3),
+                'latency_ewma': round(self._latency_ewma, 3) if self._latency_ewma is not None else None,
+                'latency_target': self.latency_target,
+                'error_rate': round(self._error_rate, 3),
+                'successes': self.successes,
+                'errors': self.errors,
+                'throttled': self.throttled,
+                'blocked_for': round(blocked_for, 1),
+                'interactive_share': self.interactive_share,
+                'lanes': {name: state.to_dict(self.lane_cap(name)) for name, state in self._lanes.items()}
+            }
+
+
+# 单例实例和锁
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(api: str) -> AdaptiveLimiter:
+    """获取 'text' 或 'image' 上游的并发限制器"""
+    limiter = _limiters.get(api)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(api)
+            if limiter is None:
+                if api == 'image':
+                    initial, latency_target = Config.MAX_IMAGE_WORKERS, Config.ADAPTIVE_IMAGE_LATENCY_TARGET
+                else:
+                    initial, latency_target = Config.MAX_DESCRIPTION_WORKERS, Config.ADAPTIVE_TEXT_LATENCY_TARGET
+                ceiling = concurrency_ceiling(api)
+                limiter = AdaptiveLimiter(
+                    name=api,
+                    initial=initial,
+                    # 关闭自适应时上下限相同，等价于固定并发
+                    min_limit=1 if Config.ADAPTIVE_CONCURRENCY_ENABLED else initial,
+                    max_limit=ceiling,
+                    latency_target=latency_target,
+                    decrease_factor=Config.ADAPTIVE_DECREASE_FACTOR,
+                    interactive_share=Config.INTERACTIVE_RESERVED_SHARE,
+                    lane_rate_limits={
+                        LANE_INTERACTIVE: Config.INTERACTIVE_RATE_LIMIT,
+                        LANE_BATCH: Config.BATCH_RATE_LIMIT
+                    }
+                )
+                _limiters[api] = limiter
+    return limiter
+
+
+def get_limiter_stats() -> Dict[str, Any]:
+    """各上游当前的并发上限与使用情况"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {api: limiter.to_dict() for api, limiter in limiters.items()}
@@ -0,0 +1,151 @@
+"""
+任务事件总线
+TaskManager 在任务/页面状态变化时发布事件，SSE 端点订阅后推送给前端，
+每个任务保留最近的事件用于断线重连（Last-Event-ID）时补发；
+只有生成中或有订阅者的任务保留事件流，其余任务的事件直接丢弃（新订阅者先收到完整快照）
+"""
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# (事件 ID, 事件类型, 数据)
+TaskEvent = Tuple[int, str, Dict[str, Any]]
+
+
+class TaskEventStream:
+    """单个任务的事件流（环形缓冲）"""
+
+    def __init__(self, capacity: int):
+        self._events: Deque[TaskEvent] = deque(maxlen=capacity)
+        # 事件 ID 从当前微秒时间戳起算：事件流释放后重建（或进程重启）时，
+        # 客户端带来的旧 ID 不会落在新事件流的范围内，而是重新下发快照
+        self._last_id = time.time_ns() // 1000
+        self._closed = False
+        self._cond = threading.Condition()
+        # 以下两项由 EventBus 在其锁内维护
+        self.active = False  # 任务正在生成
+        self.subscribers = 0
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> int:
+        with self._cond:
+            self._last_id += 1
+            self._events.append((self._last_id, event_type, data))
+            self._cond.notify_all()
+            return self._last_id
+
+    def close(self):
+        """任务被删除时关闭事件流，唤醒所有订阅者"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def can_resume(self, after_id: int) -> bool:
+        """after_id 之后的事件是否都还在缓冲中"""
+        with self._cond:
+            if after_id > self._last_id:
+                # 事件 ID 来自其他进程
+                return False
+            oldest = self._events[0][0] if self._events else self._last_id + 1
+            return after_id >= oldest - 1
+
+    def wait(self, after_id: int, timeout: float) -> List[TaskEvent]:
+        """返回 after_id 之后的事件，没有新事件时最多等待 timeout 秒"""
+        with self._cond:
+            if self._last_id <= after_id and not self._closed:
+                self._cond.wait(timeout)
+            return [event for event in self._events if event[0] > after_id]
+
+
+class EventBus:
+    """按任务划分的事件总线"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._streams: Dict[str, TaskEventStream] = {}
+        self._lock = threading.Lock()
+
+    def _stream_locked(self, task_id: str) -> TaskEventStream:
+        stream = self._streams.get(task_id)
+        if stream is None:
+            stream = self._streams[task_id] = TaskEventStream(self.capacity)
+        return stream
+
+    def _drop_if_idle_locked(self, task_id: str, stream: TaskEventStream):
+        if not stream.active and stream.subscribers <= 0 and self._streams.get(task_id) is stream:
+            del self._streams[task_id]
+
+    def activate(self, task_id: str):
+        """任务开始生成：保留事件流直到 release"""
+        with self._lock:
+            self._stream_locked(task_id).active = True
+
+    def release(self, task_id: str):
+        """任务生成结束：没有订阅者时立即释放事件流，否则在最后一个订阅者断开时释放"""
+        with self._lock:
+            stream = self._streams.get(task_id)
+            if stream is not None:
+                stream.active = False
+                self._drop_if_idle_locked(task_id, stream)
+
+    def subscribe(self, task_id: str) -> TaskEventStream:
+        """订阅任务的事件流（不存在时创建），断开时须调用 unsubscribe"""
+        with self._lock:
+            stream = self._stream_locked(task_id)
+            stream.subscribers += 1
+        return stream
+
+    def unsubscribe(self, task_id: str, stream: TaskEventStream):
+        with self._lock:
+            stream.subscribers -= 1
+            self._drop_if_idle_locked(task_id, stream)
+
+    def publish(self, task_id: str, event_type: str, data: Dict[str, Any]) -> int:
+        """发布事件，返回事件 ID；任务既不在生成中也没有订阅者时丢弃并返回 0"""
+        stream = self._streams.get(task_id)
+        if stream is None:
+            return 0
+        return stream.publish(event_type, data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'streams': len(self._streams),
+                'subscribers': sum(stream.subscribers for stream in self._streams.values())
+            }
+
+    def discard(self, task_id: str):
+        """删除任务的事件流"""
+        with self._lock:
+            stream = self._streams.pop(task_id, None)
+        if stream is not None:
+            stream.close()
+
+
+# 单例实例和锁
+_event_bus: Optional[EventBus] = None
+_event_bus_lock = threading.Lock()
+
+
+def get_event_bus() -> EventBus:
+    """获取事件总线单例（线程安全）"""
+    global _event_bus
+    if _event_bus is None:
+        with _event_bus_lock:
+            # 双重检查锁定
+            if _event_bus is None:
+                _event_bus = EventBus(Config.SSE_BUFFER_SIZE)
+    return _event_bus
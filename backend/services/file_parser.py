@@ -1,20 +1,30 @@
 """
 智能脚本解析服务 - 使用 AI 解析任意格式的脚本文件
 """
+import re
+import sys
 import json
 import uuid
 import logging
-import httpx
-from typing import List, Dict, Any
-from dataclasses import dataclass, field, asdict
+import zipfile
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Union
+from dataclasses import dataclass, field, fields
 from enum import Enum
 from io import BytesIO
 import openpyxl
-from docx import Document
+from lxml import etree
 from config import Config
+from .ai_service import get_ai_service
+from .structured_parser import parse_structured
 
 logger = logging.getLogger(__name__)
 
+# Python 3.10+ 的 dataclass 使用 __slots__ 存储字段，减少每个对象的内存占用并加快属性访问
+DATACLASS_OPTIONS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
 
 class PageStatus(str, Enum):
     """页面状态"""
@@ -25,7 +35,7 @@ class PageStatus(str, Enum):
     ERROR = "error"
 
 
-@dataclass
+@dataclass(**DATACLASS_OPTIONS)
 class ScriptPage:
     """脚本页面数据"""
     id: str = field(default_factory=lambda: str(uuid.uuid4()))
@@ -38,60 +48,326 @@ class ScriptPage:
     image_path: str = ""  # 生成的图片路径
     status: PageStatus = PageStatus.PENDING
     error_message: str = ""
+    attempts: int = 0  # 上游调用次数（含重试）
+    completed_phase: str = ""  # 已完成的生成阶段（检查点）：'' / 'description' / 'image'
+    version: int = 0  # 最后一次变化时所属任务的版本号
 
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典"""
-        data = asdict(self)
-        data['status'] = self.status.value
-        return data
+        """转换为字典（字段均为不可变类型，直接构造而不经过 asdict 的递归深拷贝）"""
+        return {
+            'id': self.id,
+            'index': self.index,
+            'shot_number': self.shot_number,
+            'segment': self.segment,
+            'narration': self.narration,
+            'visual_hint': self.visual_hint,
+            'description': self.description,
+            'image_path': self.image_path,
+            'status': self.status.value,
+            'error_message': self.error_message,
+            'attempts': self.attempts,
+            'completed_phase': self.completed_phase,
+            'version': self.version
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ScriptPage':
+        """从 to_dict 的结果恢复（忽略未知字段）"""
+        page = cls(**{k: v for k, v in data.items() if k in _SCRIPT_PAGE_FIELDS})
+        # 状态统一使用枚举单例，阶段名与环节名重复率高，驻留后各页面共享同一字符串
+        page.status = PageStatus(page.status)
+        page.completed_phase = sys.intern(page.completed_phase)
+        page.segment = sys.intern(page.segment)
+        return page
+
+
+_SCRIPT_PAGE_FIELDS = frozenset(f.name for f in fields(ScriptPage))
+
+
+def iter_excel_lines(file_path: str) -> Iterator[str]:
+    """逐行读取 Excel 活动工作表（只读模式流式读取），每行输出为 " | " 分隔的文本，跳过空行"""
+    wb = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        for row in wb.active.iter_rows(values_only=True):
+            if any(cell is not None and str(cell).strip() for cell in row):
+                yield ' | '.join(str(cell) if cell else '' for cell in row)
+    finally:
+        wb.close()
 
 
 def excel_to_text(file_path: str) -> str:
     """将 Excel 文件转换为文本格式，保留表格结构"""
-    wb = openpyxl.load_workbook(file_path, read_only=True)
-    ws = wb.active
+    return '\n'.join(iter_excel_lines(file_path))
 
-    lines = []
-    for row in ws.iter_rows(values_only=True):
-        # 过滤空行
-        if any(cell is not None and str(cell).strip() for cell in row):
-            row_text = ' | '.join(str(cell) if cell else '' for cell in row)
-            lines.append(row_text)
 
-    wb.close()
-    return '\n'.join(lines)
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
 
 
-def docx_to_text(file_path: str) -> str:
-    """将 Word 文件转换为文本格式，包括段落和表格"""
+class _LimitedReader:
+    """读取超过 limit 字节时报错，防止压缩炸弹（zip 头中的解压大小可以伪造）"""
+
+    def __init__(self, raw, limit: int):
+        self._raw = raw
+        self._limit = limit
+        self._read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._raw.read(size)
+        self._read += len(data)
+        if self._read > self._limit:
+            raise ValueError(f"Word 文档内容超过 {self._limit // (1024 * 1024)}MB 上限")
+        return data
+
+
+def _paragraph_text(p) -> str:
+    parts = []
+    for node in p.iter(_W + 't', _W + 'tab', _W + 'br'):
+        if node.tag == _W + 't':
+            parts.append(node.text or '')
+        else:
+            parts.append('\t' if node.tag == _W + 'tab' else '\n')
+    return ''.join(parts)
+
+
+def iter_docx_lines(file_path: str) -> Iterator[str]:
+    """
+    按文档顺序流式读取 Word 文件的段落和表格行
+
+    直接用 iterparse 扫描 word/document.xml，处理完的元素立即释放，内存占用与文档大小无关；
+    表格每行输出为 " | " 分隔的单元格文本。解压后的 XML 超过 DOCX_MAX_XML_BYTES 时报错
+    """
     try:
-        doc = Document(file_path)
-    except Exception as e:
+        archive = zipfile.ZipFile(file_path)
+    except (zipfile.BadZipFile, OSError) as e:
         logger.error(f"无法解析 Word 文件 {file_path}: {e}")
         raise ValueError(f"Word 文件解析失败: {e}")
 
-    lines = []
-    # 提取段落
-    for p in doc.paragraphs:
-        if p.text.strip():
-            lines.append(p.text)
-    # 提取表格
-    for table in doc.tables:
-        for row in table.rows:
-            row_text = ' | '.join(cell.text.strip() for cell in row.cells if cell.text.strip())
-            if row_text:
-                lines.append(row_text)
+    with archive:
+        try:
+            info = archive.getinfo('word/document.xml')
+        except KeyError:
+            raise ValueError("Word 文件解析失败: 缺少 word/document.xml")
+        if info.file_size > Config.DOCX_MAX_XML_BYTES:
+            raise ValueError(f"Word 文档内容超过 {Config.DOCX_MAX_XML_BYTES // (1024 * 1024)}MB 上限")
+
+        with archive.open(info) as raw:
+            rows: List[List[str]] = []  # 各层表格当前行的单元格
+            cells: List[List[str]] = []  # 各层单元格当前的段落
+            events = etree.iterparse(
+                _LimitedReader(raw, Config.DOCX_MAX_XML_BYTES), events=('start', 'end'),
+                tag=(_W + 'p', _W + 'tr', _W + 'tc'), resolve_entities=False, no_network=True
+            )
+            try:
+                for event, elem in events:
+                    tag = elem.tag
+                    if event == 'start':
+                        if tag == _W + 'tr':
+                            rows.append([])
+                        elif tag == _W + 'tc':
+                            cells.append([])
+                        continue
+
+                    if tag == _W + 'p':
+                        text = _paragraph_text(elem)
+                        if cells:
+                            cells[-1].append(text.strip())
+                        elif text.strip():
+                            yield text
+                    elif tag == _W + 'tc':
+                        cell = ' '.join(part for part in cells.pop() if part)
+                        if rows:
+                            rows[-1].append(cell)
+                    else:
+                        row_text = ' | '.join(cell for cell in rows.pop() if cell)
+                        if row_text:
+                            yield row_text
+
+                    # 释放已处理的元素及其之前的兄弟节点
+                    elem.clear()
+                    if not cells and not rows:
+                        parent = elem.getparent()
+                        while elem.getprevious() is not None:
+                            del parent[0]
+            except etree.XMLSyntaxError as e:
+                raise ValueError(f"Word 文件解析失败: {e}")
 
-    return '\n'.join(lines)
 
+def docx_to_text(file_path: str) -> str:
+    """将 Word 文件转换为文本格式，段落和表格按文档顺序排列"""
+    return '\n'.join(iter_docx_lines(file_path))
+
+
+# 自然分段边界：Markdown 标题、"第N镜/页/幕"、"镜号"、【小标题】、"1." 形式的编号行
+_BOUNDARY_RE = re.compile(
+    r'^\s*(#{1,6}\s|第\s*[0-9一二三四五六七八九十百零]+\s*[镜页幕场节章]|镜号|【|\d+\s*[\.、．:：]\s*\S)'
+)
+
+
+def is_boundary_line(line: str) -> bool:
+    """该行是否开始一个新的自然段落单元（标题或镜头标记）"""
+    return bool(_BOUNDARY_RE.match(line))
+
+
+def iter_chunks(lines: Iterable[str], max_chars: int, overlap_lines: int = 2) -> Iterator[str]:
+    """
+    将脚本文本行按自然边界流式切分为不超过 max_chars 的块（单行超长时单独成块）
+
+    - 只在行边界切分（表格的一行就是一行），块足够长时优先切在标题/镜头标记之前
+    - 没有切在自然边界上时相邻块重叠 overlap_lines 行，避免跨块的页面被截断，合并时按页面去重
+    - 首行是表格表头（含 " | "）时，每个块都带上表头，保证列含义一致
+    - 只缓冲当前块的行，输入可以是逐行读取文件的生成器
+    """
+    non_empty = (line for line in lines if line.strip())
+    first = next(non_empty, None)
+    if first is None:
+        return
+
+    header = first if ' | ' in first else None
+    budget = max(1, max_chars - (len(header) + 1 if header else 0))
+
+    def emit(chunk: List[str]) -> str:
+        return '\n'.join([header] + chunk if header else chunk)
+
+    # 切块后未放入上一块的行（重叠行、边界之后的行）重新排队，作为下一块的开头
+    requeued = deque() if header else deque([first])
+    buffer: List[str] = []
+    size = 0
+    while True:
+        line = requeued.popleft() if requeued else next(non_empty, None)
+        if line is None:
+            break
+        if buffer and size + len(line) + 1 > budget:
+            end = len(buffer)
+            if not is_boundary_line(line):
+                # 块的后半部分有自然边界时切在边界之前，不把一个镜头拆到两个块里
+                last_boundary = next((i for i in range(len(buffer) - 1, 0, -1) if is_boundary_line(buffer[i])), None)
+                if last_boundary is not None and last_boundary > len(buffer) // 2:
+                    end = last_boundary
+            yield emit(buffer[:end])
+            # 切在自然边界上时单元完整，无需重叠；否则回退 overlap_lines 行
+            start = end if end < len(buffer) or is_boundary_line(line) else max(end - overlap_lines, 1)
+            requeued.extendleft(reversed(buffer[start:] + [line]))
+            buffer, size = [], 0
+            continue
+        buffer.append(line)
+        size += len(line) + 1
+    if buffer:
+        yield emit(buffer)
+
+
+def split_into_chunks(content: str, max_chars: int, overlap_lines: int = 2) -> List[str]:
+    """将脚本文本按自然边界切分为块，规则同 iter_chunks"""
+    return list(iter_chunks(content.splitlines(), max_chars, overlap_lines))
+
+
+def _dedup_key(page: Dict[str, Any]) -> str:
+    """用于识别重叠区域重复页面的讲稿指纹（去掉空白）"""
+    return re.sub(r'\s+', '', str(page.get('narration') or ''))
+
+
+def _is_same_page(a: Dict[str, Any], b: Dict[str, Any],
+                  a_truncated: bool = False, b_truncated: bool = False) -> bool:
+    """
+    两个块解析出的页面是否是同一页：镜号一致（都有时）且讲稿相同
+
+    只有块的最后一页可能被切块截断，a_truncated/b_truncated 为 True 的一方允许是另一方讲稿的前缀；
+    其余页面须讲稿完全一致，块边界处的"好。""谢谢"等短页不会被当作重复页丢弃
+    """
+    shot_a, shot_b = str(a.get('shot_number') or '').strip(), str(b.get('shot_number') or '').strip()
+    if shot_a and shot_b and shot_a != shot_b:
+        return False
+    key_a, key_b = _dedup_key(a), _dedup_key(b)
+    if not key_a or not key_b:
+        return False
+    if key_a == key_b:
+        return True
+    return (a_truncated and key_b.startswith(key_a)) or (b_truncated and key_a.startswith(key_b))
+
+
+def merge_chunk_pages(chunk_pages: List[List[Dict[str, Any]]], window: int = 8) -> List[Dict[str, Any]]:
+    """
+    按块顺序合并各块的解析结果
+
+    每个块开头的页面与已合并结果末尾 window 页比较，重复的页面（来自重叠行）只保留一份，
+    被切块截断的块末页由更完整的一方替换；其余页面保持原顺序
+    """
+    merged: List[Dict[str, Any]] = []
+    for pages in chunk_pages:
+        boundary = len(merged)
+        for i, page in enumerate(pages):
+            duplicate = None
+            if i < window:
+                for j in range(max(0, boundary - window), boundary):
+                    if _is_same_page(merged[j], page, a_truncated=j == boundary - 1,
+                                     b_truncated=i == len(pages) - 1):
+                        duplicate = j
+                        break
+            if duplicate is None:
+                merged.append(page)
+            elif len(_dedup_key(page)) > len(_dedup_key(merged[duplicate])):
+                merged[duplicate] = page
+    return merged
+
+
+def parse_with_ai(content: Union[str, Iterable[str]]) -> List[Dict[str, Any]]:
+    """
+    使用 AI 智能解析脚本内容（Gemini 原生 API）
+
+    内容超过 PARSE_CHUNK_CHARS 时按自然边界切块并发解析，再按顺序合并去重，
+    解析耗时取决于单块延迟而不是脚本总长度
+
+    Args:
+        content: 脚本文本，或逐行产生文本的可迭代对象（如 iter_excel_lines，边读边切块）
+    """
+    if isinstance(content, str):
+        if len(content) <= Config.PARSE_CHUNK_CHARS:
+            return _parse_chunk_with_ai(content)
+        content = content.splitlines()
+
+    chunks = iter_chunks(content, Config.PARSE_CHUNK_CHARS, Config.PARSE_CHUNK_OVERLAP_LINES)
+    head = list(itertools.islice(chunks, 2))
+    if not head:
+        raise ValueError("脚本内容为空")
+    if len(head) == 1:
+        return _parse_chunk_with_ai(head[0])
+
+    # 按顺序提交各块，在途块数有上限：文件读取、切块与解析同时进行，未解析的文本不会全部堆在内存里
+    workers = max(1, Config.PARSE_MAX_WORKERS)
+    chunk_pages: List[List[Dict[str, Any]]] = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parse_chunk") as executor:
+        pending = deque()
+        for part, chunk in enumerate(itertools.chain(head, chunks), 1):
+            pending.append(executor.submit(_parse_chunk_with_ai, chunk, part))
+            if len(pending) >= workers * 2:
+                chunk_pages.append(pending.popleft().result())
+        while pending:
+            chunk_pages.append(pending.popleft().result())
+
+    pages_data = merge_chunk_pages(chunk_pages)
+    logger.info(f"[file_parser] 切分为 {len(chunk_pages)} 块并发解析，"
+                f"各块共 {sum(len(p) for p in chunk_pages)} 页，合并去重后 {len(pages_data)} 页")
+    return pages_data
+
+
+def _parse_chunk_with_ai(content: str, part: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    解析一段脚本内容
 
-def parse_with_ai(content: str) -> List[Dict[str, Any]]:
-    """使用 AI 智能解析脚本内容（Gemini 原生 API）"""
+    Args:
+        content: 脚本内容（完整脚本或其中一块）
+        part: 块序号（从 1 开始），分块解析时提供
+    """
+    part_note = ""
+    if part:
+        part_note = f"""
+注意：这是完整脚本按顺序切分后的第 {part} 部分。开头几行可能与上一部分重叠，
+请照常提取本部分出现的所有页（包括重叠的行），不要补全本部分以外的内容。
+"""
 
     prompt = f"""你是一个脚本解析助手。请分析以下内容，提取出每一页/每一镜的信息。
 
 内容可能是各种格式：Excel表格、纯文本、分段文字等。请智能识别并提取。
-
+{part_note}
 对于每一页，请提取：
 - shot_number: 镜号/页码（如果有的话，字符串格式）
 - segment: 环节/章节名称（如果有的话）
@@ -117,11 +393,6 @@ def parse_with_ai(content: str) -> List[Dict[str, Any]]:
 ]"""
 
     # 使用 Gemini 原生 API
-    url = f"{Config.TEXT_API_BASE}/v1beta/models/{Config.TEXT_MODEL}:generateContent"
-    headers = {
-        "x-goog-api-key": Config.TEXT_API_KEY,
-        "Content-Type": "application/json"
-    }
     payload = {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": {
@@ -130,10 +401,7 @@ def parse_with_ai(content: str) -> List[Dict[str, Any]]:
         }
     }
 
-    with httpx.Client(timeout=120.0) as client:
-        response = client.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
+    result = get_ai_service().generate_content('text', payload, timeout=Config.PARSE_CHUNK_TIMEOUT)
 
     # 提取文本响应
     result_text = ""
@@ -161,7 +429,6 @@ def parse_with_ai(content: str) -> List[Dict[str, Any]]:
         result_text = '\n'.join(lines)
 
     # 过滤思考过程，提取 JSON 数组
-    import re
     json_match = re.search(r'\[[\s\S]*\]', result_text)
     if json_match:
         result_text = json_match.group()
@@ -175,6 +442,11 @@ def parse_with_ai(content: str) -> List[Dict[str, Any]]:
     return pages_data
 
 
+# 解析方式：按表头/字段/镜头标记直接解析，或调用 AI 解析
+PARSE_METHOD_STRUCTURED = 'structured'
+PARSE_METHOD_AI = 'ai'
+
+
 class FileParser:
     """智能文件解析器"""
 
@@ -189,23 +461,45 @@ class FileParser:
         Returns:
             ScriptPage 列表
         """
+        return FileParser.parse(file_path)[0]
+
+    @staticmethod
+    def parse(file_path: str) -> Tuple[List[ScriptPage], str]:
+        """
+        解析脚本文件，并返回使用的解析方式
+
+        带表头的 Excel、字段明确的 JSON、用镜头标记分段的 txt/md 直接按结构解析，
+        无法识别结构时回退到 AI 解析
+
+        Returns:
+            (ScriptPage 列表, PARSE_METHOD_STRUCTURED 或 PARSE_METHOD_AI)
+        """
         from pathlib import Path
         path = Path(file_path)
         suffix = path.suffix.lower()
 
-        # 转换为文本
-        if suffix in ['.xlsx', '.xls']:
-            text_content = excel_to_text(file_path)
-        elif suffix == '.docx':
-            text_content = docx_to_text(file_path)
-        elif suffix in ['.txt', '.md']:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text_content = f.read()
-        elif suffix == '.json':
-            # JSON 可以直接解析，但也可以让 AI 处理更灵活
+        text_content = None
+        if suffix in ['.txt', '.md', '.json']:
             with open(file_path, 'r', encoding='utf-8') as f:
                 text_content = f.read()
-        else:
+
+        pages_data = parse_structured(file_path, suffix, text_content)
+        if pages_data is not None:
+            logger.info(f"按结构解析出 {len(pages_data)} 页，跳过 AI 解析")
+            return FileParser._to_pages(pages_data), PARSE_METHOD_STRUCTURED
+
+        # Excel/Word 逐行流式读取，边读边切块交给 AI 解析
+        if suffix in ['.xlsx', '.xls']:
+            pages_data = parse_with_ai(iter_excel_lines(file_path))
+            logger.info(f"AI 解析出 {len(pages_data)} 页")
+            return FileParser._to_pages(pages_data), PARSE_METHOD_AI
+        if suffix == '.docx':
+            pages_data = parse_with_ai(iter_docx_lines(file_path))
+            logger.info(f"AI 解析出 {len(pages_data)} 页")
+            return FileParser._to_pages(pages_data), PARSE_METHOD_AI
+
+        # 转换为文本（txt/md/json 已读取）
+        if text_content is None:
             # 尝试当作文本处理
             try:
                 with open(file_path, 'r', encoding='utf-8') as f:
@@ -219,8 +513,11 @@ class FileParser:
         # 使用 AI 解析
         pages_data = parse_with_ai(text_content)
         logger.info(f"AI 解析出 {len(pages_data)} 页")
+        return FileParser._to_pages(pages_data), PARSE_METHOD_AI
 
-        # 转换为 ScriptPage 对象
+    @staticmethod
+    def _to_pages(pages_data: List[Dict[str, Any]]) -> List[ScriptPage]:
+        """将解析出的页面数据转换为 ScriptPage 对象，跳过没有讲稿的页面"""
         pages = []
         for i, page_data in enumerate(pages_data):
             narration = page_data.get('narration', '')
@@ -230,7 +527,7 @@ class FileParser:
             page = ScriptPage(
                 index=i,
                 shot_number=str(page_data.get('shot_number', i + 1)),
-                segment=page_data.get('segment', ''),
+                segment=sys.intern(str(page_data.get('segment') or '')),
                 narration=narration,
                 visual_hint=page_data.get('visual_hint', '')
             )
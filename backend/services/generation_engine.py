@@ -0,0 +1,66 @@
+"""
+asyncio 生成引擎
+在独立线程中运行一个事件循环，按阶段用信号量限制并发，
+单个进程即可承载成百上千个进行中的页面请求，而无需为每个请求占用一个线程
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict
+
+from .http_client import get_http_pool
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncioEngine:
+    """事件循环生成引擎"""
+
+    def __init__(self, limits: Dict[str, int]):
+        """
+        Args:
+            limits: 各阶段（如 'description'、'image'）的最大并发数
+        """
+        self._limits = dict(limits)
+        self._loop = asyncio.new_event_loop()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="asyncio_engine", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        logger.info(f"asyncio 生成引擎已启动，并发限制: {self._limits}")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        # 信号量需在事件循环线程中创建
+        self._semaphores = {stage: asyncio.Semaphore(limit) for stage, limit in self._limits.items()}
+        self._started.set()
+        self._loop.run_forever()
+
+    async def _run_stage(self, stage: str, coro_func: Callable[..., Awaitable[Any]], args: tuple) -> Any:
+        async with self._semaphores[stage]:
+            return await coro_func(*args)
+
+    def submit(self, stage: str, coro_func: Callable[..., Awaitable[Any]], *args) -> Future:
+        """
+        提交协程到事件循环
+
+        Returns:
+            concurrent.futures.Future，可与线程池的 Future 一样配合 as_completed 使用
+        """
+        return asyncio.run_coroutine_threadsafe(self._run_stage(stage, coro_func, args), self._loop)
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def shutdown(self, timeout: float = 5.0):
+        """关闭绑定在本事件循环上的上游连接后停止事件循环"""
+        if self._loop.is_running():
+            closing = asyncio.run_coroutine_threadsafe(get_http_pool().aclose_loop(self._loop), self._loop)
+            try:
+                closing.result(timeout)
+            except Exception as e:
+                logger.warning(f"关闭异步上游连接失败: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,499 @@
+"""
+上游 HTTP 连接池
+按上游 origin（scheme://host:port）共享长连接的 httpx.Client，
+支持 keep-alive、可选 HTTP/2 多路复用，并统计连接复用情况
+"""
+import socket
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from typing import AsyncIterator, Dict, Any, Iterator, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import httpcore
+from httpx._utils import get_environment_proxies
+
+from config import Config
+from utils.json_codec import dumps as json_dumps
+from .cancellation import current_token
+from .concurrency import concurrency_ceiling
+
+logger = logging.getLogger(__name__)
+
+
+def origin_of(base_url: str) -> str:
+    """提取 base URL 的 origin，作为连接池的键"""
+    parts = urlsplit(base_url)
+    if not parts.scheme or not parts.netloc:
+        return base_url.rstrip('/')
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _http2_available() -> bool:
+    """HTTP/2 依赖 h2 包，未安装时回退到 HTTP/1.1"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class ConnectionStats:
+    """连接复用计数器（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.errors = 0
+
+    def record(self, new_connection: bool):
+        with self._lock:
+            self.requests += 1
+            if new_connection:
+                self.new_connections += 1
+            else:
+                self.reused_connections += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.new_connections + self.reused_connections
+            return {
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': self.reused_connections,
+                'errors': self.errors,
+                'reuse_ratio': round(self.reused_connections / total, 3) if total else 0.0
+            }
+
+
+class _ConnectionTracer:
+    """
+    通过 httpx 的 trace 扩展判断本次请求是否新建了 TCP 连接
+    复用 keep-alive 连接（或 HTTP/2 多路复用）时不会触发 connect_tcp 事件
+    """
+
+    __slots__ = ('opened',)
+
+    def __init__(self):
+        self.opened = False
+
+    def __call__(self, event_name: str, info: Dict[str, Any]):
+        if event_name == 'connection.connect_tcp.started':
+            self.opened = True
+
+
+class _AsyncConnectionTracer(_ConnectionTracer):
+    """AsyncClient 要求 trace 回调为协程函数"""
+
+    __slots__ = ()
+
+    async def __call__(self, event_name: str, info: Dict[str, Any]):
+        _ConnectionTracer.__call__(self, event_name, info)
+
+
+class _CancellableStream(httpcore.NetworkStream):
+    """
+    可被取消令牌中断的连接
+
+    读写时把"关闭 socket"登记为当前上下文取消令牌的回调：任务被取消时，
+    阻塞在等待上游响应上的工作线程立即收到连接错误并退出，
+    并发名额、调度窗口和连接池中的连接随之释放，而不是等到上游返回（图片请求可达数分钟）
+    """
+
+    def __init__(self, stream: httpcore.NetworkStream):
+        self._stream = stream
+
+    def _abort(self):
+        sock = self._stream.get_extra_info('socket')
+        if sock is None:
+            return
+        try:
+            # 直接调用 socket.shutdown：SSLSocket.shutdown 会先丢弃 SSL 对象，影响正在读取的线程
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def read(self, max_bytes: int, timeout: Optional[float] = None) -> bytes:
+        token = current_token()
+        if token is None:
+            return self._stream.read(max_bytes, timeout)
+        with token.on_cancel(self._abort):
+            return self._stream.read(max_bytes, timeout)
+
+    def write(self, buffer: bytes, timeout: Optional[float] = None) -> None:
+        token = current_token()
+        if token is None:
+            return self._stream.write(buffer, timeout)
+        with token.on_cancel(self._abort):
+            return self._stream.write(buffer, timeout)
+
+    def close(self) -> None:
+        self._stream.close()
+
+    def start_tls(self, ssl_context, server_hostname: Optional[str] = None,
+                  timeout: Optional[float] = None) -> httpcore.NetworkStream:
+        return _CancellableStream(self._stream.start_tls(ssl_context, server_hostname, timeout))
+
+    def get_extra_info(self, info: str) -> Any:
+        return self._stream.get_extra_info(info)
+
+
+class _CancellableBackend(httpcore.NetworkBackend):
+    """建立 _CancellableStream 连接的网络后端"""
+
+    def __init__(self):
+        self._backend = httpcore.SyncBackend()
+
+    def connect_tcp(self, host: str, port: int, timeout: Optional[float] = None,
+                    local_address: Optional[str] = None, socket_options=None) -> httpcore.NetworkStream:
+        return _CancellableStream(self._backend.connect_tcp(host, port, timeout, local_address, socket_options))
+
+    def connect_unix_socket(self, path: str, timeout: Optional[float] = None,
+                            socket_options=None) -> httpcore.NetworkStream:
+        return _CancellableStream(self._backend.connect_unix_socket(path, timeout, socket_options))
+
+    def sleep(self, seconds: float) -> None:
+        self._backend.sleep(seconds)
+
+
+class _CancellableTransport(httpx.HTTPTransport):
+    """
+    连接可随取消令牌中断的 HTTP/1.1 传输层
+
+    连接池（含代理和 SSL_CERT_FILE/SSL_CERT_DIR 等环境配置）仍由 HTTPTransport 按原参数创建，
+    只替换其网络后端；HTTPTransport 不接受 network_backend 参数，因此在创建后替换。
+    HTTP/2 下多个请求共用一条连接，关闭连接会波及其他请求，因此只用于 HTTP/1.1
+    """
+
+    def __init__(self, limits: httpx.Limits, proxy: Optional[str] = None):
+        super().__init__(limits=limits, proxy=proxy)
+        # HTTPProxy/SOCKSProxy 均继承自 ConnectionPool，经同一网络后端建立连接
+        self._pool._network_backend = _CancellableBackend()
+
+
+def _cancellable_mounts(limits: httpx.Limits) -> Dict[str, Optional[httpx.BaseTransport]]:
+    """
+    按环境变量中的代理配置（HTTP(S)_PROXY、ALL_PROXY、NO_PROXY）为每个代理创建可中断的传输层
+
+    显式传入 transport 时 httpx.Client 不再读取环境中的代理，由这里补上；值为 None 的规则表示不走代理
+    """
+    return {
+        pattern: None if proxy is None else _CancellableTransport(limits, proxy=proxy)
+        for pattern, proxy in get_environment_proxies().items()
+    }
+
+
+class PooledClient:
+    """单个上游 origin 的共享客户端"""
+
+    def __init__(self, origin: str, max_connections: int):
+        self.origin = origin
+        self.max_connections = max_connections
+        self.http2 = Config.HTTP2_ENABLED and _http2_available()
+        if Config.HTTP2_ENABLED and not self.http2:
+            logger.warning("[连接池] 已启用 HTTP2_ENABLED 但未安装 h2，回退到 HTTP/1.1")
+
+        self.stats = ConnectionStats()
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+        )
+        # httpx.Client 本身是线程安全的，可被所有工作线程共享；
+        # HTTP/1.1 下使用可中断的连接，取消任务时线程池中的在途请求立即结束
+        self._client = httpx.Client(
+            http2=self.http2,
+            limits=limits,
+            transport=None if self.http2 else _CancellableTransport(limits),
+            mounts=None if self.http2 else _cancellable_mounts(limits),
+            timeout=httpx.Timeout(120.0, connect=Config.HTTP_CONNECT_TIMEOUT)
+        )
+
+    def post(self, url: str, *, json: Any = None, content: Optional[bytes] = None,
+             headers: Optional[Dict[str, str]] = None,
+             timeout: Optional[float] = None) -> httpx.Response:
+        """
+        发送 POST 请求并记录连接复用情况
+
+        json 经 json_codec 编码；重试时可传入预先编码好的 content，避免重复编码大请求体
+        """
+        if json is not None:
+            content = json_dumps(json)
+            headers = {**(headers or {}), 'Content-Type': 'application/json'}
+        tracer = _ConnectionTracer()
+        request_timeout = httpx.Timeout(timeout, connect=Config.HTTP_CONNECT_TIMEOUT) \
+            if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        try:
+            response = self._client.post(url, content=content, headers=headers,
+                                         timeout=request_timeout,
+                                         extensions={'trace': tracer})
+        except httpx.HTTPError:
+            self.stats.record_error()
+            raise
+        self.stats.record(new_connection=tracer.opened)
+        return response
+
+    @contextmanager
+    def stream(self, url: str, *, content: bytes, headers: Optional[Dict[str, str]] = None,
+               timeout: Optional[float] = None) -> Iterator[httpx.Response]:
+        """
+        发送 POST 请求并以流式方式读取响应体，退出上下文时关闭响应
+
+        timeout 为相邻两次读取之间的最长等待时间，而不是整个响应的总时间
+        """
+        tracer = _ConnectionTracer()
+        request_timeout = httpx.Timeout(timeout, connect=Config.HTTP_CONNECT_TIMEOUT) \
+            if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        try:
+            with self._client.stream('POST', url, content=content, headers=headers,
+                                     timeout=request_timeout,
+                                     extensions={'trace': tracer}) as response:
+                self.stats.record(new_connection=tracer.opened)
+                yield response
+        except httpx.HTTPError:
+            self.stats.record_error()
+            raise
+
+    def warm_up(self, connections: int = 1, timeout: float = 5.0):
+        """
+        预热连接：提前完成 TCP/TLS 握手，使连接进入 keep-alive 池
+        对 origin 发送 HEAD 请求，任意状态码都视为成功
+        """
+        connections = max(1, min(connections, self.max_connections))
+
+        def _probe(_):
+            tracer = _ConnectionTracer()
+            try:
+                self._client.head(self.origin, timeout=timeout,
+                                  extensions={'trace': tracer})
+                return True
+            except httpx.HTTPError as e:
+                logger.warning(f"[连接池] 预热 {self.origin} 失败: {e}")
+                return False
+
+        # HTTP/1.1 下并发探测才能建立多条连接
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            ok = sum(1 for r in executor.map(_probe, range(connections)) if r)
+        logger.info(f"[连接池] 预热 {self.origin} 完成: {ok}/{connections}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.stats.to_dict()
+        data.update({
+            'http2': self.http2,
+            'max_connections': self.max_connections
+        })
+        return data
+
+    def close(self):
+        self._client.close()
+
+
+class AsyncPooledClient:
+    """
+    单个上游 origin 的共享 AsyncClient（asyncio 生成引擎使用）
+    AsyncClient 绑定创建它的事件循环，只能在该循环内使用
+    """
+
+    def __init__(self, origin: str, max_connections: int):
+        self.origin = origin
+        self.max_connections = max_connections
+        self.http2 = Config.HTTP2_ENABLED and _http2_available()
+        self.loop = asyncio.get_running_loop()
+        self.stats = ConnectionStats()
+        self._client = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(120.0, connect=Config.HTTP_CONNECT_TIMEOUT)
+        )
+
+    async def post(self, url: str, *, json: Any = None, content: Optional[bytes] = None,
+                   headers: Optional[Dict[str, str]] = None,
+                   timeout: Optional[float] = None) -> httpx.Response:
+        """
+        发送 POST 请求并记录连接复用情况
+
+        json 经 json_codec 编码；重试时可传入预先编码好的 content，避免重复编码大请求体
+        """
+        if json is not None:
+            content = json_dumps(json)
+            headers = {**(headers or {}), 'Content-Type': 'application/json'}
+        tracer = _AsyncConnectionTracer()
+        request_timeout = httpx.Timeout(timeout, connect=Config.HTTP_CONNECT_TIMEOUT) \
+            if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        try:
+            response = await self._client.post(url, content=content, headers=headers,
+                                               timeout=request_timeout,
+                                               extensions={'trace': tracer})
+        except httpx.HTTPError:
+            self.stats.record_error()
+            raise
+        self.stats.record(new_connection=tracer.opened)
+        return response
+
+    @asynccontextmanager
+    async def stream(self, url: str, *, content: bytes, headers: Optional[Dict[str, str]] = None,
+                     timeout: Optional[float] = None) -> AsyncIterator[httpx.Response]:
+        """PooledClient.stream 的异步版本"""
+        tracer = _AsyncConnectionTracer()
+        request_timeout = httpx.Timeout(timeout, connect=Config.HTTP_CONNECT_TIMEOUT) \
+            if timeout is not None else httpx.USE_CLIENT_DEFAULT
+        try:
+            async with self._client.stream('POST', url, content=content, headers=headers,
+                                           timeout=request_timeout,
+                                           extensions={'trace': tracer}) as response:
+                self.stats.record(new_connection=tracer.opened)
+                yield response
+        except httpx.HTTPError:
+            self.stats.record_error()
+            raise
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.stats.to_dict()
+        data.update({
+            'http2': self.http2,
+            'max_connections': self.max_connections
+        })
+        return data
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+class HttpClientPool:
+    """按 origin 管理共享客户端"""
+
+    def __init__(self):
+        self._clients: Dict[str, PooledClient] = {}
+        self._async_clients: Dict[str, AsyncPooledClient] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _pool_size_for(origin: str) -> int:
+        """
+        连接池大小与并发上限挂钩（启用自适应并发时取其上限）：
+        文字与图片 API 指向同一 origin 时两者相加，另留出交互请求的余量
+        """
+        size = 0
+        if Config.TEXT_API_BASE and origin_of(Config.TEXT_API_BASE) == origin:
+            size += concurrency_ceiling('text')
+        if Config.IMAGE_API_BASE and origin_of(Config.IMAGE_API_BASE) == origin:
+            size += concurrency_ceiling('image')
+        if size == 0:
+            # 前端临时传入的 API 地址，按图片并发数分配
+            size = concurrency_ceiling('image')
+        return size + Config.HTTP_POOL_HEADROOM
+
+    def get(self, base_url: str) -> PooledClient:
+        """获取（或创建）base URL 对应的共享客户端"""
+        origin = origin_of(base_url)
+        client = self._clients.get(origin)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(origin)
+                if client is None:
+                    client = PooledClient(origin, self._pool_size_for(origin))
+                    self._clients[origin] = client
+                    logger.info(f"[连接池] 创建 {origin}，最大连接数: {client.max_connections}, "
+                                f"HTTP/2: {client.http2}")
+        return client
+
+    def get_async(self, base_url: str) -> AsyncPooledClient:
+        """获取 base URL 对应的共享 AsyncClient，必须在事件循环内调用"""
+        origin = origin_of(base_url)
+        loop = asyncio.get_running_loop()
+        stale = None
+        with self._lock:
+            client = self._async_clients.get(origin)
+            if client is None or client.loop is not loop:
+                stale = client
+                client = AsyncPooledClient(origin, Config.ASYNC_HTTP_MAX_CONNECTIONS)
+                self._async_clients[origin] = client
+                logger.info(f"[连接池] 创建异步客户端 {origin}，最大连接数: {client.max_connections}, "
+                            f"HTTP/2: {client.http2}")
+        if stale is not None:
+            self._retire_async(stale)
+        return client
+
+    @staticmethod
+    def _retire_async(client: AsyncPooledClient):
+        """关闭被替换的 AsyncClient：连接绑定在其所属的事件循环上，须在该循环内 aclose"""
+        loop = client.loop
+        if loop.is_closed():
+            # 循环关闭时其传输已一并释放
+            return
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+            return
+        try:
+            loop.run_until_complete(client.aclose())
+        except RuntimeError as e:
+            logger.warning(f"[连接池] 关闭旧的异步客户端 {client.origin} 失败: {e}")
+
+    async def aclose_loop(self, loop: asyncio.AbstractEventLoop):
+        """关闭并移除绑定在指定事件循环上的 AsyncClient（在该循环内调用，引擎停止前使用）"""
+        with self._lock:
+            clients = [c for c in self._async_clients.values() if c.loop is loop]
+            for client in clients:
+                del self._async_clients[client.origin]
+        for client in clients:
+            await client.aclose()
+
+    def warm_up(self):
+        """预热已配置的文字/图片上游"""
+        for base_url in {Config.TEXT_API_BASE, Config.IMAGE_API_BASE}:
+            if base_url:
+                self.get(base_url).warm_up(Config.HTTP_WARMUP_CONNECTIONS)
+
+    def stats(self) -> Dict[str, Any]:
+        """各 origin 的连接复用统计"""
+        with self._lock:
+            clients = list(self._clients.values())
+            async_clients = list(self._async_clients.values())
+        stats = {c.origin: c.to_dict() for c in clients}
+        stats.update({f"{c.origin} (async)": c.to_dict() for c in async_clients})
+        return stats
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+# 单例实例和锁
+_http_pool: Optional[HttpClientPool] = None
+_http_pool_lock = threading.Lock()
+
+
+def get_http_pool() -> HttpClientPool:
+    """获取连接池单例（线程安全）"""
+    global _http_pool
+    if _http_pool is None:
+        with _http_pool_lock:
+            # 双重检查锁定
+            if _http_pool is None:
+                _http_pool = HttpClientPool()
+    return _http_pool
+
+
+def get_http_client(base_url: str) -> PooledClient:
+    """获取 base URL 对应的共享客户端"""
+    return get_http_pool().get(base_url)
+
+
+def get_async_http_client(base_url: str) -> AsyncPooledClient:
+    """获取 base URL 对应的共享 AsyncClient（须在事件循环内调用）"""
+    return get_http_pool().get_async(base_url)
@@ -0,0 +1,176 @@
+"""
+上游调用重试策略
+区分可重试错误（5xx、429、连接/读取超时、连接中断）与永久错误（其他 4xx、无效响应），
+可重试错误按带抖动的指数退避重试，并受单次调用的总时间预算限制
+"""
+import time
+import random
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+import httpx
+
+from config import Config
+from .concurrency import parse_retry_after
+from .cancellation import current_token, raise_if_cancelled
+
+logger = logging.getLogger(__name__)
+
+
+class AttemptTracker:
+    """记录当前上下文内的上游调用次数（用于写回 ScriptPage.attempts）"""
+
+    __slots__ = ('attempts', 'retries')
+
+    def __init__(self):
+        self.attempts = 0
+        self.retries = 0
+
+
+_attempt_tracker: ContextVar[Optional[AttemptTracker]] = ContextVar('attempt_tracker', default=None)
+
+
+@contextmanager
+def track_attempts() -> Iterator[AttemptTracker]:
+    """
+    在上下文内统计上游调用次数
+
+    线程和 asyncio 任务各自拥有独立的上下文，并发的页面互不干扰
+    """
+    tracker = AttemptTracker()
+    token = _attempt_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _attempt_tracker.reset(token)
+
+
+def _record_attempt(is_retry: bool):
+    tracker = _attempt_tracker.get()
+    if tracker is not None:
+        tracker.attempts += 1
+        if is_retry:
+            tracker.retries += 1
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """判断异常是否为可重试的瞬时错误"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    # 超时、连接失败、连接被重置等网络层错误
+    if isinstance(exc, httpx.TransportError):
+        return not isinstance(exc, (httpx.UnsupportedProtocol, httpx.LocalProtocolError))
+    return False
+
+
+def _retry_after_of(exc: BaseException) -> Optional[float]:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return parse_retry_after(exc.response.headers.get('Retry-After'))
+    return None
+
+
+def _describe(exc: BaseException) -> str:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return f"HTTP {exc.response.status_code}"
+    return f"{type(exc).__name__}: {exc}"
+
+
+class RetryPolicy:
+    """带抖动的指数退避重试策略"""
+
+    def __init__(self, name: str, max_attempts: int, base_delay: float,
+                 max_delay: float, budget: float):
+        """
+        Args:
+            name: 策略名称（日志用）
+            max_attempts: 最大尝试次数（含首次）
+            base_delay: 首次重试的基础等待时间（秒）
+            max_delay: 单次等待上限（秒）
+            budget: 单次调用（含所有重试和等待）的总时间预算（秒）
+        """
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def backoff(self, retry_number: int, retry_after: Optional[float] = None) -> float:
+        """第 retry_number 次重试前的等待时间（full jitter），不短于 Retry-After"""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (retry_number - 1)))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _next_delay(self, exc: BaseException, attempt: int, started_at: float) -> Optional[float]:
+        """返回下一次重试前的等待时间，不应重试时返回 None"""
+        if attempt >= self.max_attempts or not is_retryable(exc):
+            return None
+        delay = self.backoff(attempt, _retry_after_of(exc))
+        if time.monotonic() - started_at + delay >= self.budget:
+            logger.warning(f"[重试] {self.name} 超出时间预算 {self.budget}s，不再重试")
+            return None
+        logger.warning(f"[重试] {self.name} 第 {attempt} 次调用失败 ({_describe(exc)})，{delay:.1f}s 后重试")
+        return delay
+
+    def call(self, func: Callable[[], Any]) -> Any:
+        """执行 func，遇到可重试错误时按策略重试"""
+        started_at = time.monotonic()
+        attempt = 0
+        token = current_token()
+        while True:
+            attempt += 1
+            raise_if_cancelled()
+            _record_attempt(attempt > 1)
+            try:
+                return func()
+            except Exception as e:
+                # 取消时连接被主动关闭，得到的连接错误不是上游故障，不再重试
+                raise_if_cancelled()
+                delay = self._next_delay(e, attempt, started_at)
+                if delay is None:
+                    raise
+            # 任务被取消时立即结束退避等待
+            if token is not None:
+                token.sleep(delay)
+            else:
+                time.sleep(delay)
+
+    async def acall(self, coro_func: Callable[[], Awaitable[Any]]) -> Any:
+        """call 的 asyncio 版本"""
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            raise_if_cancelled()
+            _record_attempt(attempt > 1)
+            try:
+                return await coro_func()
+            except Exception as e:
+                delay = self._next_delay(e, attempt, started_at)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+
+_policies: Dict[str, RetryPolicy] = {}
+
+
+def get_retry_policy(api: str) -> RetryPolicy:
+    """获取 'text' 或 'image' 上游的重试策略"""
+    policy = _policies.get(api)
+    if policy is None:
+        policy = RetryPolicy(
+            name=api,
+            max_attempts=Config.RETRY_MAX_ATTEMPTS,
+            base_delay=Config.RETRY_BASE_DELAY,
+            max_delay=Config.RETRY_MAX_DELAY,
+            budget=Config.RETRY_IMAGE_BUDGET if api == 'image' else Config.RETRY_TEXT_BUDGET
+        )
+        # 策略对象无状态，并发创建时覆盖也无妨
+        _policies[api] = policy
+    return policy
@@ -0,0 +1,216 @@
+"""
+多任务公平调度
+多个任务共享同一执行器时，按任务排队并用加权差额轮询（DRR）放行，
+每个任务同时在途的页面数受窗口限制，大任务不会占满执行器而让后来的小任务长时间等待
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Deque, Dict, Tuple
+
+from .cancellation import TaskCancelledError
+
+logger = logging.getLogger(__name__)
+
+# 排队中的作业：(返回给调用方的 Future, 函数, 参数)
+_Job = Tuple[Future, Callable[..., Any], tuple]
+
+
+class FairScheduler:
+    """
+    在底层执行器之前按任务公平排队
+
+    - 全局在途数不超过 capacity（与底层执行器的并发数一致，多出的作业在这里排队而不是堆在执行器里）
+    - 每个任务在途数不超过 task_window
+    - 有作业排队的任务轮流放行，每轮可放行的数量与其权重（优先级）成正比
+    """
+
+    def __init__(self, name: str, submit_func: Callable[..., Future], capacity: int,
+                 task_window: int = 0):
+        """
+        Args:
+            name: 调度器名称（日志和指标用）
+            submit_func: 底层提交函数，如 ThreadPoolExecutor.submit，需返回 Future
+            capacity: 全局最大在途作业数
+            task_window: 单个任务最大在途作业数，<=0 表示不单独限制
+        """
+        self.name = name
+        self._submit_func = submit_func
+        self.capacity = max(1, capacity)
+        self.task_window = task_window if task_window > 0 else self.capacity
+
+        self._lock = threading.Lock()
+        self._queues: Dict[str, Deque[_Job]] = {}
+        self._ring: Deque[str] = deque()  # 有作业排队的任务，按轮询顺序
+        self._weights: Dict[str, int] = {}
+        self._deficit: Dict[str, float] = {}
+        self._task_in_flight: Dict[str, int] = {}
+        # 在途作业：任务 ID -> {返回给调用方的 Future: 底层 Future}，取消任务时使用
+        self._running: Dict[str, Dict[Future, Future]] = {}
+        self._in_flight = 0
+        self.dispatched = 0
+        self.cancelled = 0
+
+    def submit(self, task_id: str, func: Callable[..., Any], *args, priority: int = 1) -> Future:
+        """
+        提交作业，返回的 Future 在作业执行完成后完成
+
+        Args:
+            task_id: 作业所属任务
+            func: 作业函数
+            priority: 任务权重，越大每轮放行越多（>=1），以最近一次提交为准
+        """
+        future: Future = Future()
+        with self._lock:
+            queue = self._queues.get(task_id)
+            if queue is None:
+                queue = self._queues[task_id] = deque()
+                self._deficit[task_id] = 0.0
+            if not queue:
+                self._ring.append(task_id)
+            queue.append((future, func, args))
+            self._weights[task_id] = max(1, int(priority))
+            to_start = self._dispatch_locked()
+        self._start(to_start)
+        return future
+
+    def _dispatch_locked(self) -> list:
+        """按 DRR 选出可以放行的作业（需持有锁），返回 [(任务 ID, 作业)]"""
+        to_start = []
+        blocked = 0  # 连续因窗口已满而跳过的任务数
+        while self._in_flight < self.capacity and self._ring and blocked < len(self._ring):
+            task_id = self._ring[0]
+            queue = self._queues[task_id]
+            if not queue:
+                self._ring.popleft()
+                self._retire_locked(task_id)
+                continue
+            if self._task_in_flight.get(task_id, 0) >= self.task_window:
+                self._ring.rotate(-1)
+                blocked += 1
+                continue
+            blocked = 0
+
+            if self._deficit[task_id] < 1:
+                self._deficit[task_id] += self._weights.get(task_id, 1)
+            job = queue.popleft()
+            # 排队期间已被取消的作业直接丢弃
+            if not job[0].set_running_or_notify_cancel():
+                if not queue:
+                    self._ring.popleft()
+                    self._retire_locked(task_id)
+                continue
+            self._deficit[task_id] -= 1
+            self._task_in_flight[task_id] = self._task_in_flight.get(task_id, 0) + 1
+            self._in_flight += 1
+            self.dispatched += 1
+            to_start.append((task_id, job))
+
+            if not queue:
+                self._ring.popleft()
+                self._retire_locked(task_id)
+            elif self._deficit[task_id] < 1:
+                # 本轮额度用完，轮到下一个任务
+                self._ring.rotate(-1)
+        return to_start
+
+    def _retire_locked(self, task_id: str):
+        """任务的队列已空：重置差额；在途作业也已完成时释放其状态"""
+        self._deficit[task_id] = 0.0
+        if task_id not in self._task_in_flight:
+            self._queues.pop(task_id, None)
+            self._weights.pop(task_id, None)
+            self._deficit.pop(task_id, None)
+
+    def _start(self, jobs: list):
+        """在锁外把作业交给底层执行器"""
+        for task_id, (future, func, args) in jobs:
+            try:
+                inner = self._submit_func(func, *args)
+            except BaseException as e:
+                future.set_exception(e)
+                self._on_done(task_id)
+                continue
+            with self._lock:
+                self._running.setdefault(task_id, {})[future] = inner
+            inner.add_done_callback(
+                lambda f, task_id=task_id, future=future: self._complete(task_id, future, f)
+            )
+
+    @staticmethod
+    def _resolve(future: Future, result: Any = None, exception: BaseException = None):
+        """设置调用方 Future 的结果；已被取消逻辑提前结束时忽略"""
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _complete(self, task_id: str, future: Future, inner: Future):
+        with self._lock:
+            running = self._running.get(task_id)
+            if running is not None:
+                running.pop(future, None)
+                if not running:
+                    del self._running[task_id]
+        if inner.cancelled():
+            self._resolve(future, exception=TaskCancelledError("作业已取消"))
+        elif inner.exception() is not None:
+            self._resolve(future, exception=inner.exception())
+        else:
+            self._resolve(future, inner.result())
+        self._on_done(task_id)
+
+    def cancel_task(self, task_id: str) -> int:
+        """
+        取消任务的全部作业，返回被撤回或中止的作业数
+
+        排队中的作业直接撤回（调用方 Future 变为已取消）；在途作业尝试取消底层 Future
+        （asyncio 引擎中的协程会被中止），无法中止的线程池作业不再等待，其调用方 Future
+        立即以 TaskCancelledError 结束，名额在作业实际结束后释放
+        """
+        with self._lock:
+            queue = self._queues.get(task_id)
+            queued = list(queue) if queue else []
+            if queue:
+                queue.clear()
+                self._ring.remove(task_id)
+                self._retire_locked(task_id)
+            running = list(self._running.get(task_id, {}).items())
+            self.cancelled += len(queued) + len(running)
+        for future, _, _ in queued:
+            # 作业已移出队列，由这里通知 as_completed / wait 的等待者
+            if future.cancel():
+                future.set_running_or_notify_cancel()
+        for future, inner in running:
+            if not inner.cancel():
+                self._resolve(future, exception=TaskCancelledError("作业已取消"))
+        return len(queued) + len(running)
+
+    def _on_done(self, task_id: str):
+        with self._lock:
+            self._in_flight -= 1
+            remaining = self._task_in_flight.get(task_id, 1) - 1
+            if remaining > 0:
+                self._task_in_flight[task_id] = remaining
+            else:
+                self._task_in_flight.pop(task_id, None)
+                if not self._queues.get(task_id):
+                    self._retire_locked(task_id)
+            to_start = self._dispatch_locked()
+        self._start(to_start)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'task_window': self.task_window,
+                'in_flight': self._in_flight,
+                'queued': sum(len(q) for q in self._queues.values()),
+                'active_tasks': len(set(self._queues) | set(self._task_in_flight)),
+                'dispatched': self.dispatched,
+                'cancelled': self.cancelled
+            }
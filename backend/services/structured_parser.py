@@ -0,0 +1,281 @@
+"""
+结构化脚本快速解析
+带表头的 Excel、字段明确的 JSON 以及用镜头标记分段的 txt/md 不需要 AI：
+识别表头/字段名并映射到 ScriptPage 字段，毫秒级得到页面列表；
+无法识别结构时返回 None，由调用方回退到 AI 解析
+"""
+import re
+import json
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+import openpyxl
+
+logger = logging.getLogger(__name__)
+
+# 页面字段及其列名/键名别名（比较时去掉空白和冒号并转小写）
+# 匹配度相同时靠前的字段优先（如 "画面内容" 归为画面而不是讲稿）
+_FIELD_ALIASES: Dict[str, tuple] = {
+    'shot_number': ('镜号', '镜头号', '镜头', '序号', '页码', '页号', '编号', 'shot', 'shotnumber', 'no', '#'),
+    'segment': ('环节', '章节', '段落', '部分', '模块', '板块', 'segment', 'section', 'chapter'),
+    'visual_hint': ('画面描述', '镜头画面', '画面', '视觉提示', '视觉', '配图', 'visualhint', 'visual', 'image'),
+    'narration': ('讲稿', '旁白', '解说词', '解说', '台词', '口播', '文案', '讲解', '内容', 'narration', 'script', 'text'),
+}
+
+# 在前若干个非空行内查找表头（前面可能有标题、作者等元数据行）
+HEADER_SCAN_ROWS = 10
+
+# 视为空内容的讲稿
+_EMPTY_VALUES = {'', '/'}
+
+# 镜头标记行：第N镜/页/幕、镜号：N、【镜头N】、Shot N，可带 Markdown 标题前缀
+_SHOT_MARKER_RE = re.compile(
+    r'^\s*(?:#{1,6}\s*)?(?:'
+    r'第\s*(?P<a>[0-9一二三四五六七八九十百零]+)\s*[镜页幕]'
+    r'|镜号\s*[:：]?\s*(?P<b>\d+)'
+    r'|[【\[]\s*(?:镜头?|shot|page)\s*(?P<c>\d+)\s*[】\]]'
+    r'|(?:shot|scene)\s*(?P<d>\d+)'
+    r')\s*[:：.、\-—]*\s*(?P<rest>.*)$',
+    re.IGNORECASE
+)
+# "画面：xxx" 形式的字段行
+_LABEL_RE = re.compile(r'^\s*[-*]?\s*(?P<label>[^:：]{1,8}?)\s*[:：]\s*(?P<value>.*)$')
+_HEADING_RE = re.compile(r'^\s*#{1,6}\s*(?P<title>.+?)\s*#*\s*$')
+
+
+def _normalize(name: Any) -> str:
+    return re.sub(r'[\s:：_\-]+', '', str(name or '')).lower()
+
+
+def _match_score(name: str, alias: str) -> int:
+    """
+    列名与别名的匹配程度：完全一致 > 包含别名（别名越长越可信）
+    英文短别名（如 no）只接受完全一致，避免 notes 之类的误匹配
+    """
+    if name == alias:
+        return 1000
+    if (len(alias) >= 4 or (len(alias) > 1 and not alias.isascii())) and alias in name:
+        return len(alias)
+    return 0
+
+
+def field_for(name: Any) -> Optional[str]:
+    """单个列名/标签对应的页面字段，无法识别时返回 None"""
+    name = _normalize(name)
+    if not name:
+        return None
+    best, best_score = None, 0
+    for field_name, aliases in _FIELD_ALIASES.items():
+        score = max(_match_score(name, alias) for alias in aliases)
+        if score > best_score:
+            best, best_score = field_name, score
+    return best
+
+
+def map_columns(names: Sequence[Any]) -> Optional[Dict[str, int]]:
+    """
+    将表头映射为 {字段: 列序号}
+
+    每列只分配给匹配度最高的字段；必须识别出讲稿列，且至少还有一个其他字段，
+    否则返回 None（避免把普通的正文行误当作表头）
+    """
+    candidates = []
+    for column, raw in enumerate(names):
+        name = _normalize(raw)
+        if not name:
+            continue
+        for field_name, aliases in _FIELD_ALIASES.items():
+            score = max(_match_score(name, alias) for alias in aliases)
+            if score:
+                candidates.append((score, column, field_name))
+
+    mapping: Dict[str, int] = {}
+    used_columns = set()
+    for score, column, field_name in sorted(candidates, key=lambda c: (-c[0], c[1])):
+        if field_name not in mapping and column not in used_columns:
+            mapping[field_name] = column
+            used_columns.add(column)
+
+    if 'narration' not in mapping or len(mapping) < 2:
+        return None
+    return mapping
+
+
+def _cell(row: Sequence[Any], column: Optional[int]) -> str:
+    if column is None or column >= len(row) or row[column] is None:
+        return ''
+    value = row[column]
+    # Excel 中的整数镜号会读成 1.0
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _map_rows(rows: Iterable[Sequence[Any]], mapping: Dict[str, int]) -> List[Dict[str, Any]]:
+    """
+    按列映射逐行生成页面数据
+
+    环节列为空时沿用上一行的环节（合并单元格只有首行有值）；讲稿为空或为 "/" 的行跳过
+    """
+    pages: List[Dict[str, Any]] = []
+    segment = ''
+    for row in rows:
+        narration = _cell(row, mapping['narration'])
+        segment = _cell(row, mapping.get('segment')) or segment
+        if narration in _EMPTY_VALUES:
+            continue
+        pages.append({
+            'shot_number': _cell(row, mapping.get('shot_number')) or str(len(pages) + 1),
+            'segment': segment,
+            'narration': narration,
+            'visual_hint': _cell(row, mapping.get('visual_hint'))
+        })
+    return pages
+
+
+def rows_to_pages(rows: Iterable[Sequence[Any]]) -> Optional[List[Dict[str, Any]]]:
+    """在前 HEADER_SCAN_ROWS 个非空行内找到表头，之后的行按表头映射为页面"""
+    non_empty: Iterator[Sequence[Any]] = (
+        row for row in rows if any(cell is not None and str(cell).strip() for cell in row)
+    )
+    for scanned, row in enumerate(non_empty, 1):
+        mapping = map_columns(row)
+        if mapping is not None:
+            return _map_rows(non_empty, mapping) or None
+        if scanned >= HEADER_SCAN_ROWS:
+            break
+    return None
+
+
+def parse_excel(file_path: str) -> Optional[List[Dict[str, Any]]]:
+    """按表头解析 Excel 活动工作表"""
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        return rows_to_pages(wb.active.iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def parse_json_text(text: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    解析 JSON 脚本：对象数组（键名映射到字段）、二维数组（首行为表头），
+    或把上述数组放在 pages/shots/data 等键下的对象
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        data = next((data[key] for key in ('pages', 'shots', 'scenes', 'data', 'items', 'rows')
+                     if isinstance(data.get(key), list)), None)
+    if not isinstance(data, list) or not data:
+        return None
+
+    if all(isinstance(item, list) for item in data):
+        return rows_to_pages(data)
+    if not all(isinstance(item, dict) for item in data):
+        return None
+
+    # 各对象的键名取并集作为"表头"，对象按键取值转成行
+    keys = list(dict.fromkeys(key for item in data for key in item))
+    mapping = map_columns(keys)
+    if mapping is None:
+        return None
+    return _map_rows(([item.get(key) for key in keys] for item in data), mapping) or None
+
+
+def parse_shot_markers(text: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    解析用镜头标记分段的纯文本/Markdown
+
+    每个镜头标记行开始一页；"画面：/环节：/讲稿：" 等标签行写入对应字段，其余行并入讲稿；
+    非镜头标记的 Markdown 标题作为之后各页的环节。少于 2 个镜头标记时视为无法识别
+    """
+    blocks: List[Dict[str, Any]] = []
+    segment = ''
+    current: Optional[Dict[str, Any]] = None
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        marker = _SHOT_MARKER_RE.match(line)
+        if marker:
+            number = next(marker.group(g) for g in 'abcd' if marker.group(g))
+            current = {'shot_number': number, 'segment': segment, 'narration': [], 'visual_hint': []}
+            blocks.append(current)
+            rest = marker.group('rest').strip()
+            if rest:
+                line = rest
+                # "第1镜 开场" 中较短的标题视为环节
+                if not _LABEL_RE.match(rest) and len(rest) <= 20:
+                    current['segment'] = rest
+                    continue
+            else:
+                continue
+        else:
+            heading = _HEADING_RE.match(line)
+            if heading:
+                segment = heading.group('title')
+                if current is not None and not current['narration']:
+                    current['segment'] = segment
+                continue
+        if current is None:
+            # 第一个镜头标记之前是标题、作者等元数据
+            continue
+
+        label = _LABEL_RE.match(line)
+        field_name = field_for(label.group('label')) if label else None
+        if field_name == 'segment':
+            current['segment'] = label.group('value').strip()
+        elif field_name == 'visual_hint':
+            current['visual_hint'].append(label.group('value').strip())
+        elif field_name == 'narration':
+            current['narration'].append(label.group('value').strip())
+        elif field_name != 'shot_number':
+            current['narration'].append(line.strip())
+
+    if len(blocks) < 2:
+        return None
+    pages = []
+    for block in blocks:
+        narration = '\n'.join(part for part in block['narration'] if part)
+        if narration in _EMPTY_VALUES:
+            continue
+        pages.append({
+            'shot_number': block['shot_number'],
+            'segment': block['segment'],
+            'narration': narration,
+            'visual_hint': '\n'.join(part for part in block['visual_hint'] if part)
+        })
+    # 多数镜头都没有讲稿说明标记识别有误
+    if len(pages) * 2 < len(blocks):
+        return None
+    return pages
+
+
+def parse_structured(file_path: str, suffix: str, text: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    尝试按结构解析脚本文件
+
+    Args:
+        file_path: 文件路径
+        suffix: 小写扩展名
+        text: 已读取的文本内容（txt/md/json），省略时按需读取
+
+    Returns:
+        页面数据列表（字段同 parse_with_ai 的返回值），无法识别结构时返回 None
+    """
+    try:
+        if suffix == '.xlsx':
+            return parse_excel(file_path)
+        if suffix not in ('.json', '.txt', '.md'):
+            return None
+        if text is None:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        if suffix == '.json':
+            return parse_json_text(text)
+        return parse_shot_markers(text)
+    except Exception as e:
+        # 快速解析只是优化，任何异常都回退到 AI 解析
+        logger.warning(f"[structured_parser] 结构化解析 {file_path} 失败，回退到 AI 解析: {e}")
+        return None
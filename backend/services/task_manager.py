@@ -1,22 +1,49 @@
 """
 任务队列管理器
-使用 ThreadPoolExecutor 实现并发控制
+使用 ThreadPoolExecutor（或 asyncio 生成引擎）实现并发控制
 参考 banana-slides 架构
 """
 import uuid
+import json
+import functools
+import atexit
+import base64
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass, field, asdict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import List, Dict, Any, Optional, Callable
-from threading import Lock
+from typing import List, Dict, Any, Optional, Callable, Union, Awaitable, Set, Iterable, Tuple
+from threading import Lock, RLock
 
 from config import Config
-from .file_parser import ScriptPage, PageStatus
+from .file_parser import ScriptPage, PageStatus, DATACLASS_OPTIONS
+from .generation_engine import AsyncioEngine
+from .concurrency import concurrency_ceiling
+from .retry import track_attempts
+from .concurrency import use_lane, LANE_BATCH
+from .task_store import create_task_store
+from .event_bus import get_event_bus
+from .scheduler import FairScheduler
+from .cancellation import CancellationToken, TaskCancelledError, current_token, use_token
+from .ai_service import pack_description_batches
 
 logger = logging.getLogger(__name__)
 
+# 生成函数：同步函数在线程池中执行，协程函数在 asyncio 引擎中执行
+PageFunc = Callable[[ScriptPage], Union[str, Awaitable[str]]]
+# 多页描述生成函数：接收一组页面，返回 (页面 ID -> 描述, 失败的页面 ID -> 错误信息)
+BatchResult = Tuple[Dict[str, str], Dict[str, str]]
+BatchFunc = Callable[[List[ScriptPage]], Union[BatchResult, Awaitable[BatchResult]]]
+
+# 生成阶段 -> (进行中的页面状态, 完成后的页面状态, 结果写入的页面字段)
+_STAGES = {
+    'description': (PageStatus.GENERATING_DESC, PageStatus.PENDING, 'description'),  # PENDING 表示等待图片生成
+    'image': (PageStatus.GENERATING_IMAGE, PageStatus.COMPLETED, 'image_path'),
+}
+
 
 class TaskStatus(str, Enum):
     """任务状态"""
@@ -29,7 +56,7 @@ class TaskStatus(str, Enum):
     CANCELLED = "cancelled"
 
 
-@dataclass
+@dataclass(**DATACLASS_OPTIONS)
 class BatchTask:
     """批量任务"""
     id: str = field(default_factory=lambda: str(uuid.uuid4()))
@@ -43,14 +70,117 @@ class BatchTask:
     updated_at: datetime = field(default_factory=datetime.now)
     error_message: str = ""
     output_path: str = ""  # 导出文件路径
+    options: Dict[str, Any] = field(default_factory=dict)  # 生成参数（如 custom_prompt），恢复生成时沿用
+    version: int = 0  # 任务或任一页面变化时递增，页面记录自己最后一次变化时的任务版本
+
+    # 以下索引在创建时由 pages 构建，之后随页面变化增量维护（均由 lock 保护）
+    lock: RLock = field(default_factory=RLock, repr=False, compare=False)
+    _pages_by_id: Dict[str, ScriptPage] = field(default_factory=dict, repr=False, compare=False)
+    _pages_by_status: Dict[PageStatus, Dict[str, ScriptPage]] = field(default_factory=dict, repr=False, compare=False)
+    _pages_by_phase: Dict[str, Dict[str, ScriptPage]] = field(default_factory=dict, repr=False, compare=False)
+
+    def __post_init__(self):
+        self._pages_by_id = {p.id: p for p in self.pages}
+        self._pages_by_status = {status: {} for status in PageStatus}
+        self._pages_by_phase = {}
+        for page in self.pages:
+            self._pages_by_status[page.status][page.id] = page
+            self._pages_by_phase.setdefault(page.completed_phase, {})[page.id] = page
+        self.completed_pages = len(self._pages_by_status[PageStatus.COMPLETED])
+
+    def get_page(self, page_id: str) -> Optional[ScriptPage]:
+        """按 ID 获取页面"""
+        return self._pages_by_id.get(page_id)
+
+    def count_pages(self, status: PageStatus) -> int:
+        """某一状态的页面数"""
+        return len(self._pages_by_status[status])
+
+    def pages_with_phase(self, phase: str) -> List[ScriptPage]:
+        """已完成阶段为 phase 的页面（按页面顺序）"""
+        with self.lock:
+            pages = list(self._pages_by_phase.get(phase, {}).values())
+        return sorted(pages, key=lambda p: p.index)
+
+    def pages_with_status(self, status: PageStatus) -> List[ScriptPage]:
+        """状态为 status 的页面（按页面顺序）"""
+        with self.lock:
+            pages = list(self._pages_by_status[status].values())
+        return sorted(pages, key=lambda p: p.index)
+
+    def set_page_status(self, page: ScriptPage, status: PageStatus):
+        """修改页面状态并维护计数（调用方需持有 lock）"""
+        self._pages_by_status[page.status].pop(page.id, None)
+        page.status = status
+        self._pages_by_status[status][page.id] = page
+        self.completed_pages = len(self._pages_by_status[PageStatus.COMPLETED])
+
+    def set_page_phase(self, page: ScriptPage, phase: str):
+        """修改页面已完成的阶段并维护索引（调用方需持有 lock）"""
+        self._pages_by_phase.get(page.completed_phase, {}).pop(page.id, None)
+        page.completed_phase = phase
+        self._pages_by_phase.setdefault(phase, {})[page.id] = page
 
     def to_dict(self) -> Dict[str, Any]:
         """转换为字典"""
+        data = self.to_header()
+        data['pages'] = [p.to_dict() for p in self.pages]
+        return data
+
+    def to_header(self) -> Dict[str, Any]:
+        """任务概要（不含页面）"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status.value,
+            'total_pages': self.total_pages,
+            'completed_pages': self.completed_pages,
+            'current_phase': self.current_phase,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat(),
+            'error_message': self.error_message,
+            'output_path': self.output_path,
+            'progress': self.progress,
+            'stage_progress': self.stage_progress(),
+            'version': self.version
+        }
+
+    def to_delta(self, since: int) -> Dict[str, Any]:
+        """任务概要加上 since 版本之后变化的页面"""
+        data = self.to_header()
+        data['pages'] = [p.to_dict() for p in self.pages if p.version > since]
+        data['since'] = since
+        return data
+
+    def stage_progress(self) -> Dict[str, int]:
+        """各阶段已完成的页面数"""
+        with self.lock:
+            images = len(self._pages_by_phase.get('image', {}))
+            descriptions = len(self._pages_by_phase.get('description', {})) + images
+        return {'description': descriptions, 'image': images}
+
+    def page_counts(self) -> Dict[str, int]:
+        """各状态的页面数"""
+        return {status.value: len(pages) for status, pages in self._pages_by_status.items()}
+
+    def to_summary(self) -> Dict[str, Any]:
+        """列表用的任务摘要：任务概要加各状态页面数，不含页面内容"""
+        return self.summary_from_record(self.to_record())
+
+    @staticmethod
+    def summary_from_record(record: Dict[str, Any]) -> Dict[str, Any]:
+        """由任务存储的记录生成任务摘要，无需加载页面"""
+        summary = {k: v for k, v in record.items() if k != 'options'}
+        total = record.get('total_pages', 0)
+        summary['progress'] = round(record.get('completed_pages', 0) / total * 100, 1) if total else 0.0
+        return summary
+
+    def to_record(self) -> Dict[str, Any]:
+        """任务存储使用的记录（不含页面）"""
         return {
             'id': self.id,
             'name': self.name,
             'status': self.status.value,
-            'pages': [p.to_dict() for p in self.pages],
             'total_pages': self.total_pages,
             'completed_pages': self.completed_pages,
             'current_phase': self.current_phase,
@@ -58,9 +188,30 @@ class BatchTask:
             'updated_at': self.updated_at.isoformat(),
             'error_message': self.error_message,
             'output_path': self.output_path,
-            'progress': self.progress
+            'options': self.options,
+            'version': self.version,
+            'page_counts': self.page_counts()
         }
 
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], pages: List[Dict[str, Any]]) -> 'BatchTask':
+        """从任务存储的记录恢复"""
+        return cls(
+            id=record['id'],
+            name=record.get('name', ''),
+            status=TaskStatus(record['status']),
+            pages=[ScriptPage.from_dict(p) for p in pages],
+            total_pages=record.get('total_pages', len(pages)),
+            completed_pages=record.get('completed_pages', 0),
+            current_phase=record.get('current_phase', ''),
+            created_at=datetime.fromisoformat(record['created_at']),
+            updated_at=datetime.fromisoformat(record['updated_at']),
+            error_message=record.get('error_message', ''),
+            output_path=record.get('output_path', ''),
+            options=record.get('options') or {},
+            version=record.get('version', 0)
+        )
+
     @property
     def progress(self) -> float:
         """计算进度百分比"""
@@ -73,16 +224,267 @@ class TaskManager:
     """任务管理器"""
 
     def __init__(self):
+        # 内存中的任务；其余已持久化的任务在首次访问时从存储加载
         self._tasks: Dict[str, BatchTask] = {}
         self._lock = Lock()
+        # 本进程内正在执行生成的任务；状态为生成中但不在此集合中的任务是被中断的
+        self._running: Set[str] = set()
+        # 正在生成的任务本次运行的取消令牌
+        self._tokens: Dict[str, CancellationToken] = {}
+        # 进行中页面的所有者：页面 ID -> (所属运行的取消令牌, 失败或取消时需要还原的字段)，由任务的 lock 保护；
+        # 已取消运行中残留的线程只能改写仍归自己所有的页面，不会覆盖重新启动后的新运行
+        self._page_claims: Dict[str, Tuple[CancellationToken, Dict[str, Any]]] = {}
+        self._store = create_task_store()
+        # 进程退出前写入尚未落盘的页面更新
+        atexit.register(self._store.close)
+        # 线程数按自适应并发上限创建，实际在途请求数由 AIService 的限制器控制
         self._desc_executor = ThreadPoolExecutor(
-            max_workers=Config.MAX_DESCRIPTION_WORKERS,
+            max_workers=concurrency_ceiling('text'),
             thread_name_prefix="desc_worker"
         )
         self._image_executor = ThreadPoolExecutor(
-            max_workers=Config.MAX_IMAGE_WORKERS,
+            max_workers=concurrency_ceiling('image'),
             thread_name_prefix="image_worker"
         )
+        self._async_engine: Optional[AsyncioEngine] = None
+        # 页面先在公平调度器中按任务排队，再交给执行器，多个任务轮流获得并发名额
+        self._schedulers: Dict[str, FairScheduler] = {
+            'description': FairScheduler('description', self._desc_executor.submit,
+                                         concurrency_ceiling('text'), Config.SCHEDULER_TASK_WINDOW),
+            'image': FairScheduler('image', self._image_executor.submit,
+                                   concurrency_ceiling('image'), Config.SCHEDULER_TASK_WINDOW)
+        }
+        # 执行整个任务流程的协调线程（等待页面结果、更新进度），数量有上限
+        self._coordinator_executor = ThreadPoolExecutor(
+            max_workers=Config.MAX_CONCURRENT_TASKS,
+            thread_name_prefix="task_coordinator"
+        )
+
+    @property
+    def engine(self) -> str:
+        """当前配置的生成引擎：'thread' 或 'asyncio'"""
+        return 'asyncio' if Config.GENERATION_ENGINE == 'asyncio' else 'thread'
+
+    def _get_async_engine(self) -> AsyncioEngine:
+        """按需启动 asyncio 生成引擎"""
+        if self._async_engine is None:
+            with self._lock:
+                if self._async_engine is None:
+                    limits = {
+                        'description': Config.ASYNC_MAX_DESCRIPTION_CONCURRENCY,
+                        'image': Config.ASYNC_MAX_IMAGE_CONCURRENCY
+                    }
+                    engine = AsyncioEngine(limits)
+                    for stage, limit in limits.items():
+                        self._schedulers[f'async_{stage}'] = FairScheduler(
+                            f'async_{stage}', functools.partial(engine.submit, stage),
+                            limit, Config.SCHEDULER_TASK_WINDOW
+                        )
+                    self._async_engine = engine
+        return self._async_engine
+
+    def run_in_background(self, func: Callable[[], Any]) -> Future:
+        """在协调线程池中执行任务流程（如 start_generation 的生成流程）"""
+        return self._coordinator_executor.submit(func)
+
+    def _submit_page(self, stage: str, task: BatchTask, page: ScriptPage, func: PageFunc) -> Future:
+        """
+        将单个页面的某一阶段经公平调度器提交到对应的执行器
+
+        协程函数提交到 asyncio 引擎，普通函数提交到线程池，
+        两者都返回 concurrent.futures.Future，收集结果的逻辑保持一致
+        """
+        priority = task.options.get('priority', 1)
+        token = self._run_token(task.id)
+        if asyncio.iscoroutinefunction(func):
+            self._get_async_engine()
+            return self._schedulers[f'async_{stage}'].submit(
+                task.id, self._process_page_async, stage, task, page, func, token, priority=priority
+            )
+        return self._schedulers[stage].submit(
+            task.id, self._process_page, stage, task, page, func, token, priority=priority
+        )
+
+    def _claim_page(self, task: BatchTask, page: ScriptPage, running_status: PageStatus,
+                    token: CancellationToken, result_field: str):
+        """页面进入进行中状态，记录本次运行为其所有者及结果字段的原值"""
+        with task.lock:
+            self._page_claims[page.id] = (token, {result_field: getattr(page, result_field)})
+            self._set_page_status(task, page, running_status)
+
+    def _release_page(self, task: BatchTask, page: ScriptPage,
+                      token: CancellationToken) -> Optional[Dict[str, Any]]:
+        """
+        解除本次运行对页面的所有权（需要与随后的状态写入保持原子时，调用方先持有任务的 lock）
+
+        Returns:
+            登记时需要还原的字段；页面已不归本次运行所有时返回 None
+        """
+        with task.lock:
+            claim = self._page_claims.get(page.id)
+            if claim is None or claim[0] is not token:
+                return None
+            del self._page_claims[page.id]
+            return claim[1]
+
+    def _abandon_page(self, task: BatchTask, page: ScriptPage, token: CancellationToken) -> tuple:
+        """任务已取消：丢弃本阶段结果，仍归本次运行所有的页面还原结果字段并回到待生成状态"""
+        with task.lock:
+            restore = self._release_page(task, page, token)
+            if restore is not None:
+                self._set_page_status(task, page, PageStatus.PENDING, **restore)
+        return page.index, False, token.reason
+
+    def _complete_page(self, task: BatchTask, page: ScriptPage, token: CancellationToken,
+                       status: PageStatus, **kwargs) -> bool:
+        """写入本阶段的结果；任务已取消或页面已被接管时不写入并返回 False"""
+        with task.lock:
+            if token.cancelled:
+                return False
+            restore = self._release_page(task, page, token)
+            if restore is None:
+                return False
+            if status == PageStatus.ERROR:
+                kwargs = {**restore, **kwargs}
+            self._set_page_status(task, page, status, **kwargs)
+            return True
+
+    def _process_page(self, stage: str, task: BatchTask, page: ScriptPage, func: PageFunc,
+                      token: CancellationToken) -> tuple:
+        """执行单个页面的一个阶段，返回 (页面索引, 是否成功, 结果或错误信息)"""
+        running_status, done_status, result_field = _STAGES[stage]
+        if token.cancelled:
+            return page.index, False, token.reason
+        # 批量任务的上游调用走批量通道，不占用交互请求的预留名额
+        with use_lane(LANE_BATCH), use_token(token), track_attempts() as tracker:
+            try:
+                # 流式生成会先写入部分结果，失败或取消时还原
+                self._claim_page(task, page, running_status, token, result_field)
+                result = func(page)
+                # 完成时任务已被取消则丢弃结果
+                token.raise_if_cancelled()
+                if not self._complete_page(task, page, token, done_status, completed_phase=stage,
+                                           error_message="", attempts=page.attempts + tracker.attempts,
+                                           **{result_field: result}):
+                    return self._abandon_page(task, page, token)
+                return page.index, True, result
+            except Exception as e:
+                if token.cancelled:
+                    return self._abandon_page(task, page, token)
+                self._complete_page(task, page, token, PageStatus.ERROR, error_message=str(e),
+                                    attempts=page.attempts + tracker.attempts)
+                return page.index, False, str(e)
+
+    async def _process_page_async(self, stage: str, task: BatchTask, page: ScriptPage,
+                                  func: PageFunc, token: CancellationToken) -> tuple:
+        """_process_page 的 asyncio 版本，取消任务时协程（连同在途请求）被直接中止"""
+        running_status, done_status, result_field = _STAGES[stage]
+        if token.cancelled:
+            return page.index, False, token.reason
+        # 批量任务的上游调用走批量通道，不占用交互请求的预留名额
+        with use_lane(LANE_BATCH), use_token(token), track_attempts() as tracker:
+            try:
+                # 流式生成会先写入部分结果，失败或取消时还原
+                self._claim_page(task, page, running_status, token, result_field)
+                result = await func(page)
+                token.raise_if_cancelled()
+                if not self._complete_page(task, page, token, done_status, completed_phase=stage,
+                                           error_message="", attempts=page.attempts + tracker.attempts,
+                                           **{result_field: result}):
+                    return self._abandon_page(task, page, token)
+                return page.index, True, result
+            except asyncio.CancelledError:
+                self._abandon_page(task, page, token)
+                raise
+            except Exception as e:
+                if token.cancelled:
+                    return self._abandon_page(task, page, token)
+                self._complete_page(task, page, token, PageStatus.ERROR, error_message=str(e),
+                                    attempts=page.attempts + tracker.attempts)
+                return page.index, False, str(e)
+
+    def _submit_batch(self, task: BatchTask, pages: List[ScriptPage], func: BatchFunc) -> Future:
+        """将一组页面的描述生成作为一个作业提交，与单页作业共用描述阶段的调度器"""
+        priority = task.options.get('priority', 1)
+        token = self._run_token(task.id)
+        if asyncio.iscoroutinefunction(func):
+            self._get_async_engine()
+            return self._schedulers['async_description'].submit(
+                task.id, self._process_batch_async, task, pages, func, token, priority=priority
+            )
+        return self._schedulers['description'].submit(
+            task.id, self._process_batch, task, pages, func, token, priority=priority
+        )
+
+    def _finish_batch(self, task: BatchTask, pages: List[ScriptPage], result: BatchResult,
+                      attempts: int, token: CancellationToken) -> List[tuple]:
+        """写回一组页面的描述结果，返回各页面的 (页面索引, 是否成功, 结果或错误信息)"""
+        descriptions, errors = result
+        outcomes = []
+        for page in pages:
+            description = descriptions.get(page.id)
+            if description:
+                if self._complete_page(task, page, token, PageStatus.PENDING, completed_phase='description',
+                                       error_message="", attempts=page.attempts + attempts,
+                                       description=description):
+                    outcomes.append((page.index, True, description))
+                else:
+                    outcomes.append(self._abandon_page(task, page, token))
+            else:
+                error = errors.get(page.id) or "未返回该页描述"
+                self._complete_page(task, page, token, PageStatus.ERROR, error_message=error,
+                                    attempts=page.attempts + attempts)
+                outcomes.append((page.index, False, error))
+        return outcomes
+
+    def _process_batch(self, task: BatchTask, pages: List[ScriptPage], func: BatchFunc,
+                       token: CancellationToken) -> List[tuple]:
+        """一次请求生成一组页面的描述，返回各页面的 (页面索引, 是否成功, 结果或错误信息)"""
+        if token.cancelled:
+            return [(page.index, False, token.reason) for page in pages]
+        with use_lane(LANE_BATCH), use_token(token), track_attempts() as tracker:
+            for page in pages:
+                self._claim_page(task, page, PageStatus.GENERATING_DESC, token, 'description')
+            try:
+                result = func(pages)
+                token.raise_if_cancelled()
+            except Exception as e:
+                if token.cancelled:
+                    return [self._abandon_page(task, page, token) for page in pages]
+                result = {}, {page.id: str(e) for page in pages}
+            # 多页请求的调用次数计入组内每个页面
+            return self._finish_batch(task, pages, result, tracker.attempts, token)
+
+    async def _process_batch_async(self, task: BatchTask, pages: List[ScriptPage], func: BatchFunc,
+                                   token: CancellationToken) -> List[tuple]:
+        """_process_batch 的 asyncio 版本"""
+        if token.cancelled:
+            return [(page.index, False, token.reason) for page in pages]
+        with use_lane(LANE_BATCH), use_token(token), track_attempts() as tracker:
+            for page in pages:
+                self._claim_page(task, page, PageStatus.GENERATING_DESC, token, 'description')
+            try:
+                result = await func(pages)
+                token.raise_if_cancelled()
+            except asyncio.CancelledError:
+                for page in pages:
+                    self._abandon_page(task, page, token)
+                raise
+            except Exception as e:
+                if token.cancelled:
+                    return [self._abandon_page(task, page, token) for page in pages]
+                result = {}, {page.id: str(e) for page in pages}
+            return self._finish_batch(task, pages, result, tracker.attempts, token)
+
+    @staticmethod
+    def _page_result(future: Future) -> Optional[tuple]:
+        """页面作业的结果 (页面索引, 是否成功, 结果或错误信息)，作业被取消时返回 None"""
+        if future.cancelled():
+            return None
+        try:
+            return future.result()
+        except TaskCancelledError:
+            return None
 
     def create_task(self, name: str, pages: List[ScriptPage]) -> BatchTask:
         """创建新任务"""
@@ -93,26 +495,131 @@ class TaskManager:
         )
         with self._lock:
             self._tasks[task.id] = task
+        self._store.save_task(task.to_record(), [p.to_dict() for p in task.pages])
         logger.info(f"创建任务: {task.id}, 共 {len(pages)} 页")
         return task
 
     def get_task(self, task_id: str) -> Optional[BatchTask]:
-        """获取任务"""
-        return self._tasks.get(task_id)
+        """获取任务（不在内存中时从存储加载）"""
+        task = self._tasks.get(task_id)
+        if task is None:
+            loaded = self._store.load_task(task_id)
+            if loaded is None:
+                return None
+            with self._lock:
+                # 并发加载时以先放入的对象为准
+                task = self._tasks.setdefault(task_id, BatchTask.from_record(*loaded))
+        return task
 
     def get_all_tasks(self) -> List[BatchTask]:
         """获取所有任务"""
-        return list(self._tasks.values())
+        task_ids = [record['id'] for record in self._store.list_tasks()]
+        tasks = {task.id: task for task in list(self._tasks.values())}
+        for task_id in task_ids:
+            if task_id not in tasks:
+                task = self.get_task(task_id)
+                if task:
+                    tasks[task_id] = task
+        return list(tasks.values())
+
+    def list_tasks(self, statuses: Optional[List[str]] = None,
+                   created_after: Optional[datetime] = None,
+                   created_before: Optional[datetime] = None,
+                   cursor: Optional[str] = None,
+                   limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按创建时间倒序分页列出任务摘要（不加载页面）
+
+        Args:
+            statuses: 只返回这些状态的任务
+            created_after: 创建时间下限（不含）
+            created_before: 创建时间上限（不含）
+            cursor: 上一次返回的 next_cursor
+            limit: 每页条数
+
+        Returns:
+            (任务摘要列表, 下一页游标；没有更多时为 None)
+
+        Raises:
+            ValueError: 游标无效
+        """
+        position = self._decode_cursor(cursor) if cursor else None
+        after = created_after.isoformat() if created_after else None
+        before = created_before.isoformat() if created_before else None
+
+        if self._store.persistent:
+            records = self._store.query_tasks(statuses, after, before, position, limit + 1)
+        else:
+            records = sorted(
+                (task.to_record() for task in list(self._tasks.values())
+                 if (not statuses or task.status.value in statuses)),
+                key=lambda r: (r['created_at'], r['id']), reverse=True
+            )
+            records = [
+                r for r in records
+                if (after is None or r['created_at'] > after)
+                and (before is None or r['created_at'] < before)
+                and (position is None or (r['created_at'], r['id']) < position)
+            ][:limit + 1]
+
+        # 多取一条判断是否还有下一页
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = self._encode_cursor(records[-1])
+        return [BatchTask.summary_from_record(r) for r in records], next_cursor
+
+    def get_task_summaries(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量获取任务摘要，不存在的任务不出现在结果中"""
+        summaries = {}
+        missing = []
+        for task_id in task_ids:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                summaries[task_id] = task.to_summary()
+            else:
+                missing.append(task_id)
+        for task_id, record in self._store.get_task_records(missing).items():
+            summaries[task_id] = BatchTask.summary_from_record(record)
+        return summaries
+
+    @staticmethod
+    def _encode_cursor(record: Dict[str, Any]) -> str:
+        raw = json.dumps([record['created_at'], record['id']]).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[str, str]:
+        try:
+            created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return str(created_at), str(task_id)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"无效的游标: {cursor}") from e
+
+    def save_task(self, task: BatchTask):
+        """记录任务字段的变更（状态以外的字段由调用方直接修改后调用），并推送任务事件"""
+        with task.lock:
+            task.version += 1
+            task.updated_at = datetime.now()
+            record = task.to_record()
+            header = task.to_header()
+        self._store.save_task(record)
+        get_event_bus().publish(task.id, 'task', header)
 
     def update_task_status(self, task_id: str, status: TaskStatus,
                            phase: str = "", error: str = ""):
         """更新任务状态"""
         task = self.get_task(task_id)
         if task:
-            task.status = status
-            task.current_phase = phase
-            task.error_message = error
-            task.updated_at = datetime.now()
+            # 已取消的运行不再改写任务状态，取消后的状态不会被生成流程覆盖
+            if status != TaskStatus.CANCELLED and self._run_token(task_id).cancelled:
+                logger.info(f"任务 {task_id} 已取消，忽略状态更新: {status.value}")
+                return
+            with task.lock:
+                task.status = status
+                task.current_phase = phase
+                task.error_message = error
+            self.save_task(task)
             logger.info(f"任务 {task_id} 状态更新: {status.value}, {phase}")
 
     def update_page_status(self, task_id: str, page_index: int,
@@ -120,135 +627,343 @@ class TaskManager:
         """更新页面状态"""
         task = self.get_task(task_id)
         if task and 0 <= page_index < len(task.pages):
-            page = task.pages[page_index]
-            page.status = status
+            self._set_page_status(task, task.pages[page_index], status, **kwargs)
+
+    def begin_run(self, task_id: str) -> bool:
+        """标记任务开始生成，任务已在生成中时返回 False"""
+        with self._lock:
+            if task_id in self._running:
+                return False
+            self._running.add(task_id)
+            self._tokens[task_id] = CancellationToken()
+        get_event_bus().activate(task_id)
+        return True
+
+    def end_run(self, task_id: str):
+        """标记任务生成结束"""
+        with self._lock:
+            self._running.discard(task_id)
+            self._tokens.pop(task_id, None)
+        get_event_bus().release(task_id)
+
+    def _run_token(self, task_id: str) -> CancellationToken:
+        """任务本次运行的取消令牌；未经 begin_run 启动时返回一个不会被取消的令牌"""
+        with self._lock:
+            token = self._tokens.get(task_id)
+        return token if token is not None else CancellationToken()
+
+    def is_running(self, task_id: str) -> bool:
+        """任务是否正在本进程中生成"""
+        return task_id in self._running
+
+    def reset_pages(self, task_id: str, page_ids: Optional[Iterable[str]] = None) -> int:
+        """
+        清除页面的检查点，下次生成时重新生成这些页面
+
+        Args:
+            task_id: 任务 ID
+            page_ids: 要重新生成的页面 ID，None 表示全部页面
+
+        Returns:
+            被重置的页面数
+        """
+        task = self.get_task(task_id)
+        if not task:
+            return 0
+        if page_ids is None:
+            pages = task.pages
+        else:
+            pages = [p for p in (task.get_page(page_id) for page_id in page_ids) if p]
+        for page in pages:
+            self._set_page_status(task, page, PageStatus.PENDING,
+                                  completed_phase="", error_message="")
+        return len(pages)
+
+    def _set_page_status(self, task: BatchTask, page: ScriptPage,
+                         status: PageStatus, **kwargs):
+        """更新页面字段并写入存储"""
+        with task.lock:
+            task.set_page_status(page, status)
             for key, value in kwargs.items():
-                if hasattr(page, key):
+                if key == 'completed_phase':
+                    task.set_page_phase(page, value)
+                elif hasattr(page, key):
                     setattr(page, key, value)
+            task.version += 1
+            page.version = task.version
+            task.updated_at = datetime.now()
+            page_data = page.to_dict()
+            record = task.to_record()
+            event = {
+                # 页面事件附带任务进度，订阅者无需再等待任务事件
+                'page': page_data,
+                'completed_pages': task.completed_pages,
+                'progress': task.progress
+            }
+        self._store.save_page(task.id, page_data)
+        self._store.save_task(record)
+        get_event_bus().publish(task.id, 'page', event)
+
+    def update_page_partial(self, task_id: str, page: ScriptPage, description: str):
+        """
+        写入流式生成中的部分描述并推送页面事件
 
-            # 更新完成计数
-            if status == PageStatus.COMPLETED:
-                task.completed_pages = sum(
-                    1 for p in task.pages if p.status == PageStatus.COMPLETED
-                )
+        只更新内存（完成时整页写入存储）；页面已不在生成描述状态、不归调用方所在的运行所有或该运行已取消时忽略
+        """
+        task = self.get_task(task_id)
+        if not task:
+            return
+        token = current_token()
+        with task.lock:
+            claim = self._page_claims.get(page.id)
+            # 只接受仍归调用方所在运行所有的页面
+            if (claim is None or claim[0].cancelled or (token is not None and claim[0] is not token)
+                    or page.status != PageStatus.GENERATING_DESC):
+                return
+            page.description = description
+            task.version += 1
+            page.version = task.version
             task.updated_at = datetime.now()
+            event = {
+                'page': page.to_dict(),
+                'partial': True,
+                'completed_pages': task.completed_pages,
+                'progress': task.progress
+            }
+        get_event_bus().publish(task.id, 'page', event)
 
-    def run_descriptions_generation(self, task_id: str,
-                                     generate_func: Callable[[ScriptPage], str]):
+    def run_descriptions_generation(self, task_id: str, generate_func: PageFunc,
+                                    batch_func: Optional[BatchFunc] = None):
         """
         并发生成页面描述
 
         Args:
             task_id: 任务 ID
-            generate_func: 描述生成函数，接收 ScriptPage 返回描述文本
+            generate_func: 描述生成函数，接收 ScriptPage 返回描述文本；
+                           传入协程函数时使用 asyncio 引擎执行
+            batch_func: 可选，多页描述生成函数；提供时按 token 预算把相邻页面打包，
+                        每组一次请求（此时不使用 generate_func）
         """
         task = self.get_task(task_id)
-        if not task:
+        token = self._run_token(task_id)
+        if not task or token.cancelled:
             return
 
         self.update_task_status(task_id, TaskStatus.GENERATING_DESCRIPTIONS,
                                 "正在生成页面描述...")
 
-        def process_page(page: ScriptPage) -> tuple:
-            """处理单个页面"""
-            try:
-                page.status = PageStatus.GENERATING_DESC
-                description = generate_func(page)
-                page.description = description
-                page.status = PageStatus.PENDING  # 等待图片生成
-                return page.index, True, description
-            except Exception as e:
-                page.status = PageStatus.ERROR
-                page.error_message = str(e)
-                return page.index, False, str(e)
+        # 只处理尚未完成描述阶段的页面（断点续跑）
+        pages_to_process = task.pages_with_phase('')
+        completed = len(task.pages) - len(pages_to_process)
+        if completed:
+            logger.info(f"任务 {task_id} 跳过 {completed} 个已生成描述的页面")
 
         # 提交所有任务
-        futures = {
-            self._desc_executor.submit(process_page, page): page
-            for page in task.pages
-        }
+        if batch_func is not None:
+            batches = pack_description_batches(
+                pages_to_process, lambda page: f"{page.narration}\n{page.visual_hint or ''}"
+            )
+            logger.info(f"任务 {task_id} 多页生成描述：{len(pages_to_process)} 页打包为 {len(batches)} 次请求")
+            futures = [self._submit_batch(task, pages, batch_func) for pages in batches]
+        else:
+            futures = [self._submit_page('description', task, page, generate_func)
+                       for page in pages_to_process]
 
-        # 收集结果
-        completed = 0
+        # 收集结果（多页作业返回组内各页面的结果）
         for future in as_completed(futures):
-            idx, success, result = future.result()
-            completed += 1
+            outcome = self._page_result(future)
+            if outcome is None or token.cancelled:
+                continue
+            for idx, success, result in (outcome if batch_func is not None else [outcome]):
+                completed += 1
+                if success:
+                    logger.debug(f"页面 {idx} 描述生成成功")
+                else:
+                    logger.warning(f"页面 {idx} 描述生成失败: {result}")
             task.current_phase = f"生成描述中 ({completed}/{task.total_pages})"
-            if success:
-                logger.debug(f"页面 {idx} 描述生成成功")
-            else:
-                logger.warning(f"页面 {idx} 描述生成失败: {result}")
+            self.save_task(task)
 
-        task.updated_at = datetime.now()
+        if token.cancelled:
+            logger.info(f"任务 {task_id} 描述生成已取消")
+            return
+        self.save_task(task)
         logger.info(f"任务 {task_id} 描述生成完成")
 
-    def run_images_generation(self, task_id: str,
-                               generate_func: Callable[[ScriptPage], str]):
+    def run_images_generation(self, task_id: str, generate_func: PageFunc):
         """
         并发生成图片
 
         Args:
             task_id: 任务 ID
-            generate_func: 图片生成函数，接收 ScriptPage 返回图片路径
+            generate_func: 图片生成函数，接收 ScriptPage 返回图片路径；
+                           传入协程函数时使用 asyncio 引擎执行
         """
         task = self.get_task(task_id)
-        if not task:
+        token = self._run_token(task_id)
+        if not task or token.cancelled:
             return
 
         self.update_task_status(task_id, TaskStatus.GENERATING_IMAGES,
                                 "正在生成图片...")
 
-        def process_page(page: ScriptPage) -> tuple:
-            """处理单个页面"""
-            try:
-                page.status = PageStatus.GENERATING_IMAGE
-                image_path = generate_func(page)
-                page.image_path = image_path
-                page.status = PageStatus.COMPLETED
-                return page.index, True, image_path
-            except Exception as e:
-                page.status = PageStatus.ERROR
-                page.error_message = str(e)
-                return page.index, False, str(e)
-
-        # 只处理有描述的页面
-        pages_to_process = [p for p in task.pages if p.description]
+        # 只处理已有描述、尚未生成图片的页面（断点续跑）
+        pages_to_process = task.pages_with_phase('description')
 
         # 提交所有任务
-        futures = {
-            self._image_executor.submit(process_page, page): page
-            for page in pages_to_process
-        }
+        futures = {self._submit_page('image', task, page, generate_func): page
+                   for page in pages_to_process}
 
         # 收集结果
         completed = 0
         for future in as_completed(futures):
-            idx, success, result = future.result()
+            outcome = self._page_result(future)
+            if outcome is None or token.cancelled:
+                continue
+            idx, success, result = outcome
             completed += 1
-            task.completed_pages = completed
             task.current_phase = f"生成图片中 ({completed}/{len(pages_to_process)})"
+            self.save_task(task)
             if success:
                 logger.debug(f"页面 {idx} 图片生成成功: {result}")
             else:
                 logger.warning(f"页面 {idx} 图片生成失败: {result}")
 
-        task.updated_at = datetime.now()
+        if token.cancelled:
+            logger.info(f"任务 {task_id} 图片生成已取消")
+            return
         self.update_task_status(task_id, TaskStatus.COMPLETED, "任务完成")
         logger.info(f"任务 {task_id} 图片生成完成")
 
-    def cancel_task(self, task_id: str):
-        """取消任务"""
+    def run_pipelined_generation(self, task_id: str, description_func: PageFunc,
+                                 image_func: PageFunc):
+        """
+        流水线生成：每个页面的描述完成后立即进入图片阶段，不等待其他页面
+
+        两个阶段各自使用自己的执行器和并发限制；等待生成图片的页面超过
+        PIPELINE_IMAGE_QUEUE_SIZE 时暂停提交新的描述，避免描述阶段无限领先
+
+        Args:
+            task_id: 任务 ID
+            description_func: 描述生成函数，同 run_descriptions_generation
+            image_func: 图片生成函数，同 run_images_generation
+        """
         task = self.get_task(task_id)
-        if task and task.status not in [TaskStatus.COMPLETED, TaskStatus.CANCELLED]:
-            self.update_task_status(task_id, TaskStatus.CANCELLED, "任务已取消")
+        token = self._run_token(task_id)
+        if not task or token.cancelled:
+            return
+
+        self.update_task_status(task_id, TaskStatus.GENERATING_DESCRIPTIONS,
+                                "正在流水线生成描述和图片...")
+
+        # 断点续跑：已有描述的页面直接进入图片阶段
+        waiting = deque(task.pages_with_phase(''))
+        in_flight: Dict[Future, Tuple[str, ScriptPage]] = {}
+        image_backlog = 0  # 已提交、尚未完成的图片数
+        queue_size = max(1, Config.PIPELINE_IMAGE_QUEUE_SIZE)
+
+        def submit(stage: str, page: ScriptPage):
+            nonlocal image_backlog
+            func = description_func if stage == 'description' else image_func
+            in_flight[self._submit_page(stage, task, page, func)] = (stage, page)
+            if stage == 'image':
+                image_backlog += 1
+
+        for page in task.pages_with_phase('description'):
+            submit('image', page)
+
+        # 描述阶段的在途数不超过其执行器的并发数，剩余页面等图片积压回落后再提交
+        description_window = Config.ASYNC_MAX_DESCRIPTION_CONCURRENCY \
+            if asyncio.iscoroutinefunction(description_func) else concurrency_ceiling('text')
+        description_in_flight = 0
+
+        def fill_descriptions():
+            nonlocal description_in_flight
+            while waiting and description_in_flight < description_window and image_backlog < queue_size \
+                    and not token.cancelled:
+                submit('description', waiting.popleft())
+                description_in_flight += 1
+
+        fill_descriptions()
+        while in_flight:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, page = in_flight.pop(future)
+                if stage == 'description':
+                    description_in_flight -= 1
+                else:
+                    image_backlog -= 1
+                outcome = self._page_result(future)
+                if outcome is None or token.cancelled:
+                    continue
+                idx, success, result = outcome
+                if stage == 'description':
+                    if success:
+                        submit('image', page)
+                    else:
+                        logger.warning(f"页面 {idx} 描述生成失败: {result}")
+                elif not success:
+                    logger.warning(f"页面 {idx} 图片生成失败: {result}")
+
+            if token.cancelled:
+                continue
+            fill_descriptions()
+            if not waiting and description_in_flight == 0 and task.status == TaskStatus.GENERATING_DESCRIPTIONS:
+                task.status = TaskStatus.GENERATING_IMAGES
+            stages = task.stage_progress()
+            task.current_phase = f"描述 {stages['description']}/{task.total_pages}，" \
+                                 f"图片 {stages['image']}/{task.total_pages}"
+            self.save_task(task)
+
+        if token.cancelled:
+            logger.info(f"任务 {task_id} 流水线生成已取消")
+            return
+        self.update_task_status(task_id, TaskStatus.COMPLETED, "任务完成")
+        logger.info(f"任务 {task_id} 流水线生成完成")
+
+    def cancel_task(self, task_id: str) -> bool:
+        """
+        取消任务
+
+        排队中的页面从调度器撤回，在途的上游请求被中止（asyncio 引擎取消协程，线程池关闭请求所用的连接）；
+        进行中的页面回到待生成状态（已完成的阶段保留，重新启动时继续）。
+        任务状态置为 CANCELLED，之后不会被本次运行的生成流程覆盖
+
+        Returns:
+            是否执行了取消（任务不存在或已结束时返回 False）
+        """
+        task = self.get_task(task_id)
+        if not task or task.status in [TaskStatus.COMPLETED, TaskStatus.CANCELLED]:
+            return False
+
+        with self._lock:
+            token = self._tokens.get(task_id)
+        if token is not None:
+            token.cancel()
+        withdrawn = sum(scheduler.cancel_task(task_id) for scheduler in list(self._schedulers.values()))
+
+        for status, _, _ in _STAGES.values():
+            for page in task.pages_with_status(status):
+                # 接管进行中的页面：还原阶段开始前的结果字段（流式生成已写入的部分描述不保留），
+                # 之后返回的工作线程不再改写该页面
+                with task.lock:
+                    claim = self._page_claims.pop(page.id, None)
+                    restore = claim[1] if claim is not None else {}
+                    self._set_page_status(task, page, PageStatus.PENDING, **restore)
+        self.update_task_status(task_id, TaskStatus.CANCELLED, "任务已取消")
+        logger.info(f"任务 {task_id} 已取消，撤回或中止 {withdrawn} 个页面作业")
+        return True
 
     def delete_task(self, task_id: str) -> bool:
-        """删除任务"""
+        """删除任务（正在生成时先取消）"""
+        if self.is_running(task_id):
+            self.cancel_task(task_id)
+        exists = self.get_task(task_id) is not None
         with self._lock:
-            if task_id in self._tasks:
-                del self._tasks[task_id]
-                return True
-        return False
+            self._tasks.pop(task_id, None)
+        if exists:
+            self._store.delete_task(task_id)
+            get_event_bus().discard(task_id)
+        return exists
 
     def cleanup_old_tasks(self, max_age_hours: int = 24):
         """
@@ -261,21 +976,41 @@ class TaskManager:
         cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
         completed_statuses = {TaskStatus.COMPLETED, TaskStatus.CANCELLED, TaskStatus.ERROR}
 
+        # 按存储中的记录判断，未加载到内存的任务也会被清理
+        records = {record['id']: record for record in self._store.list_tasks()}
         with self._lock:
-            tasks_to_delete = [
-                task_id for task_id, task in self._tasks.items()
-                if task.status in completed_statuses and task.updated_at < cutoff_time
-            ]
-            for task_id in tasks_to_delete:
-                del self._tasks[task_id]
-                logger.info(f"清理过期任务: {task_id}")
+            for task in self._tasks.values():
+                records[task.id] = task.to_record()
+        tasks_to_delete = [
+            task_id for task_id, record in records.items()
+            if TaskStatus(record['status']) in completed_statuses
+            and datetime.fromisoformat(record['updated_at']) < cutoff_time
+        ]
+        for task_id in tasks_to_delete:
+            with self._lock:
+                self._tasks.pop(task_id, None)
+            self._store.delete_task(task_id)
+            get_event_bus().discard(task_id)
+            logger.info(f"清理过期任务: {task_id}")
 
         return len(tasks_to_delete)
 
     def shutdown(self):
-        """关闭执行器"""
+        """关闭执行器并写入未保存的任务变更"""
+        self._coordinator_executor.shutdown(wait=False)
         self._desc_executor.shutdown(wait=False)
         self._image_executor.shutdown(wait=False)
+        if self._async_engine is not None:
+            self._async_engine.shutdown()
+        self._store.close()
+
+    def scheduler_stats(self) -> Dict[str, Any]:
+        """各阶段公平调度器的状态"""
+        return {name: scheduler.to_dict() for name, scheduler in list(self._schedulers.items())}
+
+    def store_stats(self) -> Dict[str, Any]:
+        """任务存储状态"""
+        return self._store.to_dict()
 
 
 # 单例实例和锁
@@ -0,0 +1,323 @@
+"""
+任务持久化存储
+TaskManager 在内存中保存进行中的任务，任务和页面的变更写入存储，
+进程重启后按需从存储中加载，已生成的描述和图片路径不会丢失
+
+- TaskStore: 不做持久化（任务只保存在内存中）
+- SQLiteTaskStore: SQLite（WAL 模式），页面更新先合并在内存中，由后台线程批量写入
+"""
+import os
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import Config
+from utils.json_codec import dumps as json_dumps, loads as json_loads
+
+logger = logging.getLogger(__name__)
+
+# 任务记录（不含页面）和页面记录都是可 JSON 序列化的字典
+TaskRecord = Dict[str, Any]
+PageRecord = Dict[str, Any]
+
+
+class TaskStore:
+    """任务存储接口，默认实现不做持久化"""
+
+    # 为 False 时存储中没有任何任务，查询由 TaskManager 在内存中完成
+    persistent = False
+
+    def save_task(self, record: TaskRecord, pages: Optional[List[PageRecord]] = None):
+        """保存任务记录；传入 pages 时同时保存全部页面"""
+
+    def save_page(self, task_id: str, record: PageRecord):
+        """保存单个页面记录"""
+
+    def load_task(self, task_id: str) -> Optional[Tuple[TaskRecord, List[PageRecord]]]:
+        """加载任务记录及其页面，不存在时返回 None"""
+        return None
+
+    def list_tasks(self) -> List[TaskRecord]:
+        """列出所有已保存的任务记录（不含页面）"""
+        return []
+
+    def query_tasks(self, statuses: Optional[List[str]] = None,
+                    created_after: Optional[str] = None, created_before: Optional[str] = None,
+                    cursor: Optional[Tuple[str, str]] = None, limit: int = 50) -> List[TaskRecord]:
+        """
+        按创建时间倒序分页查询任务记录（不含页面）
+
+        Args:
+            statuses: 只返回这些状态的任务
+            created_after: 创建时间下限（ISO 格式，不含）
+            created_before: 创建时间上限（ISO 格式，不含）
+            cursor: 上一页最后一条记录的 (created_at, id)
+            limit: 最多返回条数
+        """
+        return []
+
+    def get_task_records(self, task_ids: List[str]) -> Dict[str, TaskRecord]:
+        """批量获取任务记录（不含页面）"""
+        return {}
+
+    def delete_task(self, task_id: str):
+        """删除任务及其页面"""
+
+    def flush(self):
+        """将尚未写入的变更写入存储"""
+
+    def close(self):
+        """写入剩余变更并释放资源"""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'backend': 'memory'}
+
+
+class SQLiteTaskStore(TaskStore):
+    """
+    基于 SQLite 的任务存储
+
+    任务创建和删除立即写入；任务状态和页面更新先按主键合并在内存中，
+    由后台线程每隔 flush_interval 秒（或积压超过 flush_batch 条时）在一个事务内批量写入，
+    生成过程中不会每页触发一次磁盘同步
+    """
+
+    persistent = True
+
+    def __init__(self, db_path: str, flush_interval: float = 0.5, flush_batch: int = 200):
+        """
+        Args:
+            db_path: 数据库文件路径
+            flush_interval: 后台批量写入间隔（秒）
+            flush_batch: 积压超过该条数时立即写入
+        """
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # 连接在读写线程间共享，由 _db_lock 串行化
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._init_schema()
+
+        # 待写入的变更，按主键合并，只保留最新值
+        self._pending_tasks: Dict[str, TaskRecord] = {}
+        self._pending_pages: Dict[Tuple[str, int], PageRecord] = {}
+        self._pending_lock = threading.Lock()
+        # 保证先取出的变更先写入
+        self._flush_lock = threading.Lock()
+        # 已删除的任务：删除后仍在返回的工作线程写入的变更直接丢弃，不会把任务重新写回
+        self._deleted: Set[str] = set()
+
+        self.flushes = 0
+        self.rows_written = 0
+
+        self._closed = False
+        self._wakeup = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="task_store_flush", daemon=True)
+        self._flusher.start()
+        logger.info(f"任务存储: SQLite {db_path}")
+
+    def _init_schema(self):
+        with self._db_lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 模式下 NORMAL 只在检查点时同步，断电最多丢失最近一次提交
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    task_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (task_id, idx)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at, id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, created_at, id)")
+
+    @staticmethod
+    def _task_row(record: TaskRecord) -> tuple:
+        return (record['id'], record['status'], record['created_at'], record['updated_at'],
+                json_dumps(record).decode('utf-8'))
+
+    @staticmethod
+    def _page_row(task_id: str, record: PageRecord) -> tuple:
+        return (task_id, record['index'], json_dumps(record).decode('utf-8'))
+
+    def _write(self, tasks: List[TaskRecord], pages: List[Tuple[str, PageRecord]]):
+        if not tasks and not pages:
+            return
+        with self._db_lock, self._conn:
+            if tasks:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tasks (id, status, created_at, updated_at, data) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [self._task_row(r) for r in tasks]
+                )
+            if pages:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO pages (task_id, idx, data) VALUES (?, ?, ?)",
+                    [self._page_row(task_id, r) for task_id, r in pages]
+                )
+        self.flushes += 1
+        self.rows_written += len(tasks) + len(pages)
+
+    def save_task(self, record: TaskRecord, pages: Optional[List[PageRecord]] = None):
+        if pages is not None:
+            # 新建任务立即落盘
+            with self._pending_lock:
+                self._pending_tasks.pop(record['id'], None)
+            self._write([record], [(record['id'], p) for p in pages])
+            return
+        with self._pending_lock:
+            if record['id'] in self._deleted:
+                return
+            self._pending_tasks[record['id']] = record
+            backlog = len(self._pending_tasks) + len(self._pending_pages)
+        if backlog >= self.flush_batch:
+            self._wakeup.set()
+
+    def save_page(self, task_id: str, record: PageRecord):
+        with self._pending_lock:
+            if task_id in self._deleted:
+                return
+            self._pending_pages[(task_id, record['index'])] = record
+            backlog = len(self._pending_tasks) + len(self._pending_pages)
+        if backlog >= self.flush_batch:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._pending_lock:
+                tasks = list(self._pending_tasks.values())
+                pages = [(task_id, record) for (task_id, _), record in self._pending_pages.items()]
+                self._pending_tasks.clear()
+                self._pending_pages.clear()
+            try:
+                self._write(tasks, pages)
+            except sqlite3.Error as e:
+                logger.error(f"任务存储写入失败: {e}")
+                # 放回待写入队列，下次重试（期间产生的更新优先）
+                with self._pending_lock:
+                    for record in tasks:
+                        self._pending_tasks.setdefault(record['id'], record)
+                    for task_id, record in pages:
+                        self._pending_pages.setdefault((task_id, record['index']), record)
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def load_task(self, task_id: str) -> Optional[Tuple[TaskRecord, List[PageRecord]]]:
+        # 先写入待写入的变更，保证读到最新状态
+        self.flush()
+        with self._db_lock:
+            row = self._conn.execute("SELECT data FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            page_rows = self._conn.execute(
+                "SELECT data FROM pages WHERE task_id = ? ORDER BY idx", (task_id,)
+            ).fetchall()
+        return json_loads(row[0]), [json_loads(r[0]) for r in page_rows]
+
+    def list_tasks(self) -> List[TaskRecord]:
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute("SELECT data FROM tasks ORDER BY created_at").fetchall()
+        return [json_loads(r[0]) for r in rows]
+
+    def query_tasks(self, statuses: Optional[List[str]] = None,
+                    created_after: Optional[str] = None, created_before: Optional[str] = None,
+                    cursor: Optional[Tuple[str, str]] = None, limit: int = 50) -> List[TaskRecord]:
+        self.flush()
+        conditions, params = [], []
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if created_after:
+            conditions.append("created_at > ?")
+            params.append(created_after)
+        if created_before:
+            conditions.append("created_at < ?")
+            params.append(created_before)
+        if cursor:
+            conditions.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        params.append(limit)
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM tasks {where} ORDER BY created_at DESC, id DESC LIMIT ?", params
+            ).fetchall()
+        return [json_loads(r[0]) for r in rows]
+
+    def get_task_records(self, task_ids: List[str]) -> Dict[str, TaskRecord]:
+        if not task_ids:
+            return {}
+        self.flush()
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT data FROM tasks WHERE id IN ({', '.join('?' * len(task_ids))})", task_ids
+            ).fetchall()
+        records = [json_loads(r[0]) for r in rows]
+        return {record['id']: record for record in records}
+
+    def delete_task(self, task_id: str):
+        # 持有 _flush_lock：等正在进行的 flush 写完（或把失败的变更放回队列）后再删除，
+        # 已从队列取出的变更不会在 DELETE 之后重新写入
+        with self._flush_lock:
+            with self._pending_lock:
+                self._deleted.add(task_id)
+                self._pending_tasks.pop(task_id, None)
+                for key in [k for k in self._pending_pages if k[0] == task_id]:
+                    del self._pending_pages[key]
+            with self._db_lock, self._conn:
+                self._conn.execute("DELETE FROM pages WHERE task_id = ?", (task_id,))
+                self._conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._pending_lock:
+            pending = len(self._pending_tasks) + len(self._pending_pages)
+        return {
+            'backend': 'sqlite',
+            'path': self.db_path,
+            'pending_writes': pending,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written
+        }
+
+
+def create_task_store() -> TaskStore:
+    """按配置创建任务存储"""
+    if Config.TASK_STORE == 'sqlite':
+        return SQLiteTaskStore(
+            Config.TASK_DB_PATH,
+            flush_interval=Config.TASK_STORE_FLUSH_INTERVAL,
+            flush_batch=Config.TASK_STORE_FLUSH_BATCH
+        )
+    return TaskStore()
@@ -0,0 +1,157 @@
+"""
+模板库
+模板图片上传一次得到模板 ID（图片内容的 SHA-256），之后每页请求只传 template_id；
+服务端保存规范化后的 base64，可直接内联到上游请求体，不再逐页解析和校验数 MB 的 data URL
+"""
+import base64
+import binascii
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from config import Config
+from .cache import CacheStats, IMAGE_EXTENSIONS, split_data_url
+from .blob_store import BlobStore, is_image_id
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TemplateImage:
+    """已登记的模板图片"""
+    template_id: str
+    mime_type: str
+    data: str  # 规范化后的 base64（无空白、标准填充）
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def inline_part(self) -> Dict[str, Any]:
+        """Gemini inline_data part，base64 字符串在各请求间共享，不复制"""
+        return {
+            "inline_data": {
+                "mime_type": self.mime_type,
+                "data": self.data
+            }
+        }
+
+
+class TemplateRegistry:
+    """
+    模板图片登记表
+
+    模板文件按内容寻址保存在独立目录（不会被生成的图片挤出），
+    内存中按字节数限制保留最近使用的模板，未命中时从磁盘读取
+    """
+
+    def __init__(self, folder: str, max_disk_bytes: int, max_memory_bytes: int,
+                 min_retention: float = 0):
+        self.store = BlobStore(folder, max_disk_bytes, min_retention)
+        self.max_memory_bytes = max_memory_bytes
+        self.stats = CacheStats()
+
+        self._memory: "OrderedDict[str, TemplateImage]" = OrderedDict()
+        self._memory_usage = 0
+        self._lock = threading.Lock()
+
+    def register(self, data: bytes, mime_type: str) -> Optional[TemplateImage]:
+        """登记模板图片字节，不支持的图片类型返回 None"""
+        mime_type = mime_type.lower()
+        if mime_type not in IMAGE_EXTENSIONS or not data:
+            return None
+        template_id = self.store.put(data, mime_type)
+        if template_id is None:
+            return None
+        template = TemplateImage(template_id, mime_type, base64.b64encode(data).decode('ascii'))
+        self._remember(template)
+        self.stats.incr('writes')
+        logger.info(f"[模板库] 登记模板 {template_id[:12]}，{len(data)} 字节")
+        return template
+
+    def register_data_url(self, data_url: str) -> Optional[TemplateImage]:
+        """解码 data URL 后登记，格式无效时返回 None"""
+        parts = split_data_url(data_url)
+        if parts is None:
+            return None
+        mime_type, data = parts
+        try:
+            image_bytes = base64.b64decode(''.join(data.split()), validate=True)
+        except (ValueError, binascii.Error):
+            return None
+        return self.register(image_bytes, mime_type)
+
+    def get(self, template_id: str) -> Optional[TemplateImage]:
+        """按模板 ID 读取模板，不存在时返回 None"""
+        if not is_image_id(template_id):
+            return None
+        with self._lock:
+            template = self._memory.get(template_id)
+            if template is not None:
+                self._memory.move_to_end(template_id)
+        if template is not None:
+            self.stats.incr('memory_hits')
+            return template
+
+        entry = self.store.read(template_id)
+        if entry is None:
+            self.stats.incr('misses')
+            return None
+        data, mime_type = entry
+        template = TemplateImage(template_id, mime_type, base64.b64encode(data).decode('ascii'))
+        self._remember(template)
+        self.stats.incr('disk_hits')
+        return template
+
+    def locate(self, template_id: str) -> Optional[Tuple[str, str]]:
+        """查找模板文件，返回 (文件路径, mime_type)"""
+        return self.store.locate(template_id)
+
+    def _remember(self, template: TemplateImage):
+        # 单个模板超过内存上限时不进入内存，每次从磁盘读取
+        if template.size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if template.template_id in self._memory:
+                self._memory.move_to_end(template.template_id)
+                return
+            self._memory[template.template_id] = template
+            self._memory_usage += template.size
+            while self._memory_usage > self.max_memory_bytes:
+                _, old = self._memory.popitem(last=False)
+                self._memory_usage -= old.size
+                self.stats.incr('evictions')
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = self.stats.to_dict()
+        with self._lock:
+            data.update({
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_usage,
+                'max_memory_bytes': self.max_memory_bytes
+            })
+        data['store'] = self.store.to_dict()
+        return data
+
+
+# 单例实例和锁
+_template_registry: Optional[TemplateRegistry] = None
+_template_registry_lock = threading.Lock()
+
+
+def get_template_registry() -> TemplateRegistry:
+    """获取模板库单例（线程安全）"""
+    global _template_registry
+    if _template_registry is None:
+        with _template_registry_lock:
+            # 双重检查锁定
+            if _template_registry is None:
+                _template_registry = TemplateRegistry(
+                    folder=Config.TEMPLATE_FOLDER,
+                    max_disk_bytes=Config.TEMPLATE_STORE_MAX_MB * 1024 * 1024,
+                    max_memory_bytes=Config.TEMPLATE_MEMORY_MB * 1024 * 1024,
+                    min_retention=Config.BLOB_STORE_MIN_RETENTION
+                )
+    return _template_registry
@@ -0,0 +1,7 @@
+"""
+测试公共配置：把 backend 目录加入 sys.path，与 app.py 的导入方式一致
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
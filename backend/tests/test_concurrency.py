@@ -0,0 +1,105 @@
+"""
+AIMD 自适应并发限制器
+"""
+import time
+
+import httpx
+import pytest
+
+from config import Config
+from services.concurrency import AdaptiveLimiter, parse_retry_after
+
+
+def _limiter(initial: int = 4, **kwargs) -> AdaptiveLimiter:
+    options = dict(min_limit=1, max_limit=8, latency_target=1.0)
+    options.update(kwargs)
+    return AdaptiveLimiter('test', initial, **options)
+
+
+def _fill(limiter: AdaptiveLimiter) -> int:
+    """占满全部名额，返回占用数"""
+    taken = 0
+    while limiter.try_acquire() == 0.0:
+        taken += 1
+    return taken
+
+
+def test_initial_limit_is_clamped():
+    assert _limiter(initial=100).limit == 8
+    assert _limiter(initial=0, min_limit=2).limit == 2
+
+
+def test_acquire_blocks_at_limit_until_release():
+    limiter = _limiter(initial=2)
+    assert _fill(limiter) == 2
+    assert limiter.acquire(timeout=0.1) is False
+    limiter.release()
+    assert limiter.acquire(timeout=0.1) is True
+
+
+def test_success_increases_limit_only_when_saturated():
+    limiter = _limiter(initial=2)
+    limiter.on_success(0.1)
+    assert limiter.limit == 2
+
+    _fill(limiter)
+    for _ in range(4):
+        limiter.on_success(0.1)
+    assert limiter.limit == 3
+
+
+def test_slow_responses_do_not_increase_limit():
+    limiter = _limiter(initial=2)
+    _fill(limiter)
+    for _ in range(10):
+        limiter.on_success(5.0)
+    assert limiter.limit == 2
+
+
+def test_throttle_halves_limit_once_per_cooldown(monkeypatch):
+    monkeypatch.setattr(Config, 'ADAPTIVE_DECREASE_COOLDOWN', 60)
+    limiter = _limiter(initial=8)
+    limiter.on_throttle(None)
+    limiter.on_throttle(None)
+    assert limiter.limit == 4
+    assert limiter.throttled == 2
+
+    monkeypatch.setattr(Config, 'ADAPTIVE_DECREASE_COOLDOWN', 0)
+    for _ in range(5):
+        limiter.on_throttle(None)
+    assert limiter.limit == 1
+
+
+def test_retry_after_blocks_new_requests():
+    limiter = _limiter()
+    limiter.on_throttle(30)
+    assert limiter.try_acquire() > 25
+    assert limiter.to_dict()['blocked_for'] > 25
+
+
+def test_slot_reports_throttle_and_timeout(monkeypatch):
+    monkeypatch.setattr(Config, 'ADAPTIVE_DECREASE_COOLDOWN', 0)
+    limiter = _limiter(initial=8)
+    with limiter.slot() as permit:
+        permit.observe(429)
+    assert limiter.limit == 4
+
+    with pytest.raises(httpx.ReadTimeout):
+        with limiter.slot():
+            raise httpx.ReadTimeout('timeout')
+    assert limiter.limit == 2
+
+    with pytest.raises(RuntimeError):
+        with limiter.slot():
+            raise RuntimeError('boom')
+    assert limiter.limit == 2
+    assert limiter.errors == 1
+    assert limiter.to_dict()['in_flight'] == 0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    http_date = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 60))
+    assert 50 < parse_retry_after(http_date) <= 60
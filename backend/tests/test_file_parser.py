@@ -0,0 +1,123 @@
+"""
+脚本切块与分块结果合并
+"""
+import zipfile
+
+import openpyxl
+import pytest
+
+from config import Config
+from services.file_parser import (
+    iter_chunks, iter_docx_lines, iter_excel_lines, merge_chunk_pages, split_into_chunks
+)
+
+_W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def _write_docx(path, body: str):
+    """写入只含 word/document.xml 的最小 Word 文件"""
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('word/document.xml', f'<w:document xmlns:w="{_W_NS}"><w:body>{body}</w:body></w:document>')
+    return str(path)
+
+
+def _p(text: str) -> str:
+    return f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>'
+
+
+def _pages(*narrations):
+    return [{'narration': text} for text in narrations]
+
+
+def test_iter_chunks_respects_max_chars():
+    lines = [f"第{i}段讲稿内容" * 3 for i in range(20)]
+    chunks = list(iter_chunks(lines, max_chars=100, overlap_lines=0))
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert '\n'.join(chunks).splitlines() == lines
+
+
+def test_iter_chunks_splits_before_boundary_without_overlap():
+    lines = ['第1镜 开场', '讲稿一' * 10, '讲稿二' * 10, '第2镜 正文', '讲稿三' * 10]
+    chunks = split_into_chunks('\n'.join(lines), max_chars=90)
+    assert chunks == ['\n'.join(lines[:3]), '\n'.join(lines[3:])]
+
+
+def test_iter_chunks_overlaps_when_no_boundary():
+    lines = [f"普通讲稿行{i}" * 4 for i in range(10)]
+    chunks = list(iter_chunks(lines, max_chars=120, overlap_lines=2))
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.splitlines()[:2] == previous.splitlines()[-2:]
+
+
+def test_iter_chunks_repeats_table_header():
+    header = '镜号 | 讲稿'
+    lines = [header] + [f"{i} | 第{i}行讲稿内容" for i in range(30)]
+    chunks = list(iter_chunks(lines, max_chars=80, overlap_lines=0))
+    assert len(chunks) > 1
+    assert all(chunk.splitlines()[0] == header for chunk in chunks)
+
+
+def test_iter_chunks_skips_blank_input():
+    assert list(iter_chunks(['', '   '], max_chars=100)) == []
+
+
+def test_merge_drops_overlap_duplicates():
+    merged = merge_chunk_pages([_pages('一', '二', '三'), _pages('三', '四')])
+    assert [p['narration'] for p in merged] == ['一', '二', '三', '四']
+
+
+def test_merge_replaces_truncated_last_page():
+    merged = merge_chunk_pages([_pages('开场', '今天我们'), _pages('今天我们学习加法', '结束')])
+    assert [p['narration'] for p in merged] == ['开场', '今天我们学习加法', '结束']
+
+
+def test_merge_keeps_short_pages_that_are_not_truncated():
+    merged = merge_chunk_pages([_pages('好', '开始'), _pages('好的，我们开始', '开始')])
+    assert [p['narration'] for p in merged] == ['好', '开始', '好的，我们开始']
+
+
+def test_merge_respects_shot_numbers():
+    first = [{'shot_number': '1', 'narration': '谢谢'}]
+    second = [{'shot_number': '2', 'narration': '谢谢'}]
+    assert len(merge_chunk_pages([first, second])) == 2
+
+
+def test_iter_docx_lines_keeps_document_order(tmp_path):
+    table = ('<w:tbl>'
+             f'<w:tr><w:tc>{_p("镜号")}</w:tc><w:tc>{_p("讲稿")}</w:tc></w:tr>'
+             f'<w:tr><w:tc>{_p("1")}</w:tc><w:tc>{_p("同学们")}{_p("好")}</w:tc></w:tr>'
+             '</w:tbl>')
+    tab_run = '<w:p><w:r><w:t>左</w:t><w:tab/><w:t>右</w:t></w:r></w:p>'
+    path = _write_docx(tmp_path / 'script.docx', _p('标题') + _p('  ') + table + tab_run)
+    assert list(iter_docx_lines(path)) == ['标题', '镜号 | 讲稿', '1 | 同学们 好', '左\t右']
+
+
+def test_iter_docx_lines_rejects_invalid_files(tmp_path, monkeypatch):
+    not_zip = tmp_path / 'broken.docx'
+    not_zip.write_bytes(b'not a zip file')
+    with pytest.raises(ValueError):
+        list(iter_docx_lines(str(not_zip)))
+
+    missing = tmp_path / 'missing.docx'
+    with zipfile.ZipFile(missing, 'w') as archive:
+        archive.writestr('word/other.xml', '<x/>')
+    with pytest.raises(ValueError):
+        list(iter_docx_lines(str(missing)))
+
+    monkeypatch.setattr(Config, 'DOCX_MAX_XML_BYTES', 64)
+    large = _write_docx(tmp_path / 'large.docx', _p('很长的内容' * 20))
+    with pytest.raises(ValueError):
+        list(iter_docx_lines(large))
+
+
+def test_iter_excel_lines_skips_empty_rows(tmp_path):
+    path = tmp_path / 'script.xlsx'
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['镜号', '讲稿'])
+    ws.append([None, None])
+    ws.append([1, '同学们好'])
+    wb.save(path)
+    assert list(iter_excel_lines(str(path))) == ['镜号 | 讲稿', '1 | 同学们好']
@@ -0,0 +1,109 @@
+"""
+上游调用重试策略
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from services import retry as retry_module
+from services.retry import RetryPolicy, is_retryable, track_attempts
+
+_REQUEST = httpx.Request('POST', 'https://api.example.com/v1/chat/completions')
+
+
+def _status_error(status_code: int, headers=None) -> httpx.HTTPStatusError:
+    response = httpx.Response(status_code, headers=headers, request=_REQUEST)
+    return httpx.HTTPStatusError(f"HTTP {status_code}", request=_REQUEST, response=response)
+
+
+def _flaky(errors, result='ok'):
+    """依次抛出 errors 中的异常，之后返回 result"""
+    errors = list(errors)
+    calls = []
+
+    def func():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    func.calls = calls
+    return func
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录退避等待时间，不真正等待"""
+    recorded = []
+    monkeypatch.setattr(retry_module.time, 'sleep', recorded.append)
+    return recorded
+
+
+def test_is_retryable():
+    assert is_retryable(_status_error(429))
+    assert is_retryable(_status_error(503))
+    assert is_retryable(httpx.ReadTimeout('timeout', request=_REQUEST))
+    assert is_retryable(httpx.ConnectError('reset', request=_REQUEST))
+    assert not is_retryable(_status_error(400))
+    assert not is_retryable(_status_error(401))
+    assert not is_retryable(httpx.UnsupportedProtocol('ftp', request=_REQUEST))
+    assert not is_retryable(ValueError('bad json'))
+
+
+def test_backoff_is_capped_and_respects_retry_after():
+    policy = RetryPolicy('test', max_attempts=5, base_delay=1.0, max_delay=4.0, budget=60)
+    for retry_number in range(1, 6):
+        assert 0 <= policy.backoff(retry_number) <= min(4.0, 2 ** (retry_number - 1))
+    assert policy.backoff(1, retry_after=10) == 10
+
+
+def test_call_retries_transient_errors(sleeps):
+    policy = RetryPolicy('test', max_attempts=3, base_delay=0.01, max_delay=0.01, budget=60)
+    func = _flaky([_status_error(502), httpx.ReadTimeout('timeout', request=_REQUEST)])
+    with track_attempts() as tracker:
+        assert policy.call(func) == 'ok'
+    assert len(func.calls) == 3
+    assert len(sleeps) == 2
+    assert (tracker.attempts, tracker.retries) == (3, 2)
+
+
+def test_call_does_not_retry_permanent_errors(sleeps):
+    policy = RetryPolicy('test', max_attempts=3, base_delay=0.01, max_delay=0.01, budget=60)
+    func = _flaky([_status_error(400)])
+    with pytest.raises(httpx.HTTPStatusError):
+        policy.call(func)
+    assert len(func.calls) == 1
+    assert sleeps == []
+
+
+def test_call_stops_after_max_attempts(sleeps):
+    policy = RetryPolicy('test', max_attempts=2, base_delay=0.01, max_delay=0.01, budget=60)
+    func = _flaky([_status_error(500)] * 5)
+    with pytest.raises(httpx.HTTPStatusError):
+        policy.call(func)
+    assert len(func.calls) == 2
+
+
+def test_call_stops_when_budget_exceeded(sleeps):
+    policy = RetryPolicy('test', max_attempts=5, base_delay=0.01, max_delay=0.01, budget=5)
+    func = _flaky([_status_error(429, headers={'Retry-After': '30'})])
+    with pytest.raises(httpx.HTTPStatusError):
+        policy.call(func)
+    assert len(func.calls) == 1
+    assert sleeps == []
+
+
+def test_acall_retries_transient_errors(monkeypatch):
+    async def no_sleep(delay):
+        pass
+
+    monkeypatch.setattr(retry_module.asyncio, 'sleep', no_sleep)
+    policy = RetryPolicy('test', max_attempts=3, base_delay=0.01, max_delay=0.01, budget=60)
+    func = _flaky([_status_error(503)])
+
+    async def coro_func():
+        return func()
+
+    assert asyncio.run(policy.acall(coro_func)) == 'ok'
+    assert len(func.calls) == 2
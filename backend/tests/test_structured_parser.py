@@ -0,0 +1,69 @@
+"""
+结构化脚本快速解析
+"""
+import json
+
+import openpyxl
+
+from services.structured_parser import map_columns, parse_structured
+
+
+def test_map_columns_requires_narration_and_another_field():
+    assert map_columns(['镜号', '环节', '画面描述', '讲稿']) == {
+        'shot_number': 0, 'segment': 1, 'visual_hint': 2, 'narration': 3
+    }
+    assert map_columns(['讲稿']) is None
+    assert map_columns(['标题', '作者']) is None
+
+
+def test_parse_excel_with_metadata_rows(tmp_path):
+    path = tmp_path / 'script.xlsx'
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['三年级数学微课'])
+    ws.append(['镜号', '环节', '画面', '讲稿'])
+    ws.append([1.0, '导入', '教室全景', '同学们好'])
+    ws.append([2.0, None, '黑板', '今天学习加法'])
+    ws.append([3.0, '总结', None, '/'])
+    wb.save(path)
+
+    pages = parse_structured(str(path), '.xlsx')
+    assert pages == [
+        {'shot_number': '1', 'segment': '导入', 'narration': '同学们好', 'visual_hint': '教室全景'},
+        {'shot_number': '2', 'segment': '导入', 'narration': '今天学习加法', 'visual_hint': '黑板'},
+    ]
+
+
+def test_parse_json_objects(tmp_path):
+    path = tmp_path / 'script.json'
+    data = {'pages': [{'shot': 1, 'narration': '开场白', 'visual': '片头'},
+                      {'shot': 2, 'narration': '正文'}]}
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+
+    pages = parse_structured(str(path), '.json')
+    assert [p['narration'] for p in pages] == ['开场白', '正文']
+    assert pages[0]['visual_hint'] == '片头'
+    assert pages[1]['shot_number'] == '2'
+
+
+def test_parse_shot_markers():
+    text = '\n'.join([
+        '# 微课脚本',
+        '第1镜 导入',
+        '画面：教室全景',
+        '同学们好。',
+        '第2镜',
+        '讲稿：今天学习加法。',
+        '画面：黑板',
+    ])
+    pages = parse_structured('script.md', '.md', text)
+    assert pages == [
+        {'shot_number': '1', 'segment': '导入', 'narration': '同学们好。', 'visual_hint': '教室全景'},
+        {'shot_number': '2', 'segment': '微课脚本', 'narration': '今天学习加法。', 'visual_hint': '黑板'},
+    ]
+
+
+def test_unstructured_text_falls_back():
+    assert parse_structured('script.txt', '.txt', '这是一段没有镜头标记的普通讲稿。\n第二段。') is None
+    assert parse_structured('script.json', '.json', '{not json') is None
+    assert parse_structured('script.docx', '.docx', '') is None
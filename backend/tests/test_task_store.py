@@ -0,0 +1,130 @@
+"""
+SQLite 任务存储的批量写入与删除
+"""
+import sqlite3
+import threading
+
+import pytest
+
+from services.task_store import SQLiteTaskStore
+
+
+def _task(task_id: str, status: str = 'pending', created_at: str = '2024-01-01T00:00:00') -> dict:
+    return {'id': task_id, 'status': status, 'created_at': created_at, 'updated_at': created_at}
+
+
+@pytest.fixture
+def store(tmp_path):
+    # 间隔足够长，由测试显式触发 flush
+    store = SQLiteTaskStore(str(tmp_path / 'data' / 'tasks.db'), flush_interval=60)
+    yield store
+    store.close()
+
+
+def _row_count(store: SQLiteTaskStore, table: str) -> int:
+    with store._db_lock:
+        return store._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_new_task_is_written_immediately(store):
+    store.save_task(_task('t1'), [{'index': 0, 'narration': '开场'}])
+    assert _row_count(store, 'tasks') == 1
+    assert _row_count(store, 'pages') == 1
+
+
+def test_updates_are_merged_until_flush(store):
+    store.save_task(_task('t1'), [{'index': 0, 'status': 'pending'}])
+    for status in ('generating', 'completed'):
+        store.save_page('t1', {'index': 0, 'status': status})
+    store.save_task(_task('t1', status='completed'))
+    assert store.to_dict()['pending_writes'] == 2
+
+    written = store.rows_written
+    store.flush()
+    assert store.rows_written - written == 2
+    assert store.to_dict()['pending_writes'] == 0
+
+    record, pages = store.load_task('t1')
+    assert record['status'] == 'completed'
+    assert pages == [{'index': 0, 'status': 'completed'}]
+
+
+def test_reads_include_pending_updates(store):
+    store.save_task(_task('t1'), [])
+    store.save_task(_task('t1', status='completed'))
+    assert store.load_task('t1')[0]['status'] == 'completed'
+    assert [r['status'] for r in store.query_tasks(statuses=['completed'])] == ['completed']
+
+
+def test_delete_drops_pending_and_late_updates(store):
+    store.save_task(_task('t1'), [{'index': 0, 'status': 'pending'}])
+    store.save_page('t1', {'index': 0, 'status': 'generating'})
+    store.delete_task('t1')
+
+    # 删除后仍在返回的工作线程写入的变更不会把任务写回
+    store.save_page('t1', {'index': 0, 'status': 'completed'})
+    store.save_task(_task('t1', status='completed'))
+    store.flush()
+    assert store.load_task('t1') is None
+    assert _row_count(store, 'pages') == 0
+
+
+def test_delete_waits_for_running_flush(store, monkeypatch):
+    store.save_task(_task('t1'), [])
+    store.save_task(_task('t1', status='generating'))
+
+    writing, release = threading.Event(), threading.Event()
+    original_write = store._write
+
+    def slow_write(tasks, pages):
+        if tasks:
+            writing.set()
+            release.wait(5)
+        original_write(tasks, pages)
+
+    monkeypatch.setattr(store, '_write', slow_write)
+    flusher = threading.Thread(target=store.flush)
+    flusher.start()
+    assert writing.wait(5)
+
+    deleter = threading.Thread(target=store.delete_task, args=('t1',))
+    deleter.start()
+    deleter.join(0.2)
+    # flush 取出的变更写完之前删除不会执行
+    assert deleter.is_alive()
+
+    release.set()
+    flusher.join(5)
+    deleter.join(5)
+    assert store.load_task('t1') is None
+
+
+def test_failed_flush_requeues_changes(store, monkeypatch):
+    store.save_task(_task('t1'), [])
+    store.save_task(_task('t1', status='completed'))
+
+    original_write = store._write
+
+    def failing_write(tasks, pages):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(store, '_write', failing_write)
+    store.flush()
+    assert store.to_dict()['pending_writes'] == 1
+
+    monkeypatch.setattr(store, '_write', original_write)
+    assert store.load_task('t1')[0]['status'] == 'completed'
+
+
+def test_close_writes_remaining_changes(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    store = SQLiteTaskStore(path, flush_interval=60)
+    store.save_task(_task('t1'), [])
+    store.save_task(_task('t1', status='completed'))
+    store.close()
+
+    reopened = SQLiteTaskStore(path, flush_interval=60)
+    try:
+        assert reopened.load_task('t1')[0]['status'] == 'completed'
+    finally:
+        reopened.close()
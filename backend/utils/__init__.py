@@ -1,6 +1,7 @@
 """
 工具模块
 """
-from .response import success_response, error_response, created_response
+from .response import success_response, error_response, created_response, json_response
+from .json_codec import get_json_body
 
-__all__ = ['success_response', 'error_response', 'created_response']
+__all__ = ['success_response', 'error_response', 'created_response', 'json_response', 'get_json_body']
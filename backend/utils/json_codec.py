@@ -0,0 +1,68 @@
+"""
+JSON 编解码
+安装了 orjson 时使用 orjson（对含大段 base64 的请求/响应体快数倍），否则回退到标准库 json；
+响应输出、请求体解析和上游请求/响应统一经过这里
+"""
+import json
+import uuid
+from datetime import date, datetime
+from typing import Any, Optional, Union
+
+from flask import request
+from werkzeug.exceptions import BadRequest
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+# 当前使用的实现：'orjson' 或 'json'
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def _default(obj: Any) -> Any:
+    """标准库 json 不支持的类型（orjson 原生支持）"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """
+    编码为 UTF-8 JSON 字节串（紧凑格式，不转义非 ASCII 字符）
+
+    sort_keys 为 True 时按键排序，相同内容总是得到相同的字节（计算缓存键时使用）
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys,
+                      default=_default).encode('utf-8')
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    """解码 JSON，格式错误时抛出 ValueError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def get_json_body(silent: bool = False) -> Optional[Any]:
+    """
+    解析当前请求的 JSON 请求体，替代 request.get_json()
+
+    请求体为空或不是 JSON 类型时返回 None；格式错误时 silent 为 True 返回 None，否则返回 400
+    """
+    if not request.is_json:
+        return None
+    data = request.get_data(cache=True)
+    if not data:
+        return None
+    try:
+        return loads(data)
+    except ValueError:
+        if silent:
+            return None
+        raise BadRequest("请求体不是有效的 JSON")
@@ -1,13 +1,20 @@
 """
 统一响应格式工具
 """
-from flask import jsonify
+from flask import Response
 from typing import Any, Optional
 
+from .json_codec import dumps
+
+
+def json_response(body: Any, status: int = 200) -> Response:
+    """将 body 编码为 JSON 响应"""
+    return Response(dumps(body), status=status, mimetype='application/json')
+
 
 def success_response(data: Any = None, message: str = "success") -> tuple:
     """成功响应"""
-    return jsonify({
+    return json_response({
         'success': True,
         'message': message,
         'data': data
@@ -22,12 +29,12 @@ def error_response(message: str, code: int = 400, details: Optional[Any] = None)
     }
     if details:
         response['details'] = details
-    return jsonify(response), code
+    return json_response(response), code
 
 
 def created_response(data: Any = None, message: str = "created") -> tuple:
     """创建成功响应"""
-    return jsonify({
+    return json_response({
         'success': True,
         'message': message,
         'data': data
@@ -3,7 +3,7 @@
 import { useState, useEffect, useRef } from 'react';
 import JSZip from 'jszip';
 import { ScriptPage } from './types';
-import { loadTemplates, TemplateItem } from '@/config/templates';
+import { loadTemplates, TemplateItem, registerTemplate, postWithTemplate } from '@/config/templates';
 import { loadPromptConfig } from '@/config/prompts';
 import { defaultApiConfig } from '@/config/gemini';
 import { CourseMetadata, ApiConfig } from '@/types';
@@ -47,6 +47,20 @@ function getApiConfig(): ApiConfig {
   return defaultApiConfig;
 }
 
+// 图片地址转为 base64 data URL（图片存储中的图片按 URL 引用，导出 PPT 时才读取内容）
+async function toDataUrl(src: string): Promise<string> {
+  if (src.startsWith('data:')) return src;
+  const response = await fetch(src);
+  if (!response.ok) throw new Error(`读取图片失败: HTTP ${response.status}`);
+  const blob = await response.blob();
+  return new Promise((resolve, reject) => {
+    const reader = new FileReader();
+    reader.onload = () => resolve(reader.result as string);
+    reader.onerror = () => reject(reader.error);
+    reader.readAsDataURL(blob);
+  });
+}
+
 export default function ImageGenerator({
   pages,
   onUpdatePage,
@@ -121,6 +135,8 @@ export default function ImageGenerator({
         const base64 = e.target?.result as string;
         setSelectedTemplate(template.id);
         setTemplateBase64(base64);
+        // 选中时登记到后端模板库，之后每页请求只传模板 ID
+        registerTemplate(API_BASE, base64);
       };
       reader.readAsDataURL(blob);
     } catch (err) {
@@ -163,7 +179,8 @@ export default function ImageGenerator({
   const generateSingleImage = async (
     pageType: 'cover' | 'content' | 'ending',
     contentIndex?: number,
-    extraPage?: ExtraPage
+    extraPage?: ExtraPage,
+    bypassCache: boolean = false
   ): Promise<boolean> => {
     // 检查是否应该停止
     if (shouldStopRef.current) return false;
@@ -196,26 +213,25 @@ export default function ImageGenerator({
     }
 
     try {
-      const response = await fetch(`${API_BASE}/api/batch/generate-image`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          narration,
-          description,
-          page_type: pageType,
-          aspect_ratio: '16:9',
-          template_base64: templateBase64,
-          custom_prompt: customPrompt, // 使用前端提示词
-        }),
-      });
+      const response = await postWithTemplate(API_BASE, '/api/batch/generate-image', {
+        narration,
+        description,
+        page_type: pageType,
+        aspect_ratio: '16:9',
+        custom_prompt: customPrompt, // 使用前端提示词
+        bypass_cache: bypassCache, // 重新生成时跳过后端图片缓存
+        response_format: 'url', // 返回图片 URL，不在 JSON 中传输 base64
+      }, templateBase64);
 
       // 请求完成后再次检查是否应该停止（不保存结果）
       if (shouldStopRef.current) return false;
 
       const result = await response.json();
 
-      if (result.success && result.data?.image_base64) {
-        const newImage = result.data.image_base64;
+      if (result.success && (result.data?.image_url || result.data?.image_base64)) {
+        const newImage: string = result.data.image_url
+          ? `${API_BASE}${result.data.image_url}`
+          : result.data.image_base64;
         if (pageType === 'cover') {
           setCoverPage(prev => {
             const versions = [...(prev.image_versions || []), newImage];
@@ -305,18 +321,14 @@ export default function ImageGenerator({
     }
 
     try {
-      const response = await fetch(`${API_BASE}/api/batch/generate-description`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          narration: page.narration || courseInfo,
-          visual_hint: page.visual_hint,
-          full_context: pages.map((p, i) => `【第${i + 1}页】${p.segment ? `[${p.segment}] ` : ''}${p.narration}`).join('\n\n'),
-          current_index: contentIndex + 1,
-          custom_prompt: customPrompt,
-          template_base64: templateBase64, // 使用当前选中的模板
-        }),
-      });
+      const response = await postWithTemplate(API_BASE, '/api/batch/generate-description', {
+        narration: page.narration || courseInfo,
+        visual_hint: page.visual_hint,
+        full_context: pages.map((p, i) => `【第${i + 1}页】${p.segment ? `[${p.segment}] ` : ''}${p.narration}`).join('\n\n'),
+        current_index: contentIndex + 1,
+        custom_prompt: customPrompt,
+        bypass_cache: true, // 重新生成时跳过后端描述缓存
+      }, templateBase64); // 使用当前选中的模板
 
       const result = await response.json();
 
@@ -472,13 +484,13 @@ export default function ImageGenerator({
 
     if (selectedPage.type === 'cover') {
       setCoverPage(prev => ({ ...prev, status: 'generating' }));
-      await generateSingleImage('cover', undefined, coverPage);
+      await generateSingleImage('cover', undefined, coverPage, true);
     } else if (selectedPage.type === 'ending') {
       setEndingPage(prev => ({ ...prev, status: 'generating' }));
-      await generateSingleImage('ending', undefined, endingPage);
+      await generateSingleImage('ending', undefined, endingPage, true);
     } else if (selectedPage.type === 'content' && 'index' in selectedPage) {
       onUpdatePage(selectedPage.index, { status: 'generating_image' });
-      await generateSingleImage('content', selectedPage.index);
+      await generateSingleImage('content', selectedPage.index, undefined, true);
     }
 
     setIsGenerating(false);
@@ -502,7 +514,7 @@ export default function ImageGenerator({
           imageBase64 = (page.data as ScriptPage).image_base64;
         }
         if (imageBase64) {
-          imagesToExport.push(imageBase64);
+          imagesToExport.push(await toDataUrl(imageBase64));
         }
       }
 
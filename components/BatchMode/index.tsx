@@ -9,6 +9,7 @@ import { ScriptPage, BatchStep, ParsedExcelResult } from './types';
 import { loadPromptConfig } from '@/config/prompts';
 import { defaultApiConfig } from '@/config/gemini';
 import TemplateUpload from '@/components/TemplateUpload';
+import { registerTemplate, postWithTemplate } from '@/config/templates';
 import { CourseMetadata, ApiConfig } from '@/types';
 
 const API_BASE = process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localhost:5002';
@@ -245,6 +246,11 @@ export default function BatchMode({ onBack }: BatchModeProps) {
     }
   }, []);
 
+  // 选择模板后登记到后端模板库，之后每页请求只传模板 ID
+  useEffect(() => {
+    if (templateImage) registerTemplate(API_BASE, templateImage);
+  }, [templateImage]);
+
   // 文件上传处理（只保存文件，不解析）
   const handleFileUpload = (file: File) => {
     setUploadedFile(file);
@@ -356,18 +362,14 @@ export default function BatchMode({ onBack }: BatchModeProps) {
         narrationToSend = formatCourseInfo();
       }
 
-      const response = await fetch(`${API_BASE}/api/batch/generate-description`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          narration: narrationToSend,
-          visual_hint: page.visual_hint,
-          full_context: fullContext,
-          current_index: index + 1,
-          custom_prompt: customPrompt,
-          template_base64: templateImage,
-        }),
-      });
+      const response = await postWithTemplate(API_BASE, '/api/batch/generate-description', {
+        narration: narrationToSend,
+        visual_hint: page.visual_hint,
+        full_context: fullContext,
+        current_index: index + 1,
+        custom_prompt: customPrompt,
+        bypass_cache: true, // 重新生成时跳过后端描述缓存
+      }, templateImage);
 
       const result = await response.json();
 
@@ -419,18 +421,13 @@ export default function BatchMode({ onBack }: BatchModeProps) {
           narrationToSend = formatCourseInfo();
         }
 
-        const response = await fetch(`${API_BASE}/api/batch/generate-description`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            narration: narrationToSend,
-            visual_hint: page.visual_hint,
-            full_context: fullContext,
-            current_index: index + 1,
-            custom_prompt: customPrompt,
-            template_base64: templateImage,
-          }),
-        });
+        const response = await postWithTemplate(API_BASE, '/api/batch/generate-description', {
+          narration: narrationToSend,
+          visual_hint: page.visual_hint,
+          full_context: fullContext,
+          current_index: index + 1,
+          custom_prompt: customPrompt,
+        }, templateImage);
 
         const result = await response.json();
 
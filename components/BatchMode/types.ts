@@ -10,7 +10,7 @@ export interface ScriptPage {
   visual_hint: string;
   description: string;
   image_path: string;
-  image_base64?: string;  // 当前选中的图片 base64
+  image_base64?: string;  // 当前选中的图片（图片 URL 或 base64 data URL）
   image_versions?: string[];  // 所有版本的图片
   selected_version?: number;  // 当前选中的版本索引（从0开始）
   status: 'pending' | 'generating_desc' | 'generating_image' | 'completed' | 'error';
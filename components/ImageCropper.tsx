@@ -102,6 +102,7 @@ export default function ImageCropper({ imageUrl, onCropComplete, onCancel }: Ima
               <img
                 ref={imgRef}
                 src={imageUrl}
+                crossOrigin="anonymous"
                 alt="参考图"
                 className="max-w-full h-auto"
               />
@@ -34,3 +34,59 @@ export async function loadTemplates(): Promise<TemplateItem[]> {
     return [];
   }
 }
+
+// 已登记到后端模板库的模板：模板 data URL -> 模板 ID（并发请求共用同一次上传）
+const registeredTemplates = new Map<string, Promise<string | null>>();
+
+/**
+ * 把模板图片登记到后端模板库，返回模板 ID
+ *
+ * 同一模板只上传一次，之后的请求只传 template_id；登记失败时返回 null
+ */
+export function registerTemplate(apiBase: string, templateBase64: string): Promise<string | null> {
+  let pending = registeredTemplates.get(templateBase64);
+  if (!pending) {
+    pending = fetch(`${apiBase}/api/templates`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ template_base64: templateBase64 }),
+    })
+      .then(response => response.json())
+      .then(result => (result.success ? (result.data.template_id as string) : null))
+      .catch(() => null);
+    registeredTemplates.set(templateBase64, pending);
+    // 登记失败不缓存，下次请求重试
+    pending.then(templateId => {
+      if (!templateId) registeredTemplates.delete(templateBase64);
+    });
+  }
+  return pending;
+}
+
+/**
+ * 发送带模板的 JSON 请求：优先传 template_id，模板库不可用或模板已不存在时改传 template_base64
+ */
+export async function postWithTemplate(
+  apiBase: string,
+  path: string,
+  body: Record<string, unknown>,
+  templateBase64?: string | null
+): Promise<Response> {
+  const post = (templateFields: Record<string, unknown>) =>
+    fetch(`${apiBase}${path}`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ ...body, ...templateFields }),
+    });
+
+  if (!templateBase64) return post({});
+
+  const templateId = await registerTemplate(apiBase, templateBase64);
+  if (templateId) {
+    const response = await post({ template_id: templateId });
+    if (response.status !== 404) return response;
+    // 后端模板库中已没有该模板（如数据目录被清理），下次重新登记
+    registeredTemplates.delete(templateBase64);
+  }
+  return post({ template_base64: templateBase64 });
+}